@@ -41,19 +41,198 @@ INSTALLED_APPS = (
     'rememerme.marketplace.rest.phrase_cards',
     'rememerme.marketplace.rest.nomination_cards',
     'rememerme.marketplace.rest.phrase_decks',
-    'rememerme.marketplace.rest.nomination_decks'
+    'rememerme.marketplace.rest.nomination_decks',
+    'rememerme.marketplace.rest.wallet',
+    'rememerme.marketplace.rest.purchases',
+    'rememerme.marketplace.rest.status'
 )
 
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSIONS_CLASSES' : ('rest_framework.permissions.IsAuthenticated', ),
-    'DEFAULT_AUTHENTICATION_CLASSES' : ('rememerme.sessions.auth.RememermeAuthentication', ),
+    'DEFAULT_AUTHENTICATION_CLASSES' : ('rememerme.marketplace.auth.CachedRememermeAuthentication', ),
     'PAGINATE_BY': 10,
     'MAX_PAGINATE_BY': 25
 }
 
 CASSANDRA_NODES = ('134.53.148.102', )
 
+CASSANDRA_KEYSPACE = 'marketplace'
+
+# Sizing of the connection pool kept for each node in CASSANDRA_NODES.
+# STRATEGY is either 'latency' or 'round_robin' and a node that times out
+# is skipped for DOWN_INTERVAL seconds.
+CASSANDRA_POOL = {
+    'POOL_SIZE': 5,
+    'MAX_OVERFLOW': 10,
+    'POOL_TIMEOUT': 3,
+    'TIMEOUT': 0.5,
+    'STRATEGY': 'latency',
+    'DOWN_INTERVAL': 10,
+    'PREWARM': True
+}
+
+# PAGE_SIZE is the number of ledger entries read per request when replaying
+# a wallet and a balance read replaying COMPACT_AFTER entries or more writes
+# a new snapshot.
+WALLET_LEDGER = {
+    'PAGE_SIZE': 500,
+    'COMPACT_AFTER': 200
+}
+
+# A purchase left pending for PENDING_TIMEOUT seconds (e.g. by a worker that
+# died) is picked back up by a retry with the same idempotency key.
+PURCHASES = {
+    'PENDING_TIMEOUT': 30
+}
+
+# How many deck indexes (the card ids of a deck) and game shuffles each
+# process keeps in memory. A deck index is reloaded after INDEX_TTL seconds
+# so cards added through other processes are picked up.
+DEAL = {
+    'INDEX_CACHE_SIZE': 1000,
+    'INDEX_TTL': 300,
+    'SHUFFLE_CACHE_SIZE': 1000
+}
+
+# The serialized deck catalog kept by each process. Writes to decks clear it
+# in the process making them and other processes see them within TTL seconds.
+CATALOG_CACHE = {
+    'MAX_SIZE': 500,
+    'TTL': 60
+}
+
+# Cards are imported in batched mutations of BATCH_SIZE cards, written once
+# BATCH_SIZE rows, valid or not, are read. The first MAX_ERRORS rows skipped
+# in an import are listed in its reports and the rest are only counted.
+CARD_IMPORT = {
+    'BATCH_SIZE': 500,
+    'MAX_ERRORS': 1000,
+    'MAX_TERM_LENGTH': 255,
+    'MAX_DESCRIPTION_LENGTH': 1024
+}
+
+# The number of cards read from Cassandra per page of a streamed card listing
+STREAM_PAGE_SIZE = 200
+
+# Lookups of users in the users service. Misses run on a pool of THREADS
+# threads. Users that exist are cached for TTL seconds and users that don't
+# for NEGATIVE_TTL seconds.
+USER_LOOKUP = {
+    'THREADS': 10,
+    'TTL': 60,
+    'NEGATIVE_TTL': 5,
+    'CACHE_SIZE': 10000
+}
+
+# Rows written together by a request are sent in batches of at most
+# MAX_ROWS rows and MAX_BYTES bytes. ATOMIC batches go through Cassandra's
+# batch log so they are applied all or nothing.
+UNIT_OF_WORK = {
+    'MAX_ROWS': 100,
+    'MAX_BYTES': 262144,
+    'ATOMIC': True
+}
+
+# Sessions validated with the sessions service are trusted by each process
+# for TTL seconds, so a revoked session can be used for at most that long.
+SESSION_CACHE = {
+    'MAX_SIZE': 10000,
+    'TTL': 30
+}
+
+# What a worker loads before its first request. With LAZY set the URL confs
+# of LAZY_URLCONFS are only loaded by the first request routed to them. The
+# WSGI app should be ready within TARGET_SECONDS of a worker starting.
+STARTUP = {
+    'LAZY': True,
+    'LAZY_URLCONFS': ('rememerme.marketplace.rest.status.urls', ),
+    'TARGET_SECONDS': 2.0
+}
+
+# Deck search. Each process indexes the whole catalog, reading it in pages
+# of BUILD_PAGE_SIZE, and rebuilds its index every REFRESH_SECONDS to pick up
+# the writes of other processes. A word of a query matches at most
+# MAX_PREFIX_WORDS indexed words it is the start of. FIELD_WEIGHTS is how
+# much a match in each part of a deck counts and matches are counted in the
+# price ranges starting at each of PRICE_BUCKETS.
+DECK_SEARCH = {
+    'BUILD_AT_STARTUP': True,
+    'BUILD_PAGE_SIZE': 500,
+    'REFRESH_SECONDS': 300,
+    'MAX_PREFIX_WORDS': 50,
+    'FIELD_WEIGHTS': { 'title': 3.0, 'tags': 2.0, 'description': 1.0, 'cards': 0.5 },
+    'PRICE_BUCKETS': (0, 1, 5, 10, 25)
+}
+
+# The decks and purchases read at a time when the deck statistics are recounted
+DECK_STATS = {
+    'REPAIR_PAGE_SIZE': 500
+}
+
+# The best selling decks. Each window is the sales of its last number of
+# hours, so 'today' is the last 24 hours, or of all time for None. The
+# TOP_K decks of each window are ranked in memory and every process reloads
+# the sales counted by the others every REFRESH_SECONDS.
+LEADERBOARD = {
+    'LOAD_AT_STARTUP': True,
+    'TOP_K': 100,
+    'REFRESH_SECONDS': 60,
+    'WINDOWS': { 'today': 24, 'week': 168, 'all': None }
+}
+
+# Streamed purchase exports read PAGE_SIZE purchases at a time. ADMINS are
+# the users (support and finance) allowed to export any user's purchases.
+PURCHASE_EXPORT = {
+    'PAGE_SIZE': 500,
+    'ADMINS': ()
+}
+
+# The decks each user paid for, cached by each process for TTL seconds. A
+# deck missing from a set older than RECHECK_SECONDS is looked for again in
+# the user's entitlements row, which is read up to MAX_DECKS columns.
+ENTITLEMENTS = {
+    'MAX_SIZE': 10000,
+    'TTL': 300,
+    'RECHECK_SECONDS': 5,
+    'MAX_DECKS': 100000
+}
+
+# Rate limits of the routes given limit() in config.urls. The buckets of
+# every worker are kept in the file at PATH, shared memory on Linux, holding
+# up to SLOTS buckets. Without a PATH each process keeps its own.
+RATE_LIMIT = {
+    'ENABLED': True,
+    'PATH': '/dev/shm/marketplace-ratelimit' if os.path.isdir('/dev/shm') else None,
+    'SLOTS': 65536
+}
+
+# The membership indexes of a user or game are taken to hold all of its
+# memberships for INDEX_TTL seconds after they were built. The games service
+# adds and changes members without going through the marketplace, so it can
+# take that long for the indexes to catch up.
+MEMBERSHIPS = {
+    'INDEX_TTL': 300
+}
+
+# The tests that assert on wall-clock time only run when ENABLED, as their
+# timings only mean something on a quiet machine: BENCHMARKS=1 manage.py test
+BENCHMARKS = {
+    'ENABLED': os.environ.get('BENCHMARKS') == '1'
+}
+
+# Users allowed to import cards into decks
+CONTENT_ADMINS = ()
+
+# Hosts allowed to read the /rest/v1/status monitoring endpoints
+MONITORING_HOSTS = ('127.0.0.1', )
+
+# The most keys sent to Cassandra in a single multiget request
+CASSANDRA_MULTIGET_CHUNK_SIZE = 100
+
 MIDDLEWARE_CLASSES = (
+    'rememerme.marketplace.metrics.MetricsMiddleware',
+    'rememerme.marketplace.identity.IdentityMapMiddleware',
+    'rememerme.marketplace.ratelimit.RateLimitMiddleware',
     #'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
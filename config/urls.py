@@ -1,10 +1,17 @@
 from django.conf.urls import patterns, include, url
+from rememerme.marketplace.rest.phrase_decks.views import DeckSearchView, TopDecksView
+from rememerme.marketplace.ratelimit import limit
 
 urlpatterns = patterns('',
-    url(r'^rest/v1/phrase_decks/(?P<game_id>[-\w]+)/cards', include('rememerme.markeplace.rest.phrase_cards.urls')),
-    url(r'^rest/v1/nomination_decks/(?P<game_id>[-\w]+)/cards', include('rememerme.games.rest.nomination_cards.urls')),
-    url(r'^rest/v1/phrase_decks', include('rememerme.markeplace.rest.phrase_decks.urls')),
+    url(r'^rest/v1/phrase_decks/(?P<deck_id>[-\w]+)/cards', include('rememerme.marketplace.rest.phrase_cards.urls')),
+    url(r'^rest/v1/nomination_decks/(?P<deck_id>[-\w]+)/cards', include('rememerme.marketplace.rest.nomination_cards.urls')),
+    url(r'^rest/v1/decks/search/?$', DeckSearchView.as_view(deck_type=None)),
+    url(r'^rest/v1/decks/top/?$', TopDecksView.as_view()),
+    url(r'^rest/v1/phrase_decks', include('rememerme.marketplace.rest.phrase_decks.urls')),
     url(r'^rest/v1/nomination_decks', include('rememerme.marketplace.rest.nomination_decks.urls')),
-    url(r'^rest/v1/account/purchases', include('rememerme.markeplace.rest.purchases.urls')),
-    url(r'^rest/v1/account/wallet', include('rememerme.marketplace.rest.wallet.urls'))
+    url(r'^rest/v1/account/purchases', include('rememerme.marketplace.rest.purchases.urls'),
+        limit('purchases', user='30/m', ip='120/m')),
+    url(r'^rest/v1/account/wallet', include('rememerme.marketplace.rest.wallet.urls'),
+        limit('wallet', user='60/m', ip='240/m')),
+    url(r'^rest/v1/status', include('rememerme.marketplace.rest.status.urls'))
 )
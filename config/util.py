@@ -8,6 +8,9 @@
 '''
 
 from django.conf import settings
+from rest_framework.response import Response
+import base64
+import json
 
 '''
     Gets the correct value for the offset and limit based on the application
@@ -24,4 +27,50 @@ def getLimit(request):
         maxLimit = settings.REST_FRAMEWORK['MAX_PAGINATE_BY']
         limit = maxLimit if request['limit'] > maxLimit else request['limit']
     
-    return limit
\ No newline at end of file
+    return limit
+
+'''
+    Encodes the position a page of a listing ended on as an opaque
+    continuation token for the client to send back.
+    
+    @param position: The last column (or row key) of the page
+'''
+def encodeCursor(position):
+    return base64.urlsafe_b64encode(json.dumps(position).encode('utf-8')).decode('ascii').rstrip('=')
+
+'''
+    Decodes a continuation token made by encodeCursor.
+    
+    @param token: The token sent by the client
+    @raise ValueError: The token was not made by encodeCursor
+'''
+def decodeCursor(token):
+    try:
+        # a token with characters outside of ASCII can't be one of ours
+        token = str(token)
+        return json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode('utf-8'))
+    except (TypeError, ValueError, UnicodeError):
+        raise ValueError('Invalid cursor %r' % token)
+
+'''
+    Gets the position to continue a listing from, or None for the first page.
+    
+    @param request: The request being made to the server
+'''
+def getCursor(request):
+    if 'cursor' in request and request['cursor']:
+        return decodeCursor(request['cursor'])
+    return None
+
+'''
+    Builds the response of one page of a listing. The token for the next
+    page is sent in the X-Next-Cursor header so the body stays a list.
+    
+    @param data: The serialized page
+    @param cursor: The position the page ended on, None on the last page
+'''
+def pagedResponse(data, cursor):
+    response = Response(data)
+    if cursor is not None:
+        response['X-Next-Cursor'] = encodeCursor(cursor)
+    return response
@@ -19,7 +19,18 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
 
 # Activate teh users-env virtual env
 activate_env=os.path.expanduser("/virtualenv/markeplace-api-env/bin/activate_this.py")
-execfile(activate_env, dict(__file__=activate_env))
+if os.path.exists(activate_env):
+    execfile(activate_env, dict(__file__=activate_env))
 
 from django.core.wsgi import get_wsgi_application
 application = get_wsgi_application()
+
+# Load the middleware and the routes every worker serves before the first request
+from rememerme.marketplace import startup
+startup.warm(application)
+
+# Open the Cassandra connections before the first request comes in
+from django.conf import settings
+if settings.CASSANDRA_POOL['PREWARM']:
+    from rememerme.marketplace import pool
+    pool.prewarm()
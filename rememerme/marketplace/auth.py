@@ -0,0 +1,65 @@
+'''
+    Authentication with a process local cache of validated sessions.
+
+    RememermeAuthentication checks the session with the sessions service on
+    every request. CachedRememermeAuthentication remembers each session it
+    has validated for settings.SESSION_CACHE['TTL'] seconds, so a client
+    browsing the catalog pays for the check once per TTL. A revoked session
+    is honored by every process within TTL, or at once in the process that
+    calls revoke or revokeUser.
+
+    @author: Andrew Oberlin, Jake Gregg
+'''
+from django.conf import settings
+from rememerme.marketplace.cache import LRUCache
+from rememerme.sessions.auth import RememermeAuthentication
+
+sessions = LRUCache(settings.SESSION_CACHE['MAX_SIZE'], settings.SESSION_CACHE['TTL'])
+
+'''
+    Gets the credential a request authenticates with, if it sent one.
+'''
+def sessionKey(request):
+    return request.META.get('HTTP_AUTHORIZATION') or None
+
+'''
+    Forgets a validated session so its next request is checked again.
+
+    @param key: The credential of the session
+'''
+def revoke(key):
+    sessions.delete(key)
+
+'''
+    Forgets every validated session of a user, e.g. when they log out everywhere.
+'''
+def revokeUser(user_id):
+    user_id = str(user_id)
+    sessions.purge(lambda key, result: str(result[0].pk) == user_id)
+
+'''
+    Gets the hits, misses and size of the session cache.
+'''
+def stats():
+    return sessions.stats()
+
+class CachedRememermeAuthentication(RememermeAuthentication):
+    '''
+        RememermeAuthentication that only checks each session once per TTL.
+        Failed checks are never cached.
+    '''
+    
+    def authenticate(self, request):
+        key = sessionKey(request)
+        if key is None:
+            return self.validate(request)
+        
+        result = sessions.get(key)
+        if result is None:
+            result = self.validate(request)
+            if result is not None:
+                sessions.set(key, result)
+        return result
+    
+    def validate(self, request):
+        return super(CachedRememermeAuthentication, self).authenticate(request)
@@ -0,0 +1,52 @@
+'''
+    Small timing helpers shared by the benchmarks in the app tests.
+
+    @author: Andrew Oberlin, Jake Gregg
+'''
+from django.conf import settings
+import time
+import unittest
+
+'''
+    Skips a test or test case that asserts on wall-clock time unless
+    BENCHMARKS['ENABLED'] is set.
+'''
+def benchmark(test):
+    return unittest.skipUnless(settings.BENCHMARKS['ENABLED'], 'set BENCHMARKS=1 to run the benchmarks')(test)
+
+'''
+    Gets the value at the given percentile of the samples.
+
+    @param samples: The measured values
+    @param pct: The percentile from 0 to 100
+'''
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = int(round((pct / 100.0) * (len(ordered) - 1)))
+    return ordered[index]
+
+'''
+    Runs fn the given number of times and reports the latency in milliseconds.
+
+    @param fn: The callable being measured
+    @param iterations: How many times to call it
+    @return: A map with the mean, p50 and p99 latency and the throughput
+'''
+def measure(fn, iterations=50):
+    samples = []
+    start = time.time()
+    for _ in range(iterations):
+        began = time.time()
+        fn()
+        samples.append((time.time() - began) * 1000.0)
+    elapsed = time.time() - start
+    
+    return {
+        'iterations' : iterations,
+        'mean_ms' : sum(samples) / len(samples),
+        'p50_ms' : percentile(samples, 50),
+        'p99_ms' : percentile(samples, 99),
+        'per_second' : iterations / elapsed if elapsed else 0.0
+    }
@@ -0,0 +1,186 @@
+'''
+    Process local caches.
+
+    @author: Andrew Oberlin, Jake Gregg
+'''
+from django.conf import settings
+from django.utils.http import http_date, parse_http_date_safe
+from rest_framework.response import Response
+from config.util import encodeCursor
+from collections import OrderedDict
+import calendar
+import datetime
+import hashlib
+import json
+import threading
+import time
+
+class LRUCache(object):
+    '''
+        A thread safe least recently used cache whose entries optionally
+        expire ttl seconds after they were set.
+    '''
+    
+    def __init__(self, max_size, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None or (entry[1] is not None and entry[1] < time.time()):
+                self.misses += 1
+                return default
+            # put it back as the most recently used
+            self.entries[key] = entry
+            self.hits += 1
+            return entry[0]
+    
+    def peek(self, key, default=None):
+        '''
+            Gets an entry without counting the lookup or refreshing its use.
+        '''
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is None or (entry[1] is not None and entry[1] < time.time()):
+            return default
+        return entry[0]
+    
+    def set(self, key, value):
+        expires = time.time() + self.ttl if self.ttl else None
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (value, expires)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+    
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+    
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+    
+    def purge(self, matches):
+        '''
+            Deletes every entry for which matches(key, value) is true.
+        '''
+        with self.lock:
+            for key, entry in list(self.entries.items()):
+                if matches(key, entry[0]):
+                    del self.entries[key]
+    
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size' : len(self.entries),
+            'hits' : self.hits,
+            'misses' : self.misses,
+            'hit_ratio' : float(self.hits) / lookups if lookups else 0.0
+        }
+
+'''
+    Gets the time in seconds since the epoch of a datetime or of the ISO
+    string it was stored as.
+'''
+def toTimestamp(value):
+    if not value:
+        return None
+    if not hasattr(value, 'timetuple'):
+        value = datetime.datetime.strptime(str(value)[:19], '%Y-%m-%dT%H:%M:%S')
+    return calendar.timegm(value.timetuple())
+
+class CatalogEntry(object):
+    '''
+        A serialized catalog response with the validators clients revalidate it with.
+    '''
+    
+    def __init__(self, data, last_modified=None, cursor=None):
+        self.data = data
+        self.cursor = cursor
+        body = json.dumps(data, sort_keys=True, default=str)
+        self.size = len(body)
+        self.etag = '"%s"' % hashlib.sha1(body.encode('utf-8')).hexdigest()
+        self.last_modified = last_modified
+
+class CatalogCache(object):
+    '''
+        Read-through cache of the serialized deck catalog. Every deck write
+        moves the cache to a new generation so nothing cached before it is
+        served again by this process; other processes drop it within ttl.
+    '''
+    
+    def __init__(self, max_size, ttl):
+        self.entries = LRUCache(max_size, ttl)
+        self.generation = 0
+        self.not_modified = 0
+        self.bytes_saved = 0
+        self.lock = threading.Lock()
+    
+    def fetch(self, key, build):
+        '''
+            Gets the entry for key, building it on a miss.
+            
+            @param build: Called on a miss, returns the CatalogEntry to cache
+        '''
+        key = (self.generation, key)
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = build()
+            self.entries.set(key, entry)
+        return entry
+    
+    def invalidate(self):
+        with self.lock:
+            self.generation += 1
+        self.entries.clear()
+    
+    def recordNotModified(self, entry):
+        with self.lock:
+            self.not_modified += 1
+            self.bytes_saved += entry.size
+    
+    def stats(self):
+        stats = self.entries.stats()
+        stats.update({
+            'generation' : self.generation,
+            'not_modified' : self.not_modified,
+            'bytes_saved' : self.bytes_saved
+        })
+        return stats
+
+catalog = CatalogCache(settings.CATALOG_CACHE['MAX_SIZE'], settings.CATALOG_CACHE['TTL'])
+
+'''
+    Builds the response for a catalog entry, answering 304 Not Modified when
+    the client's If-None-Match or If-Modified-Since shows it already has it.
+    
+    @param request: The request being made to the server
+    @param entry: The CatalogEntry being served
+'''
+def cachedResponse(request, entry):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    
+    if if_none_match:
+        not_modified = entry.etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*'
+    else:
+        not_modified = bool(if_modified_since and entry.last_modified and entry.last_modified <= if_modified_since)
+    
+    if not_modified:
+        catalog.recordNotModified(entry)
+        response = Response(status=304)
+    else:
+        response = Response(entry.data)
+        if entry.cursor is not None:
+            response['X-Next-Cursor'] = encodeCursor(entry.cursor)
+    
+    response['ETag'] = entry.etag
+    if entry.last_modified:
+        response['Last-Modified'] = http_date(entry.last_modified)
+    return response
@@ -0,0 +1,118 @@
+'''
+    Dealing phrase cards to the rounds of a game.
+
+    The card ids of a deck are held in memory as one packed string of
+    16 byte UUIDs, so a random card is an index into it. Each game deals
+    from its own shuffle of the deck: the game_deals row only stores the
+    seed of the shuffle and how far into it the game is, and the shuffle
+    itself is rebuilt from the seed once per process.
+
+    game_deals: game_id -> { 'deck_id', 'seed', 'version', 'position' }
+
+    @author: Andrew Oberlin, Jake Gregg
+'''
+from django.conf import settings
+from pycassa.cassandra.ttypes import NotFoundException as CassaNotFoundException
+from rememerme.marketplace import pool
+from rememerme.marketplace.cache import LRUCache
+from array import array
+import random
+import uuid
+import zlib
+
+_indexes = LRUCache(settings.DEAL['INDEX_CACHE_SIZE'], settings.DEAL['INDEX_TTL'])
+_shuffles = LRUCache(settings.DEAL['SHUFFLE_CACHE_SIZE'])
+
+class DeckIndex(object):
+    '''
+        The card ids of a deck packed into a string.
+    '''
+    
+    def __init__(self, deck_id, card_ids):
+        self.deck_id = str(deck_id)
+        self.cards = b''.join(uuid.UUID(card_id).bytes for card_id in card_ids)
+        self.size = len(self.cards) // 16
+        # identifies the contents so a game notices when its deck changed
+        self.version = zlib.crc32(self.cards) & 0xffffffff
+    
+    def card(self, i):
+        return str(uuid.UUID(bytes=self.cards[i * 16:(i + 1) * 16]))
+    
+    def random(self):
+        return self.card(random.randrange(self.size)) if self.size else None
+
+'''
+    Gets the index of the cards in a deck, loading it on first use.
+'''
+def getDeckIndex(deck_id):
+    deck_id = str(deck_id)
+    index = _indexes.get(deck_id)
+    if index is None:
+        cards = pool.columnFamily('deck_cards')
+        try:
+            card_ids = [card_id for card_id, _ in cards.xget(deck_id)]
+        except CassaNotFoundException:
+            card_ids = []
+        index = DeckIndex(deck_id, card_ids)
+        _indexes.set(deck_id, index)
+    return index
+
+'''
+    Drops the index of a deck from this process after its cards changed.
+'''
+def invalidate(deck_id):
+    _indexes.delete(str(deck_id))
+
+'''
+    Gets the shuffle of a deck made from the given seed: a permutation of the
+    positions in the deck index. The same seed gives the same shuffle in every
+    process.
+'''
+def getShuffle(index, seed):
+    key = (index.deck_id, index.version, seed)
+    order = _shuffles.get(key)
+    if order is None:
+        order = array('I', range(index.size))
+        random.Random(seed).shuffle(order)
+        _shuffles.set(key, order)
+    return order
+
+'''
+    Starts a new shuffle of the deck for the game and deals its first card.
+
+    @return: The id of the phrase card, or None if the deck has no indexed cards
+'''
+def start(game_id, deck_id):
+    index = getDeckIndex(deck_id)
+    if not index.size:
+        return None
+    
+    seed = random.getrandbits(32)
+    deals = pool.columnFamily('game_deals')
+    deals.insert(str(game_id), { 'deck_id' : index.deck_id, 'seed' : str(seed),
+                                 'version' : str(index.version), 'position' : '1' })
+    return index.card(getShuffle(index, seed)[0])
+
+'''
+    Deals the next card of the game's shuffle. Every card of the deck is
+    dealt once before the deck is shuffled again.
+
+    @return: The id of the phrase card, or None if the deck has no indexed cards
+'''
+def draw(game_id, deck_id):
+    index = getDeckIndex(deck_id)
+    if not index.size:
+        return None
+    
+    deals = pool.columnFamily('game_deals')
+    try:
+        deal = deals.get(str(game_id))
+    except CassaNotFoundException:
+        return start(game_id, deck_id)
+    
+    position = int(deal['position'])
+    if deal['deck_id'] != index.deck_id or int(deal['version']) != index.version or position >= index.size:
+        return start(game_id, deck_id)
+    
+    deals.insert(str(game_id), { 'position' : str(position + 1) })
+    return index.card(getShuffle(index, int(deal['seed']))[position])
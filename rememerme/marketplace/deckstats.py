@@ -0,0 +1,157 @@
+'''
+    Statistics of each deck kept in counter columns.
+
+    deck_stats: deck_id -> { 'cards' : count, 'purchases' : count, 'plays' : count }
+    deck_plays: deck_id -> { game_id : date the game started with the deck }
+
+    The counters move with the writes they count: cards as they are added
+    to or removed from a deck, purchases when one commits and plays when a
+    game starts with the deck. A counter only moves once the rows it counts
+    are written. Cassandra counters aren't idempotent, so a write that fails
+    halfway can leave a counter off by one; repair recounts every deck from
+    the rows the counters stand for and corrects any drift. A write that
+    lands between its rows and its counter while repair runs can still be
+    mistaken for drift, so repair is best run when the decks are quiet.
+
+    @author: Andrew Oberlin, Jake Gregg
+'''
+from pycassa.cassandra.ttypes import NotFoundException as CassaNotFoundException
+from rememerme.marketplace import pool
+from rememerme.marketplace.unitofwork import afterWrite
+import datetime
+import json
+
+CARDS = 'cards'
+PURCHASES = 'purchases'
+PLAYS = 'plays'
+
+COUNTERS = (CARDS, PURCHASES, PLAYS)
+
+'''
+    Gets the deck_stats counter column family.
+'''
+def counters():
+    return pool.columnFamily('deck_stats')
+
+'''
+    Gets the deck_plays column family.
+'''
+def plays():
+    return pool.columnFamily('deck_plays')
+
+'''
+    Adds to a counter of a deck once the rows being written are.
+
+    @param counter: One of COUNTERS
+    @param amount: How much to add, negative to take away
+'''
+def increment(deck_id, counter, amount=1):
+    if amount:
+        afterWrite(lambda: counters().add(str(deck_id), counter, amount))
+
+'''
+    Records that a game started with a deck. The game is added with a
+    compare-and-set so a retried start only counts it once.
+'''
+def recordPlay(deck_id, game_id):
+    applied, _ = plays().cas(str(deck_id), { str(game_id) : None },
+                             { str(game_id) : datetime.datetime.now().isoformat() })
+    if applied:
+        increment(deck_id, PLAYS)
+
+'''
+    Gets the statistics of decks with a single read.
+
+    @return: Map of deck id to the map of each counter's value
+'''
+def statsFor(deck_ids):
+    deck_ids = [str(deck_id) for deck_id in deck_ids]
+    rows = counters().multiget(deck_ids) if deck_ids else {}
+    return dict((deck_id, dict((counter, int(rows.get(deck_id, {}).get(counter, 0))) for counter in COUNTERS))
+                for deck_id in deck_ids)
+
+'''
+    Counts the rows each counter of a deck stands for.
+
+    @param purchases: Map of deck id to the number of purchases of it
+    @return: Map of each counter to its true value
+'''
+def recount(deck_id, purchases):
+    from rememerme.marketplace.models import DeckCard
+    deck_id = str(deck_id)
+
+    def count(table):
+        try:
+            return table.get_count(deck_id)
+        except CassaNotFoundException:
+            return 0
+
+    return { CARDS : count(DeckCard.table), PURCHASES : purchases.get(deck_id, 0), PLAYS : count(plays()) }
+
+'''
+    Counts the purchases of every deck with one pass over the purchases.
+
+    @return: Map of deck id to the number of purchases of it
+'''
+def countPurchases(page_size):
+    from rememerme.marketplace.models import Purchase
+    found = {}
+    for _, columns in Purchase.table.get_range(columns=['deck_id'], buffer_size=page_size):
+        if 'deck_id' in columns:
+            deck_id = str(json.loads(columns['deck_id']))
+            found[deck_id] = found.get(deck_id, 0) + 1
+    return found
+
+'''
+    Recounts the statistics of every deck and corrects the counters that
+    drifted.
+
+    The counters are read before anything is recounted and again right
+    before each is corrected. One that moved in between was written to
+    while it was recounted, so its recount can't be trusted and it is
+    skipped rather than corrected; running repair again picks it up.
+
+    @param page_size: The decks and purchases read at a time
+    @param fix: Whether to correct the counters or only report the drift
+    @return: A report of the decks checked, every counter that drifted and
+        how many were skipped
+'''
+def repair(page_size, fix=True):
+    from rememerme.marketplace.models import Deck
+    from rememerme.marketplace.search import CARD_MODELS
+
+    deck_ids = []
+    for deck_type in CARD_MODELS:
+        cursor = None
+        while True:
+            decks, cursor = Deck.filterByType(deck_type, page_size, cursor)
+            deck_ids.extend(deck.deck_id for deck in decks)
+            if cursor is None:
+                break
+    pages = [deck_ids[i:i + page_size] for i in range(0, len(deck_ids), page_size)]
+
+    before = {}
+    for page in pages:
+        before.update(statsFor(page))
+    purchases = countPurchases(page_size)
+
+    drift = []
+    skipped = 0
+    for page in pages:
+        actual = dict((deck_id, recount(deck_id, purchases)) for deck_id in page)
+        stored = statsFor(page)
+        for deck_id in page:
+            for counter in COUNTERS:
+                difference = actual[deck_id][counter] - stored[deck_id][counter]
+                if not difference:
+                    continue
+                if stored[deck_id][counter] != before[deck_id][counter]:
+                    skipped += 1
+                    continue
+                drift.append({ 'deck_id' : deck_id, 'counter' : counter,
+                               'stored' : stored[deck_id][counter], 'actual' : actual[deck_id][counter] })
+                if fix:
+                    # a counter can only be added to, so it is moved by the drift
+                    counters().add(deck_id, counter, difference)
+
+    return { 'decks' : len(deck_ids), 'drifted' : len(drift), 'skipped' : skipped, 'fixed' : fix, 'drift' : drift }
@@ -0,0 +1,112 @@
+'''
+    Which decks each user owns, answered from memory.
+
+    The entitlements row of a user holds a claim for every deck they bought
+    or are buying (see purchasing). Each process caches the decks a user has
+    paid for as a frozenset of the 16 bytes of each deck id, so checking a
+    deck is one set lookup. The purchase pipeline adds a deck to the cached
+    set once its purchase commits. A user who bought a deck through another
+    process is picked up when the cached set expires after TTL seconds, or
+    sooner by reloading the row when a deck isn't found in a set older than
+    RECHECK_SECONDS.
+
+    Free decks and decks the marketplace doesn't sell can be played by
+    anyone.
+
+    @author: Andrew Oberlin, Jake Gregg
+'''
+from django.conf import settings
+from pycassa.cassandra.ttypes import NotFoundException as CassaNotFoundException
+from rememerme.marketplace import pool
+from rememerme.marketplace.cache import LRUCache
+from rememerme.marketplace.unitofwork import afterWrite
+import json
+import threading
+import time
+import uuid
+
+# claims whose funds were taken
+PAID = frozenset(('granted', 'committed'))
+
+owned = LRUCache(settings.ENTITLEMENTS['MAX_SIZE'], settings.ENTITLEMENTS['TTL'])
+_granting = threading.Lock()
+
+'''
+    Encodes a deck id as the 16 bytes it is kept as.
+'''
+def encode(deck_id):
+    try:
+        return uuid.UUID(str(deck_id)).bytes
+    except ValueError:
+        return str(deck_id)
+
+'''
+    Reads the decks a user paid for from their entitlements row.
+
+    @return: A tuple of the frozenset of encoded deck ids and when it was read
+'''
+def load(user_id):
+    try:
+        row = pool.columnFamily('entitlements').get(str(user_id), column_count=settings.ENTITLEMENTS['MAX_DECKS'])
+    except CassaNotFoundException:
+        row = {}
+    decks = frozenset(encode(deck_id) for deck_id, claim in row.items() if json.loads(claim)['status'] in PAID)
+    entry = (decks, time.time())
+    owned.set(str(user_id), entry)
+    return entry
+
+'''
+    Gets whether a user paid for a deck.
+'''
+def owns(user_id, deck_id):
+    user_id, deck_id = str(user_id), encode(deck_id)
+    entry = owned.get(user_id)
+    if entry is None:
+        entry = load(user_id)
+    if deck_id in entry[0]:
+        return True
+    if time.time() - entry[1] < settings.ENTITLEMENTS['RECHECK_SECONDS']:
+        return False
+    # the deck may have been bought through another process
+    return deck_id in load(user_id)[0]
+
+'''
+    Gets the price of a deck, from the search index when it has the deck.
+
+    @return: The price, or None for a deck the marketplace doesn't sell
+'''
+def priceOf(deck_id):
+    from rememerme.marketplace import search
+    from rememerme.marketplace.models import Deck
+    indexed = search.index.decks.get(str(deck_id))
+    if indexed is not None and indexed.data is not None:
+        return indexed.price
+    try:
+        return Deck.getByID(deck_id).price or 0
+    except CassaNotFoundException:
+        return None
+
+'''
+    Gets whether a user may play with a deck: they own it or it is free.
+'''
+def canPlay(user_id, deck_id):
+    if owns(user_id, deck_id):
+        return True
+    return not priceOf(deck_id)
+
+'''
+    Adds a deck to the cached set of a user once the purchase is written.
+'''
+def grant(user_id, deck_id):
+    user_id = str(user_id)
+
+    def granted():
+        # a cached set is replaced rather than changed, so a check never sees one half updated
+        with _granting:
+            entry = owned.get(user_id)
+            if entry is not None:
+                owned.set(user_id, (entry[0] | frozenset((encode(deck_id), )), entry[1]))
+    afterWrite(granted)
+
+def stats():
+    return owned.stats()
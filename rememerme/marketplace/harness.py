@@ -0,0 +1,329 @@
+'''
+    Benchmarks every route in config.urls through the Django test client.
+
+    Cassandra, the models of the games and cards packages and the users
+    service are replaced by the in-memory stand-ins of
+    rememerme.marketplace.testing, seeded with a configurable amount of
+    data. Each scenario is run at the requested concurrency and the
+    throughput, latency percentiles and datastore calls per request are
+    written out as a JSON report that can be compared between versions.
+
+    @author: Andrew Oberlin, Jake Gregg
+'''
+from django.conf import settings
+from django.core.urlresolvers import get_resolver, RegexURLResolver
+from django.test.client import Client
+from rest_framework.authentication import BaseAuthentication
+from rest_framework.views import APIView
+from rememerme.marketplace import identity, pool, users
+from rememerme.marketplace.bench import percentile
+from rememerme.marketplace.importer import CardImporter
+from rememerme.marketplace.ledger import Ledger
+from rememerme.marketplace.models import Deck
+from rememerme.marketplace.purchasing import PurchasePipeline
+from rememerme.marketplace.testing import MemoryManager, memory_model
+import datetime
+import itertools
+import json
+import re
+import sys
+import threading
+import time
+import uuid
+
+# the models of the other rememerme packages and how to fake them:
+# module -> (class name, row key, filter methods)
+FAKE_MODELS = {
+    'rememerme.games.models' : (
+        ('Game', 'game_id', {}),
+        ('GameMember', 'game_member_id', { 'filterByGame' : 'game_id', 'filterByUser' : 'user_id' }),
+        ('Round', 'round_id', { 'filterByGame' : 'game_id' }),
+        ('Nomination', 'nomination_id', { 'filterByRound' : 'round_id' })
+    ),
+    'rememerme.cards.models' : (
+        ('PhraseCard', 'phrase_card_id', {}),
+        ('NominationCard', 'nomination_card_id', {})
+    )
+}
+
+# the header naming the user a benchmark request is made as
+USER_HEADER = 'HTTP_X_BENCH_USER'
+
+class BenchUser(object):
+
+    def __init__(self, pk):
+        self.pk = pk
+
+    def is_authenticated(self):
+        return True
+
+class BenchAuthentication(BaseAuthentication):
+    '''
+        Takes the user from the X-Bench-User header instead of a session.
+    '''
+
+    def authenticate(self, request):
+        user_id = request.META.get(USER_HEADER)
+        return (BenchUser(user_id), None) if user_id else None
+
+class BenchUserClient(object):
+    '''
+        A users service that knows every user.
+    '''
+
+    def __init__(self, auth):
+        pass
+
+    def get(self, user_id):
+        return { 'user_id' : user_id }
+
+'''
+    Replaces an attribute, remembering what it was so restoreFakes can put it back.
+'''
+def replace(patched, owner, attr, value):
+    # read from the dict so a method goes back as the plain function it was
+    patched.append((owner, attr, vars(owner)[attr]))
+    setattr(owner, attr, value)
+
+'''
+    Swaps the models of the games and cards packages for in-memory ones in
+    every loaded rememerme module that imported them, along with Cassandra,
+    the users service and authentication.
+
+    @return: A tuple of the map of class name to the in-memory model and
+        what was replaced, for restoreFakes
+'''
+def installFakes(latency):
+    fakes = {}
+    patched = []
+    for module_name, models in FAKE_MODELS.items():
+        __import__(module_name)
+        module = sys.modules[module_name]
+        for name, key, filters in models:
+            real = getattr(module, name)
+            fakes[name] = memory_model(name, key, latency, filters)
+            if name in identity.TRACKED_MODELS.get(module_name, {}):
+                identity.track(fakes[name], *identity.TRACKED_MODELS[module_name][name])
+            for loaded in list(sys.modules.values()):
+                if loaded is None or not loaded.__name__.startswith('rememerme.'):
+                    continue
+                for attr, value in list(vars(loaded).items()):
+                    if value is real:
+                        replace(patched, loaded, attr, fakes[name])
+
+    replace(patched, pool, '_manager', MemoryManager(latency))
+    replace(patched, users, 'UserClient', BenchUserClient)
+    users.found.clear()
+    users.missing.clear()
+
+    def get_authenticators(self):
+        # the monitoring views don't authenticate at all
+        if self.authentication_classes == ():
+            return []
+        return [BenchAuthentication()]
+    replace(patched, APIView, 'get_authenticators', get_authenticators)
+    return fakes, patched
+
+'''
+    Puts back everything installFakes replaced, newest first.
+'''
+def restoreFakes(patched):
+    for owner, attr, original in reversed(patched):
+        setattr(owner, attr, original)
+    # the fake users service found everyone
+    users.found.clear()
+    users.missing.clear()
+
+'''
+    Fills the stand-ins with decks, cards, wallets, purchases and games.
+
+    @return: The ids used to fill in the routes, by URL argument name
+'''
+def seed(fakes, decks, cards, games, admin_id, user_id):
+    ids = { 'user_id' : user_id }
+    ledger = Ledger()
+    ledger.credit(user_id, 10 ** 9, 'bench')
+
+    for deck_type, model in (('phrase', fakes['PhraseCard']), ('nomination', fakes['NominationCard'])):
+        for i in range(decks):
+            deck = Deck(deck_type=deck_type, title='%s deck %d' % (deck_type, i),
+                        description='A deck for benchmarking', tags=['bench'], price=1)
+            deck.save()
+            rows = ((n, { 'term' : '%s card %d' % (deck_type, n) }) for n in range(cards))
+            CardImporter(model, deck.deck_id).run(rows)
+            ids.setdefault('%s_deck_id' % deck_type, deck.deck_id)
+    ids['deck_id'] = ids['phrase_deck_id']
+    ids['purchase_id'] = PurchasePipeline().submit(user_id, ids['deck_id']).purchase_id
+
+    now = datetime.datetime.now()
+    for i in range(games):
+        game = fakes['Game'](game_id=str(uuid.uuid1()), leader_id=user_id, winning_score=10,
+                             deck=ids['phrase_deck_id'], current_round_id=None, date_created=now,
+                             last_modified=now)
+        game.save()
+        for member_id in (user_id, admin_id):
+            fakes['GameMember'](game_member_id=str(uuid.uuid1()), game_id=game.game_id, user_id=member_id,
+                                status=2, score=0, date_created=now, last_modified=now).save()
+        ids.setdefault('game_id', game.game_id)
+    return ids
+
+'''
+    Lists every route of the resolver as its joined pattern.
+'''
+def routes(resolver=None, prefix=''):
+    resolver = resolver or get_resolver(None)
+    for pattern in resolver.url_patterns:
+        joined = prefix + pattern.regex.pattern.strip('^$')
+        if isinstance(pattern, RegexURLResolver):
+            for route in routes(pattern, joined):
+                yield route
+        else:
+            yield joined
+
+'''
+    Turns a route pattern into a path using the seeded ids.
+'''
+def routePath(route, ids):
+    path = re.sub(r'\(\?P<(\w+)>[^)]*\)', lambda match: ids.get(match.group(1), str(uuid.uuid1())), route)
+    return '/' + path.replace('/?', '')
+
+'''
+    Gets the scenarios to run: a GET of every route plus the writes that
+    need a body. Each purchase is made by a different funded user so that
+    every one of them buys the deck.
+'''
+def scenarios(ids, admin_id, requests):
+    found = []
+    for route in routes():
+        found.append({ 'name' : 'GET ' + route, 'route' : route, 'method' : 'get' })
+
+    cards = r'rest/v1/phrase_decks/(?P<deck_id>[-\w]+)/cards/?'
+    found.append({ 'name' : 'GET %s?stream=true' % cards, 'route' : cards, 'method' : 'get',
+                   'data' : lambda i: { 'stream' : 'true' } })
+
+    buyers = [str(uuid.uuid1()) for _ in range(requests)]
+    ledger = Ledger()
+    for buyer in buyers:
+        ledger.credit(buyer, 100, 'bench')
+    found.append({ 'name' : 'POST rest/v1/account/purchases/?', 'route' : 'rest/v1/account/purchases/?',
+                   'method' : 'post', 'user' : lambda i: buyers[i],
+                   'data' : lambda i: { 'deck_id' : ids['nomination_deck_id'], 'idempotency_key' : 'bench-%d' % i } })
+
+    search = 'rest/v1/decks/search/?'
+    found.append({ 'name' : 'GET %s?q=deck' % search, 'route' : search, 'method' : 'get',
+                   'data' : lambda i: { 'q' : 'deck' } })
+
+    found.append({ 'name' : 'POST rest/v1/phrase_decks/?', 'route' : 'rest/v1/phrase_decks/?', 'method' : 'post',
+                   'user' : lambda i: admin_id, 'data' : lambda i: {
+                       'title' : 'made %d' % i, 'price' : 1, 'cards' : json.dumps(['card %d' % n for n in range(10)])
+                   } })
+    return found
+
+'''
+    Runs one scenario and measures it.
+
+    @return: The report of the scenario
+'''
+def run(scenario, ids, user_id, requests, concurrency, fakes):
+    path = routePath(scenario['route'], ids)
+    user = scenario.get('user', lambda i: user_id)
+    make_data = scenario.get('data', lambda i: {})
+    counter = itertools.count()
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+
+    def calls():
+        return pool.getManager().calls() + sum(fake.table.calls for fake in fakes.values())
+
+    def worker():
+        client = Client()
+        while True:
+            i = next(counter)
+            if i >= requests:
+                return
+            start = time.time()
+            response = getattr(client, scenario['method'])(path, make_data(i), **{ USER_HEADER : user(i) })
+            if getattr(response, 'streaming', False):
+                for _ in response.streaming_content:
+                    pass
+            elapsed = time.time() - start
+            with lock:
+                latencies.append(elapsed * 1000.0)
+                statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+
+    before = calls()
+    started = time.time()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - started
+
+    return {
+        'method' : scenario['method'].upper(),
+        'path' : path,
+        'requests' : requests,
+        'statuses' : statuses,
+        'requests_per_second' : requests / elapsed if elapsed else 0.0,
+        'p50_ms' : percentile(latencies, 50),
+        'p99_ms' : percentile(latencies, 99),
+        'datastore_calls_per_request' : float(calls() - before) / requests
+    }
+
+'''
+    Benchmarks every route.
+
+    @param requests: The requests made per scenario
+    @param concurrency: The number of clients making them at once
+    @param decks: The decks of each type seeded
+    @param cards: The cards seeded in each deck
+    @param games: The games seeded
+    @param latency: Simulated Cassandra round trip in seconds
+    @param only: If given, only the scenarios whose name contains it are run
+    @return: The report
+'''
+def benchmark(requests=100, concurrency=4, decks=10, cards=100, games=10, latency=0.0, only=None):
+    user_id, admin_id = str(uuid.uuid1()), str(uuid.uuid1())
+    fakes, patched = installFakes(latency)
+    content_admins = settings.CONTENT_ADMINS
+    settings.CONTENT_ADMINS = tuple(content_admins) + (admin_id,)
+    # every scenario is run from one address as fast as it can go
+    rate_limited = settings.RATE_LIMIT['ENABLED']
+    settings.RATE_LIMIT['ENABLED'] = False
+    try:
+        ids = seed(fakes, decks, cards, games, admin_id, user_id)
+        report = {}
+        for scenario in scenarios(ids, admin_id, requests):
+            if only and only not in scenario['name']:
+                continue
+            report[scenario['name']] = run(scenario, ids, user_id, requests, concurrency, fakes)
+    finally:
+        settings.CONTENT_ADMINS = content_admins
+        settings.RATE_LIMIT['ENABLED'] = rate_limited
+        restoreFakes(patched)
+
+    return {
+        'date_created' : datetime.datetime.now().isoformat(),
+        'config' : { 'requests' : requests, 'concurrency' : concurrency, 'decks' : decks,
+                     'cards' : cards, 'games' : games, 'latency' : latency },
+        'scenarios' : report
+    }
+
+'''
+    Compares two reports, scenario by scenario.
+
+    @return: Map of scenario name to the change in percent of p50, p99 and
+        datastore calls per request
+'''
+def compare(old, new):
+    changes = {}
+    for name, scenario in new['scenarios'].items():
+        before = old['scenarios'].get(name)
+        if not before:
+            continue
+        changes[name] = dict((measure, (scenario[measure] - before[measure]) * 100.0 / before[measure]
+                                       if before[measure] else 0.0)
+                             for measure in ('p50_ms', 'p99_ms', 'datastore_calls_per_request'))
+    return changes
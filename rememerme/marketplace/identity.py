@@ -0,0 +1,191 @@
+'''
+    A request scoped identity map.
+
+    While IdentityMapMiddleware has a map open for the request, the
+    getByID and filterBy* class methods of the tracked models load each
+    row once and hand back the same objects to every later call in the
+    request. Whatever a filter loads is also kept by its id, so a
+    getByID after a filterByGame costs nothing. Saving a model drops
+    what the map holds for its class, so a request always reads its own
+    writes.
+
+    @author: Andrew Oberlin, Jake Gregg
+'''
+import functools
+import threading
+
+# the class methods of the games models that load rows
+LOADERS = ('getByID', 'filterByGame', 'filterByUser', 'filterByRound')
+
+# module -> { class name : (the attribute holding the row key, the loaders) }
+TRACKED_MODELS = {
+    'rememerme.games.models' : {
+        'Game' : ('game_id', LOADERS),
+        'GameMember' : ('game_member_id', LOADERS),
+        'Round' : ('round_id', LOADERS),
+        'Nomination' : ('nomination_id', LOADERS)
+    },
+    # the paged filters of the marketplace models are left alone
+    'rememerme.marketplace.models' : {
+        'Deck' : ('deck_id', ('getByID',)),
+        'Purchase' : ('purchase_id', ('getByID',))
+    }
+}
+
+_local = threading.local()
+
+class IdentityMap(object):
+    '''
+        The objects loaded by one request, with the reads they saved.
+    '''
+
+    def __init__(self):
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, key, fn):
+        if key in self.entries:
+            self.hits += 1
+            return self.entries[key]
+        self.misses += 1
+        value = fn()
+        self.entries[key] = value
+        return value
+
+    def add(self, key, value):
+        self.entries.setdefault(key, value)
+
+    def drop(self, model):
+        for key in [key for key in self.entries if key[0] is model]:
+            del self.entries[key]
+
+class Totals(object):
+    '''
+        The reads served from and through the identity maps of every request.
+    '''
+
+    def __init__(self):
+        self.requests = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def add(self, identity_map):
+        with self.lock:
+            self.requests += 1
+            self.hits += identity_map.hits
+            self.misses += identity_map.misses
+
+    def toMap(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'requests' : self.requests,
+                'reads_avoided' : self.hits,
+                'reads' : self.misses,
+                'reads_avoided_per_request' : float(self.hits) / self.requests if self.requests else 0.0,
+                'hit_ratio' : float(self.hits) / lookups if lookups else 0.0
+            }
+
+totals = Totals()
+
+'''
+    Gets the identity map of the request being served by this thread, if any.
+'''
+def current():
+    return getattr(_local, 'map', None)
+
+'''
+    Opens a new identity map for this thread.
+'''
+def begin():
+    _local.map = IdentityMap()
+    return _local.map
+
+'''
+    Closes the identity map of this thread and adds up its counts.
+'''
+def end():
+    identity_map = current()
+    _local.map = None
+    if identity_map is not None:
+        totals.add(identity_map)
+    return identity_map
+
+'''
+    Wraps a loading class method so it goes through the identity map.
+'''
+def tracked(method, name, key):
+    load = method.__func__
+
+    @functools.wraps(load)
+    def wrapper(cls, *args):
+        identity_map = current()
+        if identity_map is None:
+            return load(cls, *args)
+
+        lookup = (cls, name) + tuple(str(arg) for arg in args)
+        result = identity_map.load(lookup, lambda: load(cls, *args))
+        if name != 'getByID':
+            for instance in result:
+                identity_map.add((cls, 'getByID', str(getattr(instance, key))), instance)
+            # callers get their own list of the shared objects
+            return list(result)
+        return result
+    return classmethod(wrapper)
+
+'''
+    Wraps save so writing a model drops what the map holds for its class.
+'''
+def invalidating(save):
+    @functools.wraps(save)
+    def wrapper(self, *args, **kwargs):
+        result = save(self, *args, **kwargs)
+        identity_map = current()
+        if identity_map is not None:
+            identity_map.drop(type(self))
+        return result
+    return wrapper
+
+'''
+    Sends the loaders and save of a model class through the identity map.
+    Doing it twice does nothing.
+
+    @param cls: The model class
+    @param key: The attribute holding the row key
+    @param loaders: The names of the class methods that load rows
+'''
+def track(cls, key, loaders=LOADERS):
+    if cls.__dict__.get('_tracked'):
+        return
+    for name in loaders:
+        if hasattr(cls, name):
+            setattr(cls, name, tracked(getattr(cls, name), name, key))
+    if hasattr(cls, 'save'):
+        cls.save = invalidating(cls.save)
+    cls._tracked = True
+
+'''
+    Tracks every model in TRACKED_MODELS.
+'''
+def install():
+    for module_name, models in TRACKED_MODELS.items():
+        module = __import__(module_name, fromlist=list(models))
+        for name, (key, loaders) in models.items():
+            track(getattr(module, name), key, loaders)
+
+class IdentityMapMiddleware(object):
+    '''
+        Gives every request its own identity map.
+    '''
+
+    def __init__(self):
+        install()
+
+    def process_request(self, request):
+        begin()
+
+    def process_response(self, request, response):
+        end()
+        return response
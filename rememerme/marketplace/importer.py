@@ -0,0 +1,175 @@
+'''
+    Streaming import of cards into a deck.
+
+    Rows are read one line at a time from CSV (with a header line) or
+    NDJSON, validated as they come and written in batched mutations, so a
+    deck of any size is imported without holding the file in memory.
+
+    Each row needs a term and may have a description and a card_id. Rows
+    with a card_id overwrite that card, so an import can be rerun safely.
+
+    @author: Andrew Oberlin, Jake Gregg
+'''
+from django.conf import settings
+from rememerme.marketplace.models import DeckCard
+from uuid import UUID
+import csv
+import datetime
+import json
+import time
+import uuid
+
+FORMATS = ('csv', 'ndjson')
+
+'''
+    Iterates over the rows of a CSV or NDJSON stream.
+
+    @param lines: Anything yielding the lines of the file (a file or upload)
+    @param fmt: Either csv or ndjson
+    @return: Tuples of the line number and the row map, or the line number
+        and the ValueError explaining why the line could not be read
+'''
+def readRows(lines, fmt):
+    if fmt not in FORMATS:
+        raise ValueError('Unknown format %s' % fmt)
+
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row
+        return
+
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+            if not isinstance(row, dict):
+                raise ValueError('Each line must be a JSON object')
+        except ValueError as e:
+            row = e
+        yield number, row
+
+'''
+    Gets a text field of a row with the whitespace around it stripped.
+
+    @raise ValueError: The field is not text
+'''
+def textField(row, name):
+    value = row.get(name)
+    if value is None:
+        return ''
+    if not isinstance(value, basestring):
+        raise ValueError('The %s must be text' % name)
+    return value.strip()
+
+'''
+    Checks a row and builds the columns of the card it describes.
+
+    @param row: The map read from the file
+    @param deck_id: The deck the card is imported into
+    @return: A tuple of the card id and its columns
+    @raise ValueError: The row is not a valid card
+'''
+def validateRow(row, deck_id):
+    if isinstance(row, ValueError):
+        raise row
+
+    term = textField(row, 'term')
+    if not term:
+        raise ValueError('The term is required')
+    if len(term) > settings.CARD_IMPORT['MAX_TERM_LENGTH']:
+        raise ValueError('The term is longer than %d characters' % settings.CARD_IMPORT['MAX_TERM_LENGTH'])
+
+    description = textField(row, 'description')
+    if len(description) > settings.CARD_IMPORT['MAX_DESCRIPTION_LENGTH']:
+        raise ValueError('The description is longer than %d characters' % settings.CARD_IMPORT['MAX_DESCRIPTION_LENGTH'])
+
+    card_id = textField(row, 'card_id')
+    card_id = str(UUID(card_id)) if card_id else str(uuid.uuid1())
+
+    now = datetime.datetime.now().isoformat()
+    columns = { 'term' : term, 'deck_id' : str(deck_id), 'date_created' : now, 'last_modified' : now }
+    if description:
+        columns['description'] = description
+    return card_id, columns
+
+class CardImporter(object):
+    '''
+        Imports the rows of a file into a deck in batches of batch_size cards.
+    '''
+
+    def __init__(self, model, deck_id, batch_size=None):
+        self.model = model
+        self.deck_id = str(deck_id)
+        self.batch_size = batch_size or settings.CARD_IMPORT['BATCH_SIZE']
+
+    def batches(self, rows):
+        '''
+            Imports the rows, yielding a report after each batch is written.
+
+            @param rows: The (line number, row) tuples from readRows
+            @return: Report maps with the batch number, the cards written, the
+                rows skipped, the errors of those still under MAX_ERRORS and
+                the time the batch took
+        '''
+        batch = []
+        errors = []
+        failed = 0
+        listed = 0
+        number = 0
+        started = time.time()
+
+        for line, row in rows:
+            try:
+                batch.append(validateRow(row, self.deck_id))
+            except ValueError as e:
+                failed += 1
+                if listed < settings.CARD_IMPORT['MAX_ERRORS']:
+                    errors.append({ 'line' : line, 'error' : str(e) })
+                    listed += 1
+
+            # counting the rows skipped too keeps a file of mostly bad rows from piling them up
+            if len(batch) + failed >= self.batch_size:
+                number += 1
+                yield self.write(number, batch, errors, failed, started)
+                batch, errors, failed, started = [], [], 0, time.time()
+
+        if batch or failed:
+            number += 1
+            yield self.write(number, batch, errors, failed, started)
+
+    def write(self, number, batch, errors, failed, started):
+        if batch:
+            with self.model.table.batch(queue_size=self.batch_size) as mutator:
+                for card_id, columns in batch:
+                    mutator.insert(card_id, columns)
+            DeckCard.add(self.deck_id, [card_id for card_id, _ in batch], [columns['term'] for _, columns in batch])
+
+        return {
+            'batch' : number,
+            'written' : len(batch),
+            'failed' : failed,
+            'errors' : errors,
+            'seconds' : time.time() - started
+        }
+
+    def run(self, rows):
+        '''
+            Imports all of the rows.
+
+            @return: A summary with the totals, the throughput and every batch report
+        '''
+        started = time.time()
+        reports = list(self.batches(rows))
+        elapsed = time.time() - started
+        written = sum(report['written'] for report in reports)
+
+        return {
+            'deck_id' : self.deck_id,
+            'written' : written,
+            'failed' : sum(report['failed'] for report in reports),
+            'seconds' : elapsed,
+            'cards_per_second' : written / elapsed if elapsed else 0.0,
+            'batches' : reports
+        }
@@ -0,0 +1,250 @@
+'''
+    The best selling decks of today, this week and all time.
+
+    deck_sales: 'hour:<hours since the epoch>' -> { deck_id : sales that hour }
+                'all'                           -> { deck_id : sales ever }
+
+    Every sale adds to its hour's counter row and the all time row. Each
+    process keeps the same counts in memory: the sales of each hour of the
+    longest window, the total of each window and the ranking of the TOP_K
+    decks of each window. A sale moves the deck up the ranking it is in, or
+    into it, so reading a leaderboard costs nothing but the slice returned.
+    As each hour passes the hour falling out of a window is taken off its
+    totals and that window is ranked again.
+
+    A process starts from the counter rows and reloads them every
+    REFRESH_SECONDS to pick up the sales made by other processes.
+
+    @author: Andrew Oberlin, Jake Gregg
+'''
+from django.conf import settings
+from rememerme.marketplace import pool
+from rememerme.marketplace.unitofwork import afterWrite
+import heapq
+import threading
+import time
+
+ALL_TIME = 'all'
+
+# an hour row holds a column for every deck sold that hour
+MAX_COLUMNS = 1000000
+
+'''
+    Gets the row of the counts of an hour.
+'''
+def hourKey(hour):
+    return 'hour:%d' % hour
+
+class Leaderboard(object):
+    '''
+        Sales counts bucketed by hour with the top decks of each window.
+
+        @param windows: Map of window name to its length in hours, None
+            for a window that never drops a sale
+        @param top_k: The most decks ranked in each window
+        @param clock: Gets the time in seconds since the epoch
+    '''
+
+    def __init__(self, windows, top_k, clock=time.time):
+        self.windows = windows
+        self.span = max(hours for hours in windows.values() if hours)
+        self.top_k = top_k
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.updates = 0
+        self.load({}, {})
+        # nothing has been read from the counter rows yet
+        self.built = None
+
+    def hour(self):
+        return int(self.clock() // 3600)
+
+    def load(self, hours, all_time):
+        '''
+            Replaces the counts with the ones read from the counter rows.
+
+            @param hours: Map of hour to the sales of each deck that hour
+            @param all_time: Map of deck id to its sales ever
+        '''
+        with self.lock:
+            self.current = self.hour()
+            self.hours = dict((hour, dict(counts)) for hour, counts in hours.items()
+                              if self.current - self.span < hour <= self.current)
+            self.totals = {}
+            for name, length in self.windows.items():
+                if length is None:
+                    self.totals[name] = dict(all_time)
+                    continue
+                totals = self.totals[name] = {}
+                for hour, counts in self.hours.items():
+                    if hour > self.current - length:
+                        for deck_id, count in counts.items():
+                            totals[deck_id] = totals.get(deck_id, 0) + count
+            self.top = dict((name, self.rank(name)) for name in self.windows)
+            self.built = time.time()
+
+    def rank(self, name):
+        totals = self.totals[name]
+        return heapq.nlargest(self.top_k, totals, key=totals.get)
+
+    def advance(self):
+        '''
+            Drops the hours that have fallen out of each window.
+        '''
+        hour = self.hour()
+        if hour <= self.current:
+            return
+        dirty = set()
+        for passed in range(self.current + 1, min(hour, self.current + self.span) + 1):
+            for name, length in self.windows.items():
+                expired = self.hours.get(passed - length) if length else None
+                if not expired:
+                    continue
+                totals = self.totals[name]
+                for deck_id, count in expired.items():
+                    left = totals.get(deck_id, 0) - count
+                    if left > 0:
+                        totals[deck_id] = left
+                    else:
+                        totals.pop(deck_id, None)
+                dirty.add(name)
+            self.hours.pop(passed - self.span, None)
+        self.current = hour
+        for name in dirty:
+            self.top[name] = self.rank(name)
+
+    def add(self, deck_id, amount=1):
+        '''
+            Counts sales of a deck made now.
+        '''
+        deck_id = str(deck_id)
+        with self.lock:
+            self.advance()
+            counts = self.hours.setdefault(self.current, {})
+            counts[deck_id] = counts.get(deck_id, 0) + amount
+            for name in self.windows:
+                totals = self.totals[name]
+                totals[deck_id] = totals.get(deck_id, 0) + amount
+                self.promote(name, deck_id)
+            self.updates += 1
+
+    def promote(self, name, deck_id):
+        '''
+            Moves a deck whose sales went up to its place in a ranking.
+        '''
+        top, totals = self.top[name], self.totals[name]
+        count = totals[deck_id]
+        try:
+            position = top.index(deck_id)
+        except ValueError:
+            if len(top) >= self.top_k:
+                if count <= totals.get(top[-1], 0):
+                    return
+                top.pop()
+            top.append(deck_id)
+            position = len(top) - 1
+        while position > 0 and totals.get(top[position - 1], 0) < count:
+            top[position] = top[position - 1]
+            position -= 1
+        top[position] = deck_id
+
+    def query(self, name, limit):
+        '''
+            Gets the best selling decks of a window.
+
+            @return: A list of tuples of the deck id and its sales in the window
+        '''
+        with self.lock:
+            self.advance()
+            totals = self.totals[name]
+            return [(deck_id, totals[deck_id]) for deck_id in self.top[name][:limit]]
+
+    def stats(self):
+        with self.lock:
+            return {
+                'built' : self.built,
+                'updates' : self.updates,
+                'hours' : len(self.hours),
+                'decks' : dict((name, len(totals)) for name, totals in self.totals.items())
+            }
+
+board = Leaderboard(settings.LEADERBOARD['WINDOWS'], settings.LEADERBOARD['TOP_K'])
+
+'''
+    Gets the deck_sales counter column family.
+'''
+def sales():
+    return pool.columnFamily('deck_sales')
+
+'''
+    Counts a sale of a deck once the rows being written are.
+'''
+def recordSale(deck_id):
+    deck_id = str(deck_id)
+    hour = board.hour()
+
+    def record():
+        sales().add(hourKey(hour), deck_id, 1)
+        sales().add(ALL_TIME, deck_id, 1)
+        board.add(deck_id)
+    afterWrite(record)
+
+'''
+    Reads the sales counts back from the counter rows.
+
+    @return: A tuple of the map of hour to the counts of that hour and the
+        map of deck id to its sales ever
+'''
+def readCounts(hour=None):
+    hour = board.hour() if hour is None else hour
+    hours = range(hour - board.span + 1, hour + 1)
+    rows = sales().multiget([hourKey(past) for past in hours], column_count=MAX_COLUMNS)
+    buckets = dict((past, dict((deck_id, int(count)) for deck_id, count in rows[hourKey(past)].items()))
+                   for past in hours if hourKey(past) in rows)
+    all_time = dict((deck_id, int(count)) for deck_id, count in sales().xget(ALL_TIME))
+    return buckets, all_time
+
+_rebuilding = threading.Lock()
+
+'''
+    Reloads the leaderboard of this process from the counter rows.
+
+    @param force: Whether to reload a leaderboard that was already loaded
+'''
+def rebuild(force=True):
+    with _rebuilding:
+        if force or board.built is None:
+            board.load(*readCounts())
+
+'''
+    Reloads the leaderboard in the background if it is older than REFRESH_SECONDS.
+'''
+def refresh():
+    if board.built is None or time.time() - board.built < settings.LEADERBOARD['REFRESH_SECONDS'] \
+            or _rebuilding.locked():
+        return
+    thread = threading.Thread(target=rebuild)
+    thread.daemon = True
+    thread.start()
+
+'''
+    Gets the best selling decks of a window. The first call waits for the
+    leaderboard to be loaded.
+
+    @param window: One of the names in LEADERBOARD['WINDOWS']
+    @return: A list of tuples of the deck id and its sales in the window
+'''
+def top(window, limit):
+    if board.built is None:
+        rebuild(force=False)
+    else:
+        refresh()
+    return board.query(window, limit)
+
+'''
+    Loads the leaderboard in the background, e.g. when a worker starts.
+'''
+def warm():
+    thread = threading.Thread(target=rebuild, args=(False,))
+    thread.daemon = True
+    thread.start()
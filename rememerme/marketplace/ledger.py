@@ -0,0 +1,244 @@
+'''
+    The wallet ledger. Every credit and debit of a user's wallet is
+    appended to the user's row in wallet_ledger and never changed.
+    The balance is kept in wallet_snapshot as the sum of the ledger up to
+    some entry, so reading it is one snapshot read plus a replay of the
+    entries appended since.
+
+    wallet_ledger:   user_id -> { '000000000001' : entry, ..., 'head' : last seq }
+    wallet_snapshot: user_id -> { 'balance' : ..., 'seq' : ..., 'date_created' : ... }
+
+    @author: Andrew Oberlin, Jake Gregg
+'''
+from django.conf import settings
+from pycassa.cassandra.ttypes import NotFoundException as CassaNotFoundException
+from rememerme.marketplace import pool
+from rememerme.marketplace.loaders import getPage
+from rememerme.marketplace.rest.exceptions import InsufficientFunds
+import datetime
+import json
+
+HEAD = 'head'
+FIRST_ENTRY = '%012d' % 1
+LAST_ENTRY = '9' * 12
+
+# times an append whose answer was lost is tried again
+APPEND_RETRIES = 3
+
+'''
+    Gets the column name of the ledger entry with the given sequence number.
+'''
+def entryName(seq):
+    return '%012d' % seq
+
+class Ledger(object):
+    '''
+        Reads and appends to the wallet ledger of users.
+    '''
+
+    def __init__(self, entries=None, snapshots=None):
+        self.entries = entries if entries is not None else pool.columnFamily('wallet_ledger')
+        self.snapshots = snapshots if snapshots is not None else pool.columnFamily('wallet_snapshot')
+
+    def head(self, user_id):
+        '''
+            Gets the sequence number of the last entry in the user's ledger.
+        '''
+        try:
+            return int(self.entries.get(str(user_id), columns=[HEAD])[HEAD])
+        except CassaNotFoundException:
+            return 0
+
+    def append(self, user_id, amount, reference, minimum=None):
+        '''
+            Appends an entry to the user's ledger. The entry and the new head
+            are written with a compare-and-set on the old head so concurrent
+            appends never share a seq and a funds check can't be raced.
+
+            Before trying again, the entries appended since the first attempt
+            are searched for the reference. A compare-and-set that timed out
+            may still have been applied, and one that wasn't applied may have
+            lost to another request appending the same entry (e.g. a retry of
+            a purchase that took too long). The reference should identify the
+            entry (e.g. the purchase id) for that to find it.
+
+            @param amount: Positive for a credit and negative for a debit
+            @param reference: What the entry is for (e.g. the purchase id)
+            @param minimum: If given, the lowest the balance may fall to
+            @return: The sequence number of the new entry
+        '''
+        entry = json.dumps({
+            'amount' : int(amount),
+            'reference' : str(reference),
+            'date_created' : datetime.datetime.now().isoformat()
+        })
+        start = None
+        lost = 0
+        while True:
+            head = self.head(user_id)
+            if start is None:
+                start = head
+            elif head > start or lost:
+                seq = self.find(user_id, reference, start)
+                if seq is not None:
+                    return seq
+            if minimum is not None and self.balanceAt(user_id, head) + amount < minimum:
+                raise InsufficientFunds()
+            
+            seq = head + 1
+            try:
+                applied, _ = self.entries.cas(str(user_id), { HEAD : str(head) if head else None },
+                                              { entryName(seq) : entry, HEAD : str(seq) })
+            except pool.FAILOVER_ERRORS:
+                lost += 1
+                if lost > APPEND_RETRIES:
+                    raise
+                continue
+            if applied:
+                return seq
+
+    def find(self, user_id, reference, after=0):
+        '''
+            Gets the seq of the first entry after the given one with the reference.
+
+            @return: The seq, or None if there is no such entry
+        '''
+        for seq, entry in self.tail(user_id, after):
+            if entry['reference'] == str(reference):
+                return seq
+        return None
+
+    def credit(self, user_id, amount, reference):
+        return self.append(user_id, abs(amount), reference)
+
+    def debit(self, user_id, amount, reference, minimum=0):
+        '''
+            Takes the amount out of the wallet unless that would leave it below minimum.
+        '''
+        return self.append(user_id, -abs(amount), reference, minimum)
+
+    def snapshot(self, user_id):
+        '''
+            Gets the last compacted balance of the user.
+
+            @return: A tuple of the balance and the seq of the last entry included in it
+        '''
+        try:
+            row = self.snapshots.get(str(user_id), columns=['balance', 'seq'])
+            return int(row['balance']), int(row['seq'])
+        except CassaNotFoundException:
+            return 0, 0
+
+    def tail(self, user_id, after=0, through=None):
+        '''
+            Iterates over the entries appended after the given sequence number.
+
+            @param through: The seq of the last entry to include, defaulting to all of them
+            @return: Tuples of the seq and the entry map
+        '''
+        buffer_size = settings.WALLET_LEDGER['PAGE_SIZE']
+        finish = entryName(through) if through is not None else LAST_ENTRY
+        if through is not None and through <= after:
+            return
+        try:
+            for name, value in self.entries.xget(str(user_id), column_start=entryName(after + 1),
+                                                 column_finish=finish, buffer_size=buffer_size):
+                yield int(name), json.loads(value)
+        except CassaNotFoundException:
+            return
+
+    def balance(self, user_id):
+        '''
+            Gets the current balance of the user from the snapshot and the
+            entries after it. A snapshot that has fallen too far behind is
+            compacted on the way.
+        '''
+        balance, seq = self.snapshot(user_id)
+        replayed = 0
+        for seq, entry in self.tail(user_id, seq):
+            balance += entry['amount']
+            replayed += 1
+
+        if replayed >= settings.WALLET_LEDGER['COMPACT_AFTER']:
+            self.writeSnapshot(user_id, balance, seq)
+        return balance
+
+    def balanceAt(self, user_id, seq):
+        '''
+            Gets the balance of the user right after the entry with the given seq.
+        '''
+        balance, snapshot_seq = self.snapshot(user_id)
+        if snapshot_seq > seq:
+            balance, snapshot_seq = 0, 0
+        for _, entry in self.tail(user_id, snapshot_seq, seq):
+            balance += entry['amount']
+        return balance
+
+    def writeSnapshot(self, user_id, balance, seq):
+        self.snapshots.insert(str(user_id), {
+            'balance' : str(balance),
+            'seq' : str(seq),
+            'date_created' : datetime.datetime.now().isoformat()
+        })
+
+    def compact(self, user_id):
+        '''
+            Folds the entries after the snapshot into a new snapshot.
+
+            @return: The balance and seq of the new snapshot
+        '''
+        balance, seq = self.snapshot(user_id)
+        previous = seq
+        for seq, entry in self.tail(user_id, seq):
+            balance += entry['amount']
+
+        if seq != previous:
+            self.writeSnapshot(user_id, balance, seq)
+        return balance, seq
+
+    def check(self, user_id):
+        '''
+            Replays the whole ledger of the user and compares it with the snapshot.
+
+            @return: A map describing the snapshot, the replayed balance and whether they agree
+        '''
+        balance, seq = self.snapshot(user_id)
+        replayed = 0
+        total = 0
+        for entry_seq, entry in self.tail(user_id):
+            total += entry['amount']
+            if entry_seq == seq:
+                replayed = total
+
+        return {
+            'user_id' : str(user_id),
+            'snapshot_seq' : seq,
+            'snapshot_balance' : balance,
+            'ledger_balance_at_snapshot' : replayed,
+            'ledger_balance' : total,
+            'consistent' : replayed == balance
+        }
+
+    def history(self, user_id, limit, cursor=None):
+        '''
+            Gets a page of the user's ledger, newest first.
+
+            @param limit: The most entries returned
+            @param cursor: The position the previous page ended on
+            @return: A tuple of the entry maps (including their seq) and the cursor of the next page
+        '''
+        columns, cursor = getPage(self.entries, user_id, limit, cursor, column_start=LAST_ENTRY,
+                                  column_finish=FIRST_ENTRY, column_reversed=True)
+        history = []
+        for name, value in columns:
+            entry = json.loads(value)
+            entry['seq'] = int(name)
+            history.append(entry)
+        return history, cursor
+
+    def users(self):
+        '''
+            Iterates over the ids of every user with a ledger.
+        '''
+        for key, _ in self.entries.get_range(columns=[HEAD]):
+            yield key
@@ -0,0 +1,71 @@
+'''
+    Bulk loading helpers for the pycassa backed models. Listings should
+    load their rows with one multiget instead of one get per row.
+
+    @author: Andrew Oberlin, Jake Gregg
+'''
+from django.conf import settings
+from pycassa.cassandra.ttypes import NotFoundException as CassaNotFoundException
+
+'''
+    Loads the rows of a model for all of the given ids with a single
+    multiget. Large key sets are split by pycassa into requests of at
+    most chunk_size keys.
+
+    @param model: The model class (anything with a table and fromCassa)
+    @param ids: The row keys to load in the order they should be returned
+    @param chunk_size: The maximum number of keys sent in one request
+    @param skip_missing: Whether rows that don't exist are left out, e.g.
+        for ids read from an index that can be ahead of its rows
+    @return: The models found, in the order of ids
+    @raise CassaNotFoundException: A row doesn't exist and skip_missing
+        wasn't set, like getByID
+'''
+def getByIDs(model, ids, chunk_size=None, skip_missing=False):
+    keys = []
+    seen = set()
+    for key in ids:
+        key = str(key)
+        if key not in seen:
+            seen.add(key)
+            keys.append(key)
+    
+    if not keys:
+        return []
+    
+    if not chunk_size:
+        chunk_size = settings.CASSANDRA_MULTIGET_CHUNK_SIZE
+    
+    rows = model.table.multiget(keys, buffer_size=chunk_size)
+    if not skip_missing and len(rows) < len(keys):
+        raise CassaNotFoundException()
+    return [model.fromCassa((key, rows[key])) for key in keys if key in rows]
+
+'''
+    Gets one page of the columns of an index row, continuing after the
+    column a previous page ended on.
+
+    @param index: The column family holding the index
+    @param row_key: The index row
+    @param limit: The most columns returned
+    @param cursor: The last column of the previous page
+    @return: A tuple of the list of (column, value) pairs and the column the
+        next page continues after, or None if this was the last page
+'''
+def getPage(index, row_key, limit, cursor=None, column_start='', column_finish='', column_reversed=False):
+    # one extra column tells whether there is a next page and the cursor itself comes back first
+    count = limit + 1
+    if cursor:
+        column_start = cursor = str(cursor)
+        count += 1
+    
+    try:
+        row = index.get(str(row_key), column_start=column_start, column_finish=column_finish,
+                        column_reversed=column_reversed, column_count=count)
+    except CassaNotFoundException:
+        return [], None
+    
+    columns = [(name, value) for name, value in row.items() if name != cursor]
+    if len(columns) > limit:
+        return columns[:limit], columns[limit - 1][0]
+    return columns, None
@@ -0,0 +1,188 @@
+'''
+    Indexes of game memberships.
+
+    The memberships of each user are indexed by their status, so the
+    memberships with one status (e.g. pending requests) are read as a
+    single row slice instead of filtering all of the user's memberships.
+    The members of each game are indexed by user, so finding a user's
+    membership of a game is a point read instead of a scan of the game.
+
+    member_status:        '<user_id>:<status>' -> { game_member_id : game_id }
+                          '<user_id>'          -> { 'indexed' : time the index was built }
+    game_members_by_user: game_id -> { user_id : game_member_id, 'indexed' : time the game was scanned }
+
+    The writes of the marketplace go through save so the indexes follow
+    them. Members can also be added or changed by the games service, which
+    doesn't know about the indexes, so an index is only taken to hold all of
+    the memberships of its user or game for MEMBERSHIPS['INDEX_TTL'] seconds
+    after it was built from GameMember.filterByUser or filterByGame. A user
+    whose index is older than that is answered from filterByUser again,
+    which rebuilds it, and a user missing from a game whose index is older
+    than that is looked for with a new scan of the game. An entry found under
+    a status its member no longer has is moved to the row of its status.
+
+    @author: Andrew Oberlin, Jake Gregg
+'''
+from django.conf import settings
+from pycassa.cassandra.ttypes import NotFoundException as CassaNotFoundException
+from rememerme.games.models import GameMember
+from rememerme.marketplace import pool
+from rememerme.marketplace.loaders import getByIDs
+import time
+
+INDEXED = 'indexed'
+
+# the statuses of a membership
+INVITED = 1
+ACCEPTED = 2
+
+'''
+    Gets the row of the index holding a user's memberships with the status.
+'''
+def rowKey(user_id, status):
+    return '%s:%d' % (user_id, int(status))
+
+'''
+    Gets the member_status column family.
+'''
+def index():
+    return pool.columnFamily('member_status')
+
+'''
+    Gets the game_members_by_user column family.
+'''
+def gameIndex():
+    return pool.columnFamily('game_members_by_user')
+
+'''
+    Checks whether an index marker was written within MEMBERSHIPS['INDEX_TTL'].
+'''
+def isFresh(marker):
+    try:
+        return time.time() - float(marker) < settings.MEMBERSHIPS['INDEX_TTL']
+    except (TypeError, ValueError):
+        # markers from before the indexes expired hold a date
+        return False
+
+'''
+    Saves a membership, adds it to the index of its game and moves it to
+    the row of its status in the index of its user.
+
+    @param member: The GameMember to save
+    @param previous: The status it had before, if it existed already
+'''
+def save(member, previous=None):
+    member.save()
+    user_id = str(member.user_id)
+    index().insert(rowKey(user_id, member.status), { str(member.game_member_id) : str(member.game_id) })
+    gameIndex().insert(str(member.game_id), { user_id : str(member.game_member_id) })
+    if previous is not None and int(previous) != int(member.status):
+        index().remove(rowKey(user_id, previous), columns=[str(member.game_member_id)])
+
+'''
+    Checks whether the index of the user was built within MEMBERSHIPS['INDEX_TTL'].
+'''
+def isIndexed(user_id):
+    try:
+        return isFresh(index().get(str(user_id), columns=[INDEXED])[INDEXED])
+    except CassaNotFoundException:
+        return False
+
+'''
+    Builds the index of a user from all of their memberships.
+
+    @return: The user's memberships
+'''
+def backfill(user_id):
+    user_id = str(user_id)
+    members = GameMember.filterByUser(user_id)
+    rows = {}
+    for member in members:
+        rows.setdefault(rowKey(user_id, member.status), {})[str(member.game_member_id)] = str(member.game_id)
+    for row_key, columns in rows.items():
+        index().insert(row_key, columns)
+    index().insert(user_id, { INDEXED : repr(time.time()) })
+    return members
+
+'''
+    Gets the memberships of a user with the status.
+
+    @return: The GameMembers
+'''
+def filterByStatus(user_id, status):
+    user_id = str(user_id)
+    if not isIndexed(user_id):
+        return [member for member in backfill(user_id) if member.status == status]
+
+    try:
+        member_ids = [name for name, _ in index().xget(rowKey(user_id, status))]
+    except CassaNotFoundException:
+        return []
+
+    found = []
+    for member in getByIDs(GameMember, member_ids, skip_missing=True):
+        if int(member.status) == int(status):
+            found.append(member)
+        else:
+            # the status was changed without going through save
+            index().insert(rowKey(user_id, member.status), { str(member.game_member_id) : str(member.game_id) })
+            index().remove(rowKey(user_id, status), columns=[str(member.game_member_id)])
+    return found
+
+'''
+    Builds the index of a game from all of its members and marks it complete.
+
+    @return: Map of user id to game member id
+'''
+def indexGame(game_id):
+    game_id = str(game_id)
+    members = dict((str(member.user_id), str(member.game_member_id)) for member in GameMember.filterByGame(game_id))
+    # a game that doesn't exist is kept out of the index
+    if members:
+        gameIndex().insert(game_id, dict(members, **{ INDEXED : repr(time.time()) }))
+    return members
+
+'''
+    Gets the game member ids of users in a game with a single read. Only a
+    miss in a game whose index is no longer fresh scans the game.
+
+    @param user_ids: The users to look up, or None for every member
+    @return: Map of user id to game member id of the users that are members
+'''
+def memberIDs(game_id, user_ids=None):
+    game_id = str(game_id)
+    wanted = None if user_ids is None else set(str(user_id) for user_id in user_ids)
+    try:
+        if wanted is None:
+            row = dict(gameIndex().xget(game_id))
+        else:
+            row = dict(gameIndex().get(game_id, columns=list(wanted) + [INDEXED]))
+    except CassaNotFoundException:
+        row = {}
+
+    complete = isFresh(row.pop(INDEXED, None))
+    if not complete and (wanted is None or len(row) < len(wanted)):
+        row = indexGame(game_id)
+    if wanted is not None:
+        row = dict((user_id, member_id) for user_id, member_id in row.items() if user_id in wanted)
+    return row
+
+'''
+    Checks whether a user is a member of a game.
+'''
+def isMember(game_id, user_id):
+    return str(user_id) in memberIDs(game_id, [user_id])
+
+'''
+    Gets the membership of a user in a game.
+
+    @return: The GameMember, or None if the user isn't a member
+'''
+def findMember(game_id, user_id):
+    member_id = memberIDs(game_id, [user_id]).get(str(user_id))
+    if not member_id:
+        return None
+    try:
+        return GameMember.getByID(member_id)
+    except CassaNotFoundException:
+        return None
@@ -0,0 +1,283 @@
+'''
+    Per route request metrics.
+
+    MetricsMiddleware times every request and files it under the URL pattern
+    from config.urls that served it. The pycassa ColumnFamily and Mutator
+    methods are wrapped so every Cassandra call made while the request runs
+    is counted against it, with the rows it read. The totals are exposed in
+    the Prometheus text format by the status app.
+
+    @author: Andrew Oberlin, Jake Gregg
+'''
+from django.core.urlresolvers import get_resolver, RegexURLResolver
+import bisect
+import functools
+import threading
+import time
+
+# upper bounds in seconds of the latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# how each datastore method's result is turned into the number of rows read
+ROW_COUNTERS = {
+    'get' : lambda result: 1,
+    'multiget' : len,
+    'get_count' : lambda result: 1,
+    'multiget_count' : len
+}
+
+# returned by an insert queued by a unit of work, which isn't a call yet
+DEFERRED = object()
+
+# datastore methods that page lazily, so rows are counted as they are yielded
+GENERATOR_METHODS = ('xget', 'get_range', 'get_indexed_slices')
+
+_local = threading.local()
+
+class RequestMetrics(object):
+    '''
+        What a single request has done so far.
+    '''
+
+    def __init__(self):
+        self.start = time.time()
+        self.route = None
+        self.calls = {}
+        self.rows = 0
+
+    def call(self, method):
+        self.calls[method] = self.calls.get(method, 0) + 1
+
+class RouteMetrics(object):
+    '''
+        The totals of every request served by one route.
+    '''
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.seconds = 0.0
+        self.calls = {}
+        self.rows = 0
+        self.bytes = 0
+
+    def observe(self, seconds, calls, rows):
+        self.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.seconds += seconds
+        for method, count in calls.items():
+            self.calls[method] = self.calls.get(method, 0) + count
+        self.rows += rows
+
+    def toMap(self):
+        calls = sum(self.calls.values())
+        return {
+            'requests' : self.count,
+            'mean_ms' : self.seconds / self.count * 1000.0 if self.count else 0.0,
+            'datastore_calls' : calls,
+            'datastore_calls_per_request' : float(calls) / self.count if self.count else 0.0,
+            'datastore_calls_by_method' : dict(self.calls),
+            'rows_read' : self.rows,
+            'bytes_serialized' : self.bytes
+        }
+
+class Registry(object):
+    '''
+        Keeps the RouteMetrics of every route.
+    '''
+
+    def __init__(self):
+        self.routes = {}
+        self.lock = threading.Lock()
+
+    def _route(self, route):
+        metrics = self.routes.get(route)
+        if metrics is None:
+            metrics = self.routes.setdefault(route, RouteMetrics())
+        return metrics
+
+    def observe(self, route, seconds, calls, rows):
+        with self.lock:
+            self._route(route).observe(seconds, calls, rows)
+
+    def addBytes(self, route, size):
+        with self.lock:
+            self._route(route).bytes += size
+
+    def clear(self):
+        with self.lock:
+            self.routes = {}
+
+    def stats(self):
+        with self.lock:
+            return dict((route, metrics.toMap()) for route, metrics in self.routes.items())
+
+    def exposition(self):
+        '''
+            Writes out every route's metrics in the Prometheus text format.
+        '''
+        lines = [
+            '# TYPE marketplace_request_seconds histogram',
+            '# TYPE marketplace_datastore_calls_total counter',
+            '# TYPE marketplace_datastore_rows_total counter',
+            '# TYPE marketplace_response_bytes_total counter'
+        ]
+        with self.lock:
+            for route in sorted(self.routes):
+                metrics = self.routes[route]
+                label = 'route="%s"' % route.replace('\\', '\\\\').replace('"', '\\"')
+                total = 0
+                for bound, count in zip(BUCKETS + ('+Inf',), metrics.buckets):
+                    total += count
+                    lines.append('marketplace_request_seconds_bucket{%s,le="%s"} %d' % (label, bound, total))
+                lines.append('marketplace_request_seconds_sum{%s} %f' % (label, metrics.seconds))
+                lines.append('marketplace_request_seconds_count{%s} %d' % (label, metrics.count))
+                for method in sorted(metrics.calls):
+                    lines.append('marketplace_datastore_calls_total{%s,method="%s"} %d'
+                                 % (label, method, metrics.calls[method]))
+                lines.append('marketplace_datastore_rows_total{%s} %d' % (label, metrics.rows))
+                lines.append('marketplace_response_bytes_total{%s} %d' % (label, metrics.bytes))
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+'''
+    Gets the metrics of the request being served by this thread, if any.
+'''
+def current():
+    return getattr(_local, 'request', None)
+
+'''
+    Counts a datastore call against the current request.
+
+    @param method: The name of the ColumnFamily method called
+    @param rows: The number of rows it read
+'''
+def record(method, rows=0):
+    metrics = current()
+    if metrics is not None:
+        metrics.call(method)
+        metrics.rows += rows
+
+'''
+    Counts rows read against the current request.
+'''
+def addRows(rows):
+    metrics = current()
+    if metrics is not None:
+        metrics.rows += rows
+
+'''
+    Wraps a datastore method so its calls are recorded.
+'''
+def instrumented(method, name):
+    counter = ROW_COUNTERS.get(name, lambda result: 0)
+
+    if name in GENERATOR_METHODS:
+        # an xget reads a single row however many columns it pages through
+        @functools.wraps(method)
+        def generator(*args, **kwargs):
+            record(name, 1 if name == 'xget' else 0)
+            for item in method(*args, **kwargs):
+                if name != 'xget':
+                    addRows(1)
+                yield item
+        return generator
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        result = method(*args, **kwargs)
+        if result is not DEFERRED:
+            record(name, counter(result))
+        return result
+    return wrapper
+
+'''
+    Wraps the named methods of a datastore class so their calls are recorded.
+    Wrapping a class twice does nothing.
+
+    @param cls: The class, e.g. pycassa's ColumnFamily
+    @param names: The names of the methods to wrap
+'''
+def instrument(cls, names):
+    if cls.__dict__.get('_instrumented'):
+        return
+    for name in names:
+        if hasattr(cls, name):
+            setattr(cls, name, instrumented(getattr(cls, name), name))
+    cls._instrumented = True
+
+'''
+    Wraps pycassa so every Cassandra call made by any model is recorded,
+    including the models of the other rememerme packages.
+'''
+def instrumentDatastore():
+    from pycassa.columnfamily import ColumnFamily
+    from pycassa.batch import Mutator
+    instrument(ColumnFamily, list(ROW_COUNTERS) + list(GENERATOR_METHODS) + ['insert', 'batch_insert', 'remove', 'add'])
+    instrument(Mutator, ['send'])
+
+'''
+    Gets the URL pattern from config.urls that matches the path, with the
+    patterns of every include joined together.
+
+    @param path: The path of the request
+    @return: The pattern, or None if no pattern matches
+'''
+def routePattern(path, resolver=None):
+    resolver = resolver or get_resolver(None)
+    match = resolver.regex.search(path)
+    if not match:
+        return None
+    rest = path[match.end():]
+    for pattern in resolver.url_patterns:
+        if isinstance(pattern, RegexURLResolver):
+            found = routePattern(rest, pattern)
+            if found is not None:
+                return pattern.regex.pattern.strip('^$') + found
+        elif pattern.regex.search(rest):
+            return pattern.regex.pattern.strip('^$')
+    return None
+
+class MetricsMiddleware(object):
+    '''
+        Records the latency, datastore calls, rows read and bytes written of
+        every request under the route that served it.
+    '''
+
+    def __init__(self):
+        instrumentDatastore()
+
+    def process_request(self, request):
+        _local.request = RequestMetrics()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        metrics = current()
+        if metrics is not None:
+            metrics.route = routePattern(request.path_info)
+
+    def process_response(self, request, response):
+        metrics = current()
+        _local.request = None
+        if metrics is None:
+            return response
+
+        route = metrics.route or 'unmatched'
+        registry.observe(route, time.time() - metrics.start, metrics.calls, metrics.rows)
+        if getattr(response, 'streaming', False):
+            response.streaming_content = countBytes(response.streaming_content, route)
+        else:
+            registry.addBytes(route, len(response.content))
+        return response
+
+'''
+    Counts the bytes of a streamed response as they are sent.
+'''
+def countBytes(chunks, route):
+    size = 0
+    try:
+        for chunk in chunks:
+            size += len(chunk)
+            yield chunk
+    finally:
+        registry.addBytes(route, size)
@@ -0,0 +1,204 @@
+'''
+    The models of the marketplace that are stored in the marketplace
+    keyspace through rememerme.marketplace.pool.
+
+    @author: Andrew Oberlin, Jake Gregg
+'''
+from rememerme.marketplace import pool, deal, deckstats, search
+from rememerme.marketplace.cache import catalog
+from rememerme.marketplace.loaders import getByIDs, getPage
+from rememerme.marketplace.unitofwork import afterWrite
+from pycassa.cassandra.ttypes import NotFoundException as CassaNotFoundException
+import datetime
+import json
+import uuid
+
+class LazyColumnFamily(object):
+    '''
+        Gives a model class a table attribute like the pycassa models have
+        without connecting to Cassandra at import time.
+    '''
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        return pool.columnFamily(self.name)
+
+'''
+    Encodes datetimes the way they are stored in Cassandra.
+'''
+def encodeValue(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    raise TypeError('%r is not JSON serializable' % value)
+
+class CassaModel(object):
+    '''
+        Base of the marketplace models. The row key is stored under the
+        attribute named by key and every field is a JSON encoded column.
+    '''
+    key = None
+    fields = ()
+
+    def __init__(self, **kwargs):
+        setattr(self, self.key, kwargs.get(self.key))
+        for field in self.fields:
+            setattr(self, field, kwargs.get(field))
+
+    @classmethod
+    def fromMap(cls, mapRep):
+        return cls(**mapRep)
+
+    @classmethod
+    def fromCassa(cls, cassRep):
+        mapRep = dict((name, json.loads(value)) for name, value in cassRep[1].items() if name in cls.fields)
+        mapRep[cls.key] = str(cassRep[0])
+        return cls.fromMap(mapRep)
+
+    @classmethod
+    def getByID(cls, row_key):
+        return cls.fromCassa((str(row_key), cls.table.get(str(row_key))))
+
+    def toCassa(self):
+        return dict((field, json.dumps(getattr(self, field), default=encodeValue))
+                    for field in self.fields if getattr(self, field) is not None)
+
+    def save(self):
+        if not getattr(self, self.key):
+            setattr(self, self.key, str(uuid.uuid1()))
+        self.table.insert(str(getattr(self, self.key)), self.toCassa())
+
+'''
+    Gets the name of the column that sorts a row by the time it was created.
+'''
+def timeIndexName(created, row_key):
+    if hasattr(created, 'isoformat'):
+        created = created.isoformat()
+    return '%s:%s' % (created, row_key)
+
+class Deck(CassaModel):
+    '''
+        A deck of phrase or nomination cards for sale in the marketplace.
+        Decks are also indexed by their type in decks_by_type, newest first.
+    '''
+    table = LazyColumnFamily('deck')
+    type_index = LazyColumnFamily('decks_by_type')
+    key = 'deck_id'
+    fields = ('deck_type', 'title', 'description', 'tags', 'price', 'date_created', 'last_modified')
+
+    def save(self):
+        if not self.date_created:
+            self.date_created = datetime.datetime.now()
+        if not self.last_modified:
+            self.last_modified = self.date_created
+        super(Deck, self).save()
+        self.type_index.insert(str(self.deck_type), { timeIndexName(self.date_created, self.deck_id) : self.deck_id })
+        afterWrite(catalog.invalidate)
+        afterWrite(lambda: search.index.addDeck(self))
+
+    @classmethod
+    def filterByType(cls, deck_type, limit, cursor=None):
+        '''
+            Gets a page of the decks of a type, newest first.
+
+            @param cursor: The position the previous page ended on
+            @return: A tuple of the decks and the cursor of the next page
+        '''
+        columns, cursor = getPage(cls.type_index, deck_type, limit, cursor, column_reversed=True)
+        return getByIDs(cls, [deck_id for _, deck_id in columns], skip_missing=True), cursor
+
+class Purchase(CassaModel):
+    '''
+        A deck bought by a user. Purchases are also indexed per user in
+        user_purchases by the time they were made.
+    '''
+    table = LazyColumnFamily('purchase')
+    user_index = LazyColumnFamily('user_purchases')
+    key = 'purchase_id'
+    fields = ('user_id', 'deck_id', 'price', 'idempotency_key', 'date_created')
+
+    def save(self):
+        super(Purchase, self).save()
+        self.user_index.insert(str(self.user_id), { timeIndexName(self.date_created, self.purchase_id) : str(self.purchase_id) })
+
+    @classmethod
+    def filterByUser(cls, user_id, limit, cursor=None):
+        '''
+            Gets a page of the purchases of a user, newest first.
+
+            @param cursor: The position the previous page ended on
+            @return: A tuple of the purchases and the cursor of the next page
+        '''
+        columns, cursor = getPage(cls.user_index, user_id, limit, cursor, column_reversed=True)
+        return getByIDs(cls, [purchase_id for _, purchase_id in columns], skip_missing=True), cursor
+
+class DeckCard(object):
+    '''
+        The index of the cards in each deck.
+
+        deck_cards: deck_id -> { card_id : '' }
+    '''
+    table = LazyColumnFamily('deck_cards')
+
+    @classmethod
+    def add(cls, deck_id, card_ids, terms=None):
+        '''
+            Adds cards to a deck.
+
+            @param terms: The terms of the cards, in the order of card_ids, to search them by
+        '''
+        # cards written again by a rerun import aren't counted twice
+        new = set(str(card_id) for card_id in card_ids) - set(cls.cardsIn(deck_id, card_ids))
+        cls.table.insert(str(deck_id), dict((str(card_id), '') for card_id in card_ids))
+        deckstats.increment(deck_id, deckstats.CARDS, len(new))
+        afterWrite(lambda: deal.invalidate(deck_id))
+        if terms is not None:
+            afterWrite(lambda: search.index.addCards(deck_id, dict(zip(card_ids, terms))))
+
+    @classmethod
+    def remove(cls, deck_id, card_ids):
+        removed = cls.cardsIn(deck_id, card_ids)
+        cls.table.remove(str(deck_id), columns=[str(card_id) for card_id in card_ids])
+        deckstats.increment(deck_id, deckstats.CARDS, -len(removed))
+        afterWrite(lambda: deal.invalidate(deck_id))
+        afterWrite(lambda: search.index.removeCards(deck_id, card_ids))
+
+    @classmethod
+    def cardsIn(cls, deck_id, card_ids):
+        '''
+            Gets which of the cards are in the deck already.
+        '''
+        try:
+            return list(cls.table.get(str(deck_id), columns=[str(card_id) for card_id in card_ids]))
+        except CassaNotFoundException:
+            return []
+
+    @classmethod
+    def filterByDeck(cls, deck_id, limit, cursor=None):
+        '''
+            Gets a page of the card ids of a deck.
+
+            @return: A tuple of the card ids and the cursor of the next page
+        '''
+        columns, cursor = getPage(cls.table, deck_id, limit, cursor)
+        return [card_id for card_id, _ in columns], cursor
+
+    @classmethod
+    def iterByDeck(cls, deck_id, page_size):
+        '''
+            Iterates over all of the card ids of a deck in lists of page_size ids.
+        '''
+        page = []
+        try:
+            for card_id, _ in cls.table.xget(str(deck_id), buffer_size=page_size):
+                page.append(card_id)
+                if len(page) >= page_size:
+                    yield page
+                    page = []
+        except CassaNotFoundException:
+            pass
+        if page:
+            yield page
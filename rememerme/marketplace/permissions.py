@@ -0,0 +1,10 @@
+from rest_framework.permissions import BasePermission
+from django.conf import settings
+
+class IsContentAdmin(BasePermission):
+    '''
+        Only lets the users listed in settings.CONTENT_ADMINS manage deck content.
+    '''
+    
+    def has_permission(self, request, view):
+        return bool(request.user and request.user.pk in settings.CONTENT_ADMINS)
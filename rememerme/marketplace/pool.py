@@ -0,0 +1,340 @@
+'''
+    Manages the Cassandra connection pools for the marketplace.
+
+    One pycassa ConnectionPool is kept per node in settings.CASSANDRA_NODES
+    and every request picks a node either round robin or by the lowest
+    observed latency. A node that times out is taken out of rotation for
+    a while and the request fails over to the next node. A write that
+    can't safely be applied twice, a counter add or a compare-and-set, only
+    fails over when the node refused it outright; after a timeout it may
+    have been applied, so the error is raised to the caller instead.
+
+    @author: Andrew Oberlin, Jake Gregg
+'''
+from django.conf import settings
+from pycassa.pool import ConnectionPool, PoolListener, AllServersUnavailable,\
+    MaximumRetryException, NoConnectionAvailable
+from pycassa.columnfamily import ColumnFamily
+from pycassa.cassandra.ttypes import TimedOutException, UnavailableException,\
+    Column, ConsistencyLevel
+from rememerme.marketplace import metrics
+import itertools
+import random
+import socket
+import threading
+import time
+
+# errors after which the request is retried on another node
+FAILOVER_ERRORS = (TimedOutException, UnavailableException, MaximumRetryException,
+                   NoConnectionAvailable, AllServersUnavailable, socket.error)
+
+# errors that mean the request was never applied, so even a write that
+# isn't idempotent can be sent to another node
+NOT_APPLIED_ERRORS = (UnavailableException, NoConnectionAvailable, AllServersUnavailable)
+
+# weight of the newest sample in the moving average of a node's latency
+LATENCY_DECAY = 0.2
+
+class PoolStats(PoolListener):
+    '''
+        Counts what happens to the connections of a single node's pool.
+    '''
+
+    def __init__(self):
+        self.checkouts = 0
+        self.waits = 0
+        self.failures = 0
+        self.created = 0
+        # the error of the failed attempt of each thread's current request
+        self.attempt = threading.local()
+
+    def connection_created(self, dic):
+        self.created += 1
+
+    def connection_checked_out(self, dic):
+        self.checkouts += 1
+
+    def connection_failed(self, dic):
+        self.failures += 1
+        self.attempt.error = dic.get('error')
+
+    def cause(self, error):
+        '''
+            Gets the error a request failed with. With retries left to execute
+            the pool raises MaximumRetryException for every failed attempt,
+            but tells its listeners what the attempt failed with first.
+        '''
+        if isinstance(error, MaximumRetryException):
+            return getattr(self.attempt, 'error', None) or error
+        return error
+
+    def pool_at_max(self, dic):
+        self.waits += 1
+
+class Node(object):
+    '''
+        A single Cassandra node with its own connection pool.
+    '''
+
+    def __init__(self, server, pool, stats, down_interval):
+        self.server = server
+        self.pool = pool
+        self.stats = stats
+        self.down_interval = down_interval
+        self.latency = 0.0
+        self.timeouts = 0
+        self.down_until = 0.0
+        self.column_families = {}
+        self.lock = threading.Lock()
+
+    def isUp(self):
+        return time.time() >= self.down_until
+
+    def markDown(self):
+        self.timeouts += 1
+        self.down_until = time.time() + self.down_interval
+
+    def record(self, elapsed):
+        self.latency = elapsed if not self.latency else \
+            (1 - LATENCY_DECAY) * self.latency + LATENCY_DECAY * elapsed
+
+    def columnFamily(self, name):
+        # creating a ColumnFamily loads its schema so it is only done once per node
+        cf = self.column_families.get(name)
+        if cf is None:
+            with self.lock:
+                cf = self.column_families.get(name)
+                if cf is None:
+                    cf = ColumnFamily(self.pool, name)
+                    self.column_families[name] = cf
+        return cf
+
+    def toMap(self):
+        return {
+            'server' : self.server,
+            'up' : self.isUp(),
+            'latency_ms' : self.latency * 1000.0,
+            'size' : self.pool.size(),
+            'overflow' : self.pool.overflow(),
+            'checked_out' : self.pool.checkedout(),
+            'checkouts' : self.stats.checkouts,
+            'waits' : self.stats.waits,
+            'timeouts' : self.timeouts,
+            'failures' : self.stats.failures,
+            'connections_created' : self.stats.created
+        }
+
+class ConnectionManager(object):
+    '''
+        Chooses which node serves each request and fails over between them.
+    '''
+
+    def __init__(self, keyspace, servers, pool_size=5, max_overflow=10, pool_timeout=3,
+                 timeout=0.5, strategy='latency', down_interval=10):
+        if strategy not in ('latency', 'round_robin'):
+            raise ValueError('Unknown node selection strategy %s' % strategy)
+
+        self.strategy = strategy
+        self.nodes = []
+        for server in servers:
+            stats = PoolStats()
+            pool = ConnectionPool(keyspace, server_list=[server], pool_size=pool_size,
+                                  max_overflow=max_overflow, pool_timeout=pool_timeout,
+                                  timeout=timeout, prefill=False, listeners=[stats],
+                                  # retries are left to execute, which knows which calls are safe to repeat
+                                  max_retries=0)
+            self.nodes.append(Node(server, pool, stats, down_interval))
+        self.cycle = itertools.cycle(range(len(self.nodes)))
+        self.lock = threading.Lock()
+
+    def candidates(self):
+        '''
+            The nodes to try for a request in the order they should be tried.
+            Nodes that are down come last so they are still used if nothing
+            else is left.
+        '''
+        up = [node for node in self.nodes if node.isUp()]
+        down = [node for node in self.nodes if not node.isUp()]
+
+        if self.strategy == 'round_robin' or len(up) < 2:
+            with self.lock:
+                first = next(self.cycle)
+            ordered = self.nodes[first:] + self.nodes[:first]
+            return [n for n in ordered if n in up] + down
+
+        # power of two choices keeps all of the fast nodes busy instead of one
+        a, b = random.sample(up, 2)
+        best = a if a.latency <= b.latency else b
+        return [best] + sorted([n for n in up if n is not best], key=lambda n: n.latency) + down
+
+    def execute(self, fn, idempotent=True):
+        '''
+            Runs fn with a node, failing over to the next node when it times out.
+
+            @param fn: Called with the Node to use
+            @param idempotent: Whether fn can be applied twice, e.g. a read.
+                Otherwise it only fails over on the NOT_APPLIED_ERRORS.
+        '''
+        error = None
+        for node in self.candidates():
+            start = time.time()
+            node.stats.attempt.error = None
+            try:
+                result = fn(node)
+            except FAILOVER_ERRORS as e:
+                node.markDown()
+                if not idempotent and not isinstance(node.stats.cause(e), NOT_APPLIED_ERRORS):
+                    raise
+                error = e
+                continue
+            node.record(time.time() - start)
+            return result
+        raise error if error else AllServersUnavailable('No Cassandra nodes are configured.')
+
+    def columnFamily(self, name):
+        return ManagedColumnFamily(self, name)
+
+    def prewarm(self):
+        '''
+            Opens pool_size connections to every node so the first requests of
+            a new worker don't pay for the connection setup.
+        '''
+        for node in self.nodes:
+            try:
+                node.pool.fill()
+            except FAILOVER_ERRORS:
+                node.markDown()
+
+    def stats(self):
+        return {
+            'strategy' : self.strategy,
+            'nodes' : [node.toMap() for node in self.nodes]
+        }
+
+class ManagedColumnFamily(object):
+    '''
+        The part of the pycassa ColumnFamily interface used by the marketplace,
+        with every call sent to a node chosen by the ConnectionManager.
+    '''
+
+    def __init__(self, manager, name):
+        self.manager = manager
+        self.column_family = name
+
+    def _call(self, method, *args, **kwargs):
+        return self.manager.execute(
+            lambda node: getattr(node.columnFamily(self.column_family), method)(*args, **kwargs))
+
+    def _callOnce(self, method, *args, **kwargs):
+        return self.manager.execute(
+            lambda node: getattr(node.columnFamily(self.column_family), method)(*args, **kwargs),
+            idempotent=False)
+
+    def get(self, *args, **kwargs):
+        return self._call('get', *args, **kwargs)
+
+    def multiget(self, *args, **kwargs):
+        return self._call('multiget', *args, **kwargs)
+
+    def get_count(self, *args, **kwargs):
+        return self._call('get_count', *args, **kwargs)
+
+    def insert(self, *args, **kwargs):
+        return self._call('insert', *args, **kwargs)
+
+    def remove(self, *args, **kwargs):
+        return self._call('remove', *args, **kwargs)
+
+    def add(self, *args, **kwargs):
+        # a counter add applied twice counts twice
+        return self._callOnce('add', *args, **kwargs)
+
+    def cas(self, key, expected, updates):
+        '''
+            Atomically applies updates to the row if its columns still have the
+            expected values. This is Cassandra's lightweight transaction and
+            needs Cassandra 2.0 or later.
+
+            @param expected: Map of column name to value, None meaning the column must not exist
+            @param updates: Map of column name to the new value
+            @return: A tuple of whether it was applied and the current values of the expected columns
+        '''
+        timestamp = int(time.time() * 1e6)
+        expected_columns = [Column(name=name, value=value, timestamp=timestamp if value is not None else None)
+                            for name, value in expected.items()]
+        update_columns = [Column(name=name, value=value, timestamp=timestamp) for name, value in updates.items()]
+
+        def call(node):
+            return node.pool.execute('cas', key, self.column_family, expected_columns, update_columns,
+                                     ConsistencyLevel.SERIAL, ConsistencyLevel.QUORUM)
+
+        result = self.manager.execute(call, idempotent=False)
+        # cas skips the ColumnFamily so it is counted here
+        metrics.record('cas', 1)
+        current = dict((column.name, column.value) for column in (result.current_values or []))
+        return result.success, current
+
+    def nodeColumnFamily(self):
+        '''
+            Gets the pycassa ColumnFamily of the node the next request would use.
+        '''
+        return self.manager.candidates()[0].columnFamily(self.column_family)
+
+    def xget(self, *args, **kwargs):
+        # paging generators stay on the node they started on
+        return self.nodeColumnFamily().xget(*args, **kwargs)
+
+    def get_range(self, *args, **kwargs):
+        return self.nodeColumnFamily().get_range(*args, **kwargs)
+
+    def batch(self, queue_size=100):
+        return self.nodeColumnFamily().batch(queue_size=queue_size)
+
+_manager = None
+_manager_lock = threading.Lock()
+
+'''
+    Gets the connection manager of this process, building it from the
+    settings on first use.
+'''
+def getManager():
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                config = settings.CASSANDRA_POOL
+                _manager = ConnectionManager(settings.CASSANDRA_KEYSPACE, settings.CASSANDRA_NODES,
+                    pool_size=config['POOL_SIZE'], max_overflow=config['MAX_OVERFLOW'],
+                    pool_timeout=config['POOL_TIMEOUT'], timeout=config['TIMEOUT'],
+                    strategy=config['STRATEGY'], down_interval=config['DOWN_INTERVAL'])
+    return _manager
+
+'''
+    Replaces the connection manager of this process. Used to swap in the
+    in-memory store from rememerme.marketplace.testing.
+'''
+def setManager(manager):
+    global _manager
+    with _manager_lock:
+        _manager = manager
+
+'''
+    Gets a column family of the marketplace keyspace bound to the managed pools.
+
+    @param name: The name of the column family
+'''
+def columnFamily(name):
+    return getManager().columnFamily(name)
+
+
+'''
+    Opens the connections of every node's pool. Called when a WSGI worker starts.
+'''
+def prewarm():
+    getManager().prewarm()
+
+'''
+    Gets the pool statistics of every node for monitoring.
+'''
+def stats():
+    return getManager().stats()
@@ -0,0 +1,185 @@
+'''
+    The purchase pipeline: validate -> reserve funds -> grant entitlement -> commit.
+
+    A purchase is claimed before any money moves by a compare-and-set on the
+    deck's column in the user's entitlements row, so concurrent requests for
+    the same deck (retries, double clicks, reconnects) can't both go through.
+    The debit itself is a compare-and-set on the wallet ledger, so concurrent
+    purchases of different decks can't spend the same funds. Granting and
+    committing move the claim on with a compare-and-set too, so only one of
+    the requests racing through a purchase counts its sale. No lock is held
+    across requests.
+
+    entitlements: user_id -> { deck_id : claim }
+
+    @author: Andrew Oberlin, Jake Gregg
+'''
+from django.conf import settings
+from pycassa.cassandra.ttypes import NotFoundException as CassaNotFoundException
+from rememerme.marketplace import deckstats, entitlements, leaderboard, pool
+from rememerme.marketplace.ledger import Ledger
+from rememerme.marketplace.models import Deck, Purchase
+from rememerme.marketplace.unitofwork import UnitOfWork
+from rememerme.marketplace.rest.exceptions import DeckNotFound, DeckAlreadyOwned,\
+    PurchaseInProgress
+import datetime
+import json
+import time
+import uuid
+
+PENDING = 'pending'
+GRANTED = 'granted'
+COMMITTED = 'committed'
+
+# the purchase id of an idempotency key is the same on every retry
+PURCHASE_NAMESPACE = uuid.UUID('6c5b7a2e-1d3f-4a8e-9b0c-2f4e6d8a1c3b')
+
+'''
+    Gets the id of the purchase of a deck made by the user with the given
+    idempotency key. A key reused for another deck makes another purchase.
+'''
+def purchaseID(user_id, deck_id, idempotency_key):
+    return str(uuid.uuid5(PURCHASE_NAMESPACE, '%s:%s:%s' % (user_id, deck_id, idempotency_key)))
+
+class PurchasePipeline(object):
+    '''
+        Runs a purchase of a deck through each of the steps. Every step can
+        be repeated safely, so a retried request resumes wherever the
+        previous attempt stopped.
+    '''
+
+    def __init__(self, ledger=None, entitlements=None):
+        self.ledger = ledger if ledger is not None else Ledger()
+        self.entitlements = entitlements if entitlements is not None else pool.columnFamily('entitlements')
+
+    def submit(self, user_id, deck_id, idempotency_key=None):
+        '''
+            Buys the deck for the user exactly once.
+
+            @param idempotency_key: Identifies the purchase across retries. A new
+                one is made up when the client doesn't send one.
+            @return: The committed Purchase
+        '''
+        user_id, deck_id = str(user_id), str(deck_id)
+        idempotency_key = idempotency_key or str(uuid.uuid1())
+
+        deck = self.validate(deck_id)
+        claim = self.reserve(user_id, deck, idempotency_key)
+        if claim['status'] == PENDING:
+            claim = self.grant(user_id, deck, claim)
+        if claim['status'] == COMMITTED:
+            return Purchase.getByID(claim['purchase_id'])
+        return self.commit(user_id, deck, claim)
+
+    def validate(self, deck_id):
+        try:
+            return Deck.getByID(deck_id)
+        except CassaNotFoundException:
+            raise DeckNotFound()
+
+    def reserve(self, user_id, deck, idempotency_key):
+        '''
+            Claims the deck for this purchase and debits its price. A retry of a
+            claimed purchase gets back the claim as it stands.
+        '''
+        claim = {
+            'status' : PENDING,
+            'purchase_id' : purchaseID(user_id, deck.deck_id, idempotency_key),
+            'idempotency_key' : idempotency_key,
+            'price' : deck.price or 0,
+            'after' : self.ledger.head(user_id),
+            'date_created' : time.time()
+        }
+        applied, current = self.entitlements.cas(user_id, { deck.deck_id : None },
+                                                 { deck.deck_id : json.dumps(claim) })
+        if not applied:
+            return self.resume(user_id, deck, idempotency_key, current[deck.deck_id])
+
+        self.pay(user_id, deck, claim)
+        return claim
+
+    def resume(self, user_id, deck, idempotency_key, stored):
+        claim = json.loads(stored)
+        if claim['idempotency_key'] != idempotency_key:
+            if claim['status'] == PENDING:
+                raise PurchaseInProgress()
+            raise DeckAlreadyOwned()
+
+        if claim['status'] != PENDING:
+            return claim
+
+        # a pending claim is only picked up once its request has given up on
+        # it and only by one retry, the one that wins the compare-and-set
+        if time.time() - claim.get('resumed', claim['date_created']) < settings.PURCHASES['PENDING_TIMEOUT']:
+            raise PurchaseInProgress()
+        claim['resumed'] = time.time()
+        applied, _ = self.entitlements.cas(user_id, { deck.deck_id : stored },
+                                           { deck.deck_id : json.dumps(claim) })
+        if not applied:
+            raise PurchaseInProgress()
+
+        if not self.debited(user_id, claim):
+            self.pay(user_id, deck, claim)
+        return claim
+
+    def pay(self, user_id, deck, claim):
+        try:
+            if claim['price']:
+                self.ledger.debit(user_id, claim['price'], claim['purchase_id'])
+        except Exception:
+            # a debit whose answer was lost may still have been taken, then the
+            # claim is left pending for a retry to finish
+            if not claim['price'] or not self.debited(user_id, claim):
+                # the funds were never taken so the deck can be bought again
+                self.entitlements.remove(user_id, columns=[deck.deck_id])
+            raise
+
+    def debited(self, user_id, claim):
+        return self.ledger.find(user_id, claim['purchase_id'], claim['after']) is not None
+
+    def advance(self, user_id, deck, claim, status):
+        '''
+            Moves the claim on to the status with a compare-and-set, so of the
+            requests racing through a step (e.g. a slow request and its retry)
+            only one makes it.
+
+            @return: A tuple of whether this request moved the claim and the claim as it stands
+        '''
+        stored = json.dumps(claim)
+        while True:
+            moved = dict(claim, status=status)
+            applied, current = self.entitlements.cas(user_id, { deck.deck_id : stored },
+                                                     { deck.deck_id : json.dumps(moved) })
+            if applied:
+                return True, moved
+            stored = current.get(deck.deck_id)
+            if stored is None:
+                return False, claim
+            current = json.loads(stored)
+            if current['purchase_id'] != claim['purchase_id'] or current['status'] != claim['status']:
+                return False, current
+            # still at the same step, but resumed or stored with its columns in another order
+            claim = current
+
+    def grant(self, user_id, deck, claim):
+        _, claim = self.advance(user_id, deck, claim, GRANTED)
+        return claim
+
+    def commit(self, user_id, deck, claim):
+        '''
+            Writes the purchase record and commits the claim. Writing the record
+            again on a retry stores the same row, and only the request that
+            commits the claim counts the sale.
+        '''
+        purchase = Purchase(purchase_id=claim['purchase_id'], user_id=user_id, deck_id=deck.deck_id,
+                            price=claim['price'], idempotency_key=claim['idempotency_key'],
+                            date_created=datetime.datetime.fromtimestamp(claim['date_created']))
+        # the purchase and its index entry go in one batch
+        with UnitOfWork():
+            purchase.save()
+        committed, _ = self.advance(user_id, deck, claim, COMMITTED)
+        if committed:
+            deckstats.increment(deck.deck_id, deckstats.PURCHASES)
+            leaderboard.recordSale(deck.deck_id)
+        entitlements.grant(user_id, deck.deck_id)
+        return purchase
@@ -0,0 +1,251 @@
+'''
+    Token bucket rate limits shared by every worker process of a host.
+
+    A route is limited by passing limit() as the extra arguments of its url
+    in config.urls, e.g. limit('purchases', user='30/m', ip='120/m'). Every
+    request to the route takes a token from the bucket of its user, then
+    from the bucket of its IP address. A bucket holds as many tokens as the rate
+    allows per period and refills at that rate. A request finding a bucket
+    empty gets a 429 with a Retry-After of when the bucket has a token again.
+
+    The user of a request is known before the view authenticates it when
+    its session is in the session cache. Otherwise the credential it sent
+    stands in for the user.
+
+    The buckets live in a file mapped into every worker (SharedStore), by
+    default on /dev/shm. The file is a hash table of fixed groups of slots,
+    each slot holding the hash of a bucket's key, its tokens and when it was
+    last taken from. A group is updated under a lock on its byte of the file
+    (and a thread lock, as file locks don't exclude the threads of one
+    process). A bucket missing from a full group replaces the one taken from
+    least recently, which has refilled the most. Without RATE_LIMIT['PATH']
+    the buckets are kept in the memory of each process (MemoryStore).
+
+    @author: Andrew Oberlin, Jake Gregg
+'''
+from django.conf import settings
+from django.http import HttpResponse
+from rememerme.marketplace import auth
+from collections import OrderedDict
+import fcntl
+import hashlib
+import json
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+
+PERIODS = { 's' : 1.0, 'm' : 60.0, 'h' : 3600.0, 'd' : 86400.0 }
+
+# key hash, tokens, time last taken from
+SLOT = struct.Struct('<Qdd')
+
+# the slots a key can be kept in
+GROUP_SIZE = 8
+
+# the thread locks the groups are spread over
+THREAD_LOCKS = 256
+
+'''
+    Parses a rate like 30/m into the size of the bucket and the tokens
+    added back per second.
+'''
+def parseRate(rate):
+    count, _, period = rate.partition('/')
+    count = int(count)
+    return count, count / PERIODS[period[:1]]
+
+'''
+    Takes a token from a bucket.
+
+    @return: A tuple of whether a token was taken, the tokens left and the
+        seconds until there is a token if there wasn't one
+'''
+def refill(tokens, updated, capacity, per_second, now):
+    tokens = min(float(capacity), tokens + max(0.0, now - updated) * per_second)
+    if tokens >= 1.0:
+        return True, tokens - 1.0, 0.0
+    return False, tokens, (1.0 - tokens) / per_second
+
+class MemoryStore(object):
+    '''
+        The buckets of one process, at most max_size of them.
+    '''
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def take(self, key, capacity, per_second, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            tokens, updated = self.buckets.pop(key, (capacity, now))
+            allowed, tokens, wait = refill(tokens, updated, capacity, per_second, now)
+            self.buckets[key] = (tokens, now)
+            if len(self.buckets) > self.max_size:
+                self.buckets.popitem(last=False)
+        return allowed, wait
+
+class SharedStore(object):
+    '''
+        The buckets of every process that maps the file at path.
+
+        @param slots: The buckets the file holds, rounded up to whole groups
+    '''
+
+    def __init__(self, path, slots):
+        self.groups = max(1, int(math.ceil(float(slots) / GROUP_SIZE)))
+        size = self.groups * GROUP_SIZE * SLOT.size
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        # a new file is all empty slots
+        fcntl.lockf(self.fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self.fd).st_size < size:
+                os.ftruncate(self.fd, size)
+        finally:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN)
+        self.map = mmap.mmap(self.fd, size)
+        self.locks = [threading.Lock() for _ in range(min(THREAD_LOCKS, self.groups))]
+
+    def take(self, key, capacity, per_second, now=None):
+        now = time.time() if now is None else now
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        # 0 marks an empty slot
+        digest = struct.unpack('<Q', hashlib.md5(key).digest()[:8])[0] or 1
+        group = digest % self.groups
+        base = group * GROUP_SIZE * SLOT.size
+
+        with self.locks[group % len(self.locks)]:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, 1, group)
+            try:
+                slot, tokens, updated = None, capacity, now
+                stalest = None
+                for offset in range(base, base + GROUP_SIZE * SLOT.size, SLOT.size):
+                    stored, stored_tokens, stored_updated = SLOT.unpack_from(self.map, offset)
+                    if stored == digest:
+                        slot, tokens, updated = offset, stored_tokens, stored_updated
+                        break
+                    if stored == 0:
+                        # slots are never emptied, so the key isn't further on
+                        slot = offset
+                        break
+                    if stalest is None or stored_updated < stalest[1]:
+                        stalest = (offset, stored_updated)
+                if slot is None:
+                    slot = stalest[0]
+
+                allowed, tokens, wait = refill(tokens, updated, capacity, per_second, now)
+                SLOT.pack_into(self.map, slot, digest, tokens, now)
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, group)
+        return allowed, wait
+
+    def close(self):
+        self.map.close()
+        os.close(self.fd)
+
+class Limit(object):
+    '''
+        The rate limits of a route.
+
+        @param name: Names the buckets of the route, routes of the same
+            name share them
+        @param user: The rate of each user, e.g. 30/m
+        @param ip: The rate of each IP address
+        @param methods: The methods limited, all of them if None
+    '''
+
+    def __init__(self, name, user=None, ip=None, methods=None):
+        self.name = name
+        self.user = parseRate(user) if user else None
+        self.ip = parseRate(ip) if ip else None
+        self.methods = frozenset(method.upper() for method in methods) if methods else None
+
+'''
+    Gets the extra url arguments that rate limit a route.
+
+    @return: The arguments for url() in config.urls
+'''
+def limit(name, user=None, ip=None, methods=None):
+    return { 'rate_limit' : Limit(name, user, ip, methods) }
+
+_store = None
+_store_lock = threading.Lock()
+
+'''
+    Gets the store of the buckets, opening it the first time.
+'''
+def getStore():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                config = settings.RATE_LIMIT
+                _store = SharedStore(config['PATH'], config['SLOTS']) if config['PATH'] else MemoryStore(config['SLOTS'])
+    return _store
+
+'''
+    Replaces the store of the buckets, e.g. with a MemoryStore in tests.
+'''
+def setStore(store):
+    global _store
+    _store = store
+
+'''
+    Gets who a request is made by before the view authenticates it.
+'''
+def userKey(request):
+    key = auth.sessionKey(request)
+    if key is None:
+        return None
+    result = auth.sessions.peek(key)
+    return 'user:%s' % result[0].pk if result is not None else 'session:%s' % key
+
+'''
+    Takes a token from each bucket of a request.
+
+    @return: The seconds to wait if a bucket was empty, otherwise None
+'''
+def check(request, rule, store=None):
+    store = store or getStore()
+    buckets = []
+    if rule.user:
+        user = userKey(request)
+        if user is not None:
+            buckets.append((user, rule.user))
+    if rule.ip:
+        buckets.append(('ip:%s' % request.META.get('REMOTE_ADDR'), rule.ip))
+
+    # a user over their limit stops here, so they don't use up the tokens
+    # of the others sharing their address
+    for key, (capacity, per_second) in buckets:
+        allowed, wait = store.take('%s:%s' % (rule.name, key), capacity, per_second)
+        if not allowed:
+            return wait
+    return None
+
+class RateLimitMiddleware(object):
+    '''
+        Answers a request to a rate limited route with a 429 once one of its
+        buckets is empty.
+    '''
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # the rule is taken out so the view never sees it
+        rule = view_kwargs.pop('rate_limit', None)
+        if rule is None or not settings.RATE_LIMIT['ENABLED']:
+            return None
+        if rule.methods is not None and request.method not in rule.methods:
+            return None
+
+        wait = check(request, rule)
+        if wait is None:
+            return None
+        response = HttpResponse(json.dumps({ 'detail' : 'Slow down, too many requests.' }),
+                                status=429, content_type='application/json')
+        response['Retry-After'] = str(int(math.ceil(wait)))
+        return response
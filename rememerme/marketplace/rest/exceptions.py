@@ -6,6 +6,12 @@ class BadRequestException(APIException):
     '''
     status_code = 400
     detail = "A Bad Request was made for the API. Revise input parameters."
+
+class InvalidParameters(BadRequestException):
+    '''
+        Parameters of the request were missing or invalid. The detail maps
+        each of them to what was wrong with it.
+    '''
     
 class InvalidWinningScore(APIException):
     '''
@@ -90,3 +96,45 @@ class PhraseCardNotFound(APIException):
     '''
     status_code = 404
     detail = "That phrase card that does not exist."
+
+class DeckNotFound(APIException):
+    '''
+        The deck requested was not found.
+    '''
+    status_code = 404
+    detail = "We don't sell that deck."
+
+class DeckNotOwned(APIException):
+    '''
+        The user hasn't bought the paid deck they tried to play with.
+    '''
+    status_code = 403
+    detail = "You have to buy that deck before you can play with it."
+
+class InsufficientFunds(APIException):
+    '''
+        The wallet does not hold enough to pay for the purchase.
+    '''
+    status_code = 402
+    detail = "Your wallet is a little light for that one."
+
+class DeckAlreadyOwned(APIException):
+    '''
+        The user already bought the deck.
+    '''
+    status_code = 409
+    detail = "You already own that deck."
+
+class PurchaseInProgress(APIException):
+    '''
+        Another request for the same purchase has not finished yet.
+    '''
+    status_code = 409
+    detail = "That purchase is already being made. Try again in a moment."
+
+class PurchaseNotFound(APIException):
+    '''
+        The purchase requested was not found.
+    '''
+    status_code = 404
+    detail = "You never bought that."
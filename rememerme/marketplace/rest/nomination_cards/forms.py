@@ -17,14 +17,26 @@ from pycassa.cassandra.ttypes import NotFoundException as CassaNotFoundException
 import datetime
 import json
 from rememerme.games.permissions import GamePermissions
-from rememerme.users.client import UserClient, UserClientError
+from rememerme.marketplace import memberships
+from rememerme.marketplace.loaders import getByIDs
+from rememerme.marketplace.users import existingUsers
+from rememerme.marketplace.unitofwork import UnitOfWork
+from rememerme.marketplace.models import Deck, DeckCard
+from rememerme.marketplace.importer import CardImporter, readRows, FORMATS
+from rememerme.marketplace.streaming import streamCards, streamJSON
+from django.http import StreamingHttpResponse
+from django.conf import settings
+from rememerme.marketplace.rest.exceptions import DeckNotFound
+from rememerme.cards.models import NominationCard
+from rememerme.cards.serializers import NominationCardSerializer
+from config.util import getLimit, getCursor
 
 class GamesListGetForm(forms.Form):
 
     def submit(self, request):
         try:
             game_memberships = GameMember.filterByUser(request.user.pk)
-            games = [Game.getByID(mem.game_id) for mem in game_memberships]
+            games = getByIDs(Game, [mem.game_id for mem in game_memberships])
         except CassaNotFoundException:
             raise GameNotFound()
         return GameSerializer(games, many=True).data
@@ -64,26 +76,37 @@ class GamesPostForm(forms.Form):
         game_members = self.cleaned_data['game_members']
         del self.cleaned_data['game_members']
         self.cleaned_data['leader_id'] = UUID(request.user.pk)
-        game = Game.fromMap(self.cleaned_data)
-        game.save()
-        
-        members_added = {}
         
+        user_ids = []
         for mem in game_members:
             try:
-                mem = str(UUID(mem))
-                UserClient(request.auth).get(mem)
-                # user exists so let's add him/her
-                now = datetime.datetime.now()
+                user_ids.append(str(UUID(mem)))
+            except ValueError:
+                continue
+        
+        # every invitee is looked up at once instead of one call after another
+        existing = existingUsers(request.auth, user_ids)
+        
+        members_added = {}
+        now = datetime.datetime.now()
+        
+        # the game and all of its members are written in one batch
+        with UnitOfWork():
+            game = Game.fromMap(self.cleaned_data)
+            game.save()
+            
+            for mem in user_ids:
+                if mem not in existing:
+                    continue
+                # a user listed twice is only added once
+                existing.discard(mem)
                 member = GameMember(game_member_id=str(uuid.uuid1()), game_id=UUID(game.game_id), user_id=UUID(mem), status=1, date_created=now, last_modified=now)
-                member.save()
+                memberships.save(member)
                 members_added[member.game_member_id] = now
-            except ValueError, UserClientError:
-                continue
-       
-        member = GameMember(game_member_id=str(uuid.uuid1()), score=0, game_id=UUID(game.game_id), user_id=UUID(request.user.pk), status=2, date_created=now, last_modified=now)
-        member.save()
-        members_added[member.game_member_id] = now 
+            
+            member = GameMember(game_member_id=str(uuid.uuid1()), score=0, game_id=UUID(game.game_id), user_id=UUID(request.user.pk), status=2, date_created=now, last_modified=now)
+            memberships.save(member)
+            members_added[member.game_member_id] = now 
 
         serialized = GameSerializer(game).data
         serialized['game_members'] = members_added
@@ -110,10 +133,76 @@ class GamesSingleGetForm(forms.Form):
 
 class GameRequestsForm(forms.Form):
     def submit(self, request):
-        requests = [gm for gm in GameMember.filterByUser(request.user.pk) if gm.status == 1]
+        requests = memberships.filterByStatus(request.user.pk, memberships.INVITED)
         return GameMemberSerializer(requests, many=True).data
+
+'''
+    Gets a page of the cards in a deck.
+'''
+class NominationCardsListGetForm(forms.Form):
+    deck_id = forms.CharField()
+    limit = forms.IntegerField(required=False, min_value=1)
+    cursor = forms.CharField(required=False)
+    stream = forms.BooleanField(required=False)
+    
+    def clean(self):
+        try:
+            self.cleaned_data['deck_id'] = str(UUID(self.cleaned_data['deck_id']))
+        except ValueError:
+            raise DeckNotFound()
+        try:
+            self.cleaned_data['cursor'] = getCursor(self.cleaned_data)
+        except ValueError:
+            raise BadRequestException()
+        self.cleaned_data['limit'] = getLimit(self.cleaned_data)
+        return self.cleaned_data
+    
+    def submit(self, request):
+        card_ids, self.next_cursor = DeckCard.filterByDeck(self.cleaned_data['deck_id'], self.cleaned_data['limit'],
+                                                           self.cleaned_data['cursor'])
+        return NominationCardSerializer(getByIDs(NominationCard, card_ids, skip_missing=True), many=True).data
+    
+    def streamResponse(self, request):
+        '''
+            Streams every card of the deck as one JSON list, reading the deck a
+            page at a time so memory stays flat however big the deck is.
+        '''
+        serialize = lambda cards: NominationCardSerializer(cards, many=True).data
+        pages = streamCards(NominationCard, self.cleaned_data['deck_id'], serialize, settings.STREAM_PAGE_SIZE)
+        return StreamingHttpResponse(streamJSON(pages), content_type='application/json')
+
+'''
+    Imports a CSV or NDJSON file of cards into a deck.
+'''
+class NominationCardImportForm(forms.Form):
+    deck_id = forms.CharField()
+    file = forms.FileField()
+    format = forms.ChoiceField(choices=[(f, f) for f in FORMATS], required=False)
+    batch_size = forms.IntegerField(required=False, min_value=1, max_value=5000)
+    
+    def clean(self):
+        try:
+            self.cleaned_data['deck_id'] = str(UUID(self.cleaned_data['deck_id']))
+        except ValueError:
+            raise DeckNotFound()
         
+        if not self.cleaned_data.get('format'):
+            name = self.cleaned_data['file'].name.lower()
+            self.cleaned_data['format'] = 'csv' if name.endswith('.csv') else 'ndjson'
+        return self.cleaned_data
+    
+    def submit(self, request):
+        '''
+            Streams the uploaded file into the deck.
+            
+            @return: The import summary with the report of every batch
+        '''
+        try:
+            deck = Deck.getByID(self.cleaned_data['deck_id'])
+        except CassaNotFoundException:
+            raise DeckNotFound()
+        if deck.deck_type != 'nomination':
+            raise DeckNotFound()
         
-        
-        
-
+        importer = CardImporter(NominationCard, deck.deck_id, self.cleaned_data['batch_size'])
+        return importer.run(readRows(self.cleaned_data['file'], self.cleaned_data['format']))
@@ -1,9 +1,8 @@
 from django.conf.urls import patterns, url
 
-from rememerme.games.rest.games import views
+from rememerme.marketplace.rest.nomination_cards import views
 
 urlpatterns = patterns('',
-    url(r'^/requests/?', views.GameRequestView.as_view()),
-    url(r'^/(?P<game_id>[-\w]+)/?', views.GamesSingleView.as_view()),
-    url(r'^/?$', views.GamesListView.as_view())
+    url(r'^/import/?$', views.CardsImportView.as_view()),
+    url(r'^/?$', views.CardsListView.as_view())
 )
@@ -6,11 +6,11 @@
 
     @author: Andrew Oberlin, Jake Gregg
 '''
-from django import forms
-from rememerme.games.models import Game, Round, GameMember, Nomination
+from rememerme.games.models import Game, Round, Nomination
 from rememerme.cards.models import PhraseCard, NominationCard
 from rememerme.games.rest.exceptions import NoCurrentRound, RoundNotFound, \
-    GameNotFound, GameAlreadyStarted, AlreadyNominated, InvalidNominationCard, NotTheSelector
+    GameNotFound, GameAlreadyStarted, AlreadyNominated, InvalidNominationCard, NotTheSelector,\
+    GameMemberNotFound
 from rememerme.games.serializers import RoundSerializer, NominationSerializer
 from uuid import UUID
 from pycassa.cassandra.ttypes import NotFoundException as CassaNotFoundException
@@ -18,24 +18,17 @@ import datetime
 import random
 from rememerme.games.permissions import GamePermissions
 from rest_framework.exceptions import PermissionDenied
+from rememerme.marketplace import deal, deckstats, entitlements, memberships
+from rememerme.marketplace.rest.exceptions import DeckNotOwned
+from rememerme.marketplace.schema import Schema, SchemaForm, UUIDField
 
 '''
     Gets all friend requests recieved and returns them to the user.
 
     @return: A list of requests matching the query with the given offset/limit
 '''        
-class StartGameForm(forms.Form):
-    game_id = forms.CharField(required=True)
-    deck_id = forms.CharField(required=True)
-    
-    def clean(self):
-        try:
-            self.cleaned_data['game_id'] = str(UUID(self.cleaned_data['game_id']))
-            self.cleaned_data['deck_id'] = str(UUID(self.cleaned_data['deck_id']))
-        except ValueError:
-            raise GameNotFound()
-        return self.cleaned_data
-    
+class StartGameForm(SchemaForm):
+    schema = Schema(game_id=UUIDField(error=GameNotFound), deck_id=UUIDField(error=GameNotFound))
     
     '''
         Submits the form and returns the friend requests received for the user.
@@ -51,13 +44,20 @@ class StartGameForm(forms.Form):
         if not GamePermissions.has_object_permission(request, game):
             raise PermissionDenied()
         
+        # paid decks can only be played by the users who bought them
+        if not entitlements.canPlay(request.user.pk, self.cleaned_data['deck_id']):
+            raise DeckNotOwned()
+        
         # select randomly from the game members
-        game_members = GameMember.filterByGame(game.game_id)
-        selector = random.choice(game_members)
+        selector_id = random.choice(list(memberships.memberIDs(game.game_id)))
         
         now = datetime.datetime.now()
         
-        round = Round(selector_id=selector.user_id, phrase_card_id=PhraseCard.getRandom(self.cleaned_data['deck_id']).phrase_card_id,
+        # deal from a fresh shuffle of the deck, falling back for decks with no card index
+        phrase_card_id = deal.start(game.game_id, self.cleaned_data['deck_id']) or \
+            PhraseCard.getRandom(self.cleaned_data['deck_id']).phrase_card_id
+        
+        round = Round(selector_id=UUID(selector_id), phrase_card_id=phrase_card_id,
             game_id=game.game_id, date_created=now, last_modified=now)
         
         round.save()
@@ -65,6 +65,7 @@ class StartGameForm(forms.Form):
         game.deck = self.cleaned_data['deck_id']
         game.current_round_id = round.round_id
         game.save()
+        deckstats.recordPlay(game.deck, game.game_id)
 
         return RoundSerializer(round).data
     
@@ -73,16 +74,8 @@ class StartGameForm(forms.Form):
 
     @return: Validation of accepting the request.
 '''
-class RoundForm(forms.Form):
-    game_id = forms.CharField(required=True)
-    
-    def clean(self):
-        cleaned_data = super(RoundForm, self).clean()
-        try:
-            cleaned_data['game_id'] = str(UUID(cleaned_data['game_id']))
-        except ValueError:
-            raise GameNotFound()
-        return cleaned_data
+class RoundForm(SchemaForm):
+    schema = Schema(game_id=UUIDField(error=GameNotFound))
     
     def submit(self, request):
         game_id = self.cleaned_data['game_id']
@@ -110,15 +103,8 @@ class RoundForm(forms.Form):
 
     @return: confirmation that the request was denied.
 '''
-class NominationsGetForm(forms.Form):
-    game_id = forms.CharField(required=True)
-    
-    def clean(self):
-        try:
-            self.cleaned_data['game_id'] = str(UUID(self.cleaned_data['game_id']))
-            return self.cleaned_data
-        except ValueError:
-            raise GameNotFound()
+class NominationsGetForm(SchemaForm):
+    schema = Schema(game_id=UUIDField(error=GameNotFound))
     
     '''
         Submits the form to deny the friend request.
@@ -139,17 +125,8 @@ class NominationsGetForm(forms.Form):
 
     @return: confirmation that the request was denied.
 '''
-class NominationsPostForm(forms.Form):
-    game_id = forms.CharField(required=True)
-    nomination_card_id = forms.CharField(required=True)
-    
-    def clean(self):
-        try:
-            self.cleaned_data['game_id'] = str(UUID(self.cleaned_data['game_id']))
-            self.cleaned_data['nomination_card_id'] = str(UUID(self.cleaned_data['nomination_card_id']))
-            return self.cleaned_data
-        except ValueError:
-            raise GameNotFound()
+class NominationsPostForm(SchemaForm):
+    schema = Schema(game_id=UUIDField(error=GameNotFound), nomination_card_id=UUIDField(error=GameNotFound))
     
     '''
         Submits the form to deny the friend request.
@@ -184,17 +161,8 @@ class NominationsPostForm(forms.Form):
 
     @return: confirmation that the request was denied.
 '''
-class SelectionForm(forms.Form):
-    game_id = forms.CharField(required=True)
-    selection_id = forms.CharField(required=True)
-    
-    def clean(self):
-        try:
-            self.cleaned_data['game_id'] = str(UUID(self.cleaned_data['game_id']))
-            self.cleaned_data['selection_id'] = str(UUID(self.cleaned_data['selection_id']))
-            return self.cleaned_data
-        except ValueError:
-            raise GameNotFound()
+class SelectionForm(SchemaForm):
+    schema = Schema(game_id=UUIDField(error=GameNotFound), selection_id=UUIDField(error=GameNotFound))
     
     '''
         Submits the form to deny the friend request.
@@ -226,22 +194,21 @@ class SelectionForm(forms.Form):
         round.selection_id = self.cleaned_data['selection_id']
         round.save()
         
-        game_members = GameMember.filterByGame(game.game_id)
         # finds the game state that should be updated
-        member = None
-        for m in game_members:
-            if str(m.user_id) == str(nomination.nominator_id):
-                member = m
-                break
+        member = memberships.findMember(game.game_id, nomination.nominator_id)
+        if member is None:
+            raise GameMemberNotFound()
         
         member.score += 10
         member.save()
         
         # creates a new round, saves it and the game
         now = datetime.datetime.now()
-        selector = random.choice(game_members)
+        selector_id = random.choice(list(memberships.memberIDs(game.game_id)))
+        
+        phrase_card_id = deal.draw(game.game_id, game.deck) or PhraseCard.getRandom(game.deck).phrase_card_id
         
-        new_round = Round(selector_id=selector.user_id, phrase_card_id=PhraseCard.getRandom(game.deck).phrase_card_id,
+        new_round = Round(selector_id=UUID(selector_id), phrase_card_id=phrase_card_id,
             game_id=game.game_id, date_created=now, last_modified=now)
         
         new_round.save()
@@ -1,3 +1,342 @@
-from django.test import TestCase
+from django.conf import settings
+from django import forms
+from django.test import SimpleTestCase
+from django.test.client import Client
+from rememerme.games.rest.exceptions import GameNotFound
+from rememerme.marketplace import pool, deal, deckstats, harness, identity, memberships
+from rememerme.marketplace.bench import benchmark, measure
+from rememerme.marketplace.ledger import Ledger
+from rememerme.marketplace.models import Deck, DeckCard
+from rememerme.marketplace.purchasing import PurchasePipeline
+from rememerme.marketplace.rest.exceptions import InvalidParameters
+from rememerme.marketplace.rest.nomination_decks.forms import SelectionForm
+# loaded before the fakes are installed so their models are swapped too
+from rememerme.marketplace.rest.nomination_decks import views
+from rememerme.marketplace.rest.wallet.forms import GamesPostForm
+from rememerme.marketplace.testing import MemoryManager, memory_model
+from rememerme.marketplace.unitofwork import UnitOfWork
+from uuid import UUID
+import datetime
+import json
+import time
+import uuid
 
-# Create your tests here.
+class DealTest(SimpleTestCase):
+    
+    def setUp(self):
+        self.manager = MemoryManager()
+        pool.setManager(self.manager)
+        self.deck_id = str(uuid.uuid1())
+        self.card_ids = [str(uuid.uuid4()) for _ in range(50)]
+        DeckCard.add(self.deck_id, self.card_ids)
+    
+    def tearDown(self):
+        deal.invalidate(self.deck_id)
+        pool.setManager(None)
+    
+    def test_deals_without_replacement(self):
+        game_id = str(uuid.uuid1())
+        dealt = [deal.start(game_id, self.deck_id)]
+        
+        deck_reads = self.manager.columnFamily('deck_cards').calls
+        for _ in range(49):
+            dealt.append(deal.draw(game_id, self.deck_id))
+        
+        self.assertEqual(sorted(dealt), sorted(self.card_ids))
+        # the deck was read once, not once per round
+        self.assertEqual(self.manager.columnFamily('deck_cards').calls, deck_reads)
+        # a finished deck is shuffled again
+        self.assertTrue(deal.draw(game_id, self.deck_id) in self.card_ids)
+    
+    def test_games_shuffle_separately(self):
+        first = [deal.start('game-1', self.deck_id)] + [deal.draw('game-1', self.deck_id) for _ in range(9)]
+        second = [deal.start('game-2', self.deck_id)] + [deal.draw('game-2', self.deck_id) for _ in range(9)]
+        self.assertNotEqual(first, second)
+    
+    def test_new_cards_reshuffle(self):
+        game_id = str(uuid.uuid1())
+        deal.start(game_id, self.deck_id)
+        added = str(uuid.uuid4())
+        DeckCard.add(self.deck_id, [added])
+        
+        dealt = [deal.draw(game_id, self.deck_id) for _ in range(51)]
+        self.assertEqual(sorted(dealt), sorted(self.card_ids + [added]))
+    
+    def test_removed_cards_leave_the_deck(self):
+        with UnitOfWork():
+            DeckCard.remove(self.deck_id, self.card_ids[1:])
+            # a game started before the removal is written
+            deal.start('game-1', self.deck_id)
+        self.assertEqual(deal.start('game-2', self.deck_id), self.card_ids[0])
+    
+    def test_empty_deck(self):
+        self.assertEqual(deal.start('game', str(uuid.uuid1())), None)
+
+class MemberLookupTest(SimpleTestCase):
+    '''
+        Finding one user's membership of a game should be a point read.
+    '''
+    
+    def setUp(self):
+        self.manager = MemoryManager()
+        pool.setManager(self.manager)
+        self.GameMember = memory_model('game_member', 'game_member_id', filters={ 'filterByGame' : 'game_id' })
+        self.real, memberships.GameMember = memberships.GameMember, self.GameMember
+        self.game_id = str(uuid.uuid1())
+        self.user_ids = [str(uuid.uuid1()) for _ in range(20)]
+        self.scans = 0
+        scan = self.GameMember.filterByGame
+        
+        def filterByGame(game_id):
+            self.scans += 1
+            return scan(game_id)
+        self.GameMember.filterByGame = staticmethod(filterByGame)
+    
+    def tearDown(self):
+        memberships.GameMember = self.real
+        pool.setManager(None)
+    
+    def addMembers(self, save):
+        for user_id in self.user_ids:
+            save(self.GameMember(game_member_id=str(uuid.uuid1()), game_id=self.game_id, user_id=user_id, status=2))
+    
+    def test_members_are_point_reads(self):
+        self.addMembers(memberships.save)
+        
+        member_reads = self.GameMember.table.calls
+        member = memberships.findMember(self.game_id, self.user_ids[7])
+        self.assertEqual(str(member.user_id), self.user_ids[7])
+        self.assertTrue(memberships.isMember(self.game_id, self.user_ids[3]))
+        # one point read of the member itself and no scans
+        self.assertEqual(self.GameMember.table.calls - member_reads, 1)
+        self.assertEqual(sorted(memberships.memberIDs(self.game_id)), sorted(self.user_ids))
+    
+    def test_members_added_without_save_are_found(self):
+        self.addMembers(memberships.save)
+        user_id = str(uuid.uuid1())
+        # e.g. added by the games service
+        self.GameMember(game_member_id=str(uuid.uuid1()), game_id=self.game_id, user_id=user_id, status=2).save()
+        
+        self.assertEqual(str(memberships.findMember(self.game_id, user_id).user_id), user_id)
+        calls = self.GameMember.table.calls
+        self.assertTrue(memberships.isMember(self.game_id, user_id))
+        self.assertEqual(self.GameMember.table.calls, calls)
+        self.assertFalse(memberships.isMember(self.game_id, str(uuid.uuid1())))
+    
+    def test_old_games_are_backfilled(self):
+        self.addMembers(lambda member: member.save())
+        
+        self.assertTrue(memberships.isMember(self.game_id, self.user_ids[0]))
+        self.assertTrue(memberships.isMember(self.game_id, self.user_ids[1]))
+        calls = self.GameMember.table.calls
+        self.assertTrue(memberships.isMember(self.game_id, self.user_ids[1]))
+        self.assertEqual(self.GameMember.table.calls, calls)
+    
+    def test_misses_in_complete_games_are_one_read(self):
+        self.addMembers(memberships.save)
+        self.assertFalse(memberships.isMember(self.game_id, str(uuid.uuid1())))
+        self.assertEqual(self.scans, 1)
+        
+        reads = self.manager.calls()
+        self.assertFalse(memberships.isMember(self.game_id, str(uuid.uuid1())))
+        self.assertEqual(memberships.memberIDs(self.game_id, [self.user_ids[0], str(uuid.uuid1())]).keys(),
+                         [self.user_ids[0]])
+        self.assertEqual(sorted(memberships.memberIDs(self.game_id)), sorted(self.user_ids))
+        self.assertEqual(self.scans, 1)
+        self.assertEqual(self.manager.calls() - reads, 3)
+    
+    def test_stale_games_are_scanned_again(self):
+        self.addMembers(memberships.save)
+        memberships.memberIDs(self.game_id)
+        user_id = str(uuid.uuid1())
+        # e.g. added by the games service
+        self.GameMember(game_member_id=str(uuid.uuid1()), game_id=self.game_id, user_id=user_id, status=2).save()
+        self.assertFalse(memberships.isMember(self.game_id, user_id))
+        
+        memberships.gameIndex().insert(self.game_id, { memberships.INDEXED : repr(time.time() - settings.MEMBERSHIPS['INDEX_TTL'] - 1) })
+        self.assertTrue(memberships.isMember(self.game_id, user_id))
+        self.assertEqual(self.scans, 2)
+    
+    def test_unknown_games_are_not_indexed(self):
+        self.assertFalse(memberships.isMember(str(uuid.uuid1()), self.user_ids[0]))
+        self.assertEqual(self.manager.columnFamily('game_members_by_user').rows, {})
+
+class GameRoutesTest(SimpleTestCase):
+    '''
+        Plays a game through the routes of the marketplace.
+    '''
+    
+    def setUp(self):
+        self.fakes, self.patched = harness.installFakes(0.0)
+        self.user_id = str(uuid.uuid1())
+        now = datetime.datetime.now()
+        self.game = self.fakes['Game'](game_id=str(uuid.uuid1()), leader_id=self.user_id, winning_score=10,
+                                       deck=None, current_round_id=None, date_created=now, last_modified=now)
+        self.game.save()
+        memberships.save(self.fakes['GameMember'](game_member_id=str(uuid.uuid1()), game_id=self.game.game_id,
+                                                  user_id=self.user_id, status=memberships.ACCEPTED, score=0,
+                                                  date_created=now, last_modified=now))
+        self.path = '/rest/v1/nomination_decks/games/%s' % self.game.game_id
+        self.headers = { harness.USER_HEADER : self.user_id }
+    
+    def tearDown(self):
+        harness.restoreFakes(self.patched)
+    
+    def test_current_round(self):
+        now = datetime.datetime.now()
+        round = self.fakes['Round'](game_id=self.game.game_id, selector_id=self.user_id,
+                                    phrase_card_id=str(uuid.uuid1()), date_created=now, last_modified=now)
+        round.save()
+        self.game.current_round_id = round.round_id
+        self.game.save()
+        
+        response = Client().get(self.path + '/current', **self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['round_id'], round.round_id)
+    
+    def makeDeck(self, price):
+        deck = Deck(deck_type='phrase', title='Puns', price=price)
+        deck.save()
+        card = self.fakes['PhraseCard'](term='pun')
+        card.save()
+        DeckCard.add(deck.deck_id, [card.phrase_card_id])
+        return deck
+    
+    def test_paid_decks_need_buying(self):
+        deck = self.makeDeck(30)
+        client = Client()
+        
+        response = client.post(self.path, { 'deck_id' : deck.deck_id }, **self.headers)
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.fakes['Game'].getByID(self.game.game_id).current_round_id, None)
+        
+        Ledger().credit(self.user_id, 30, 'gift')
+        PurchasePipeline().submit(self.user_id, deck.deck_id)
+        response = client.post(self.path, { 'deck_id' : deck.deck_id }, **self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.fakes['Game'].getByID(self.game.game_id).current_round_id,
+                         json.loads(response.content)['round_id'])
+    
+    def test_free_decks_are_played(self):
+        deck = self.makeDeck(0)
+        response = Client().post(self.path, { 'deck_id' : deck.deck_id }, **self.headers)
+        self.assertEqual(response.status_code, 200)
+    
+    def test_plays_are_counted(self):
+        deck = self.makeDeck(0)
+        Client().post(self.path, { 'deck_id' : deck.deck_id }, **self.headers)
+        self.assertEqual(deckstats.statsFor([deck.deck_id])[deck.deck_id]['plays'], 1)
+
+class IdentityMapTest(SimpleTestCase):
+    '''
+        Repeated loads in a request should only read each row once.
+    '''
+    
+    def setUp(self):
+        self.Game = memory_model('game', 'game_id')
+        self.GameMember = memory_model('game_member', 'game_member_id', filters={ 'filterByGame' : 'game_id' })
+        identity.track(self.Game, 'game_id')
+        identity.track(self.GameMember, 'game_member_id')
+        self.Game(game_id='g', winning_score=10).save()
+        for i in range(5):
+            self.GameMember(game_member_id=str(i), game_id='g', score=0).save()
+    
+    def tearDown(self):
+        identity.end()
+    
+    def calls(self):
+        return self.Game.table.calls + self.GameMember.table.calls
+    
+    def test_loaded_once_per_request(self):
+        identity.begin()
+        before = self.calls()
+        game = self.Game.getByID('g')
+        self.assertTrue(self.Game.getByID('g') is game)
+        members = self.GameMember.filterByGame('g')
+        self.GameMember.filterByGame('g')
+        # the members were kept by id when the game's members were loaded
+        self.assertTrue(self.GameMember.getByID('3') in members)
+        self.assertEqual(self.calls() - before, 2)
+        
+        identity_map = identity.end()
+        self.assertEqual(identity_map.hits, 3)
+        self.assertEqual(identity_map.misses, 2)
+    
+    def test_saves_are_read_back(self):
+        identity.begin()
+        member = self.GameMember.getByID('1')
+        member.score = 10
+        member.save()
+        scores = dict((m.game_member_id, m.score) for m in self.GameMember.filterByGame('g'))
+        self.assertEqual(scores['1'], 10)
+        self.assertFalse(self.GameMember.getByID('1') is member)
+    
+    def test_no_request_no_map(self):
+        self.assertFalse(self.Game.getByID('g') is self.Game.getByID('g'))
+
+class DjangoSelectionForm(forms.Form):
+    '''
+        SelectionForm as it was validated before its schema.
+    '''
+    game_id = forms.CharField(required=True)
+    selection_id = forms.CharField(required=True)
+    
+    def clean(self):
+        try:
+            self.cleaned_data['game_id'] = str(UUID(self.cleaned_data['game_id']))
+            self.cleaned_data['selection_id'] = str(UUID(self.cleaned_data['selection_id']))
+            return self.cleaned_data
+        except ValueError:
+            raise GameNotFound()
+
+class SchemaTest(SimpleTestCase):
+    '''
+        Checks the compiled validators and their error details.
+    '''
+    
+    def test_cleans_parameters(self):
+        game_id, selection_id = str(uuid.uuid1()), str(uuid.uuid1())
+        form = SelectionForm({ 'selection_id' : selection_id.upper() }, game_id=game_id)
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.cleaned_data, { 'game_id' : game_id, 'selection_id' : selection_id })
+    
+    def test_field_error(self):
+        form = SelectionForm({ 'selection_id' : 'nope' }, game_id=str(uuid.uuid1()))
+        self.assertRaises(GameNotFound, form.is_valid)
+    
+    def test_error_details(self):
+        form = GamesPostForm({ 'game_members' : '{"not": "a list"}' })
+        try:
+            form.is_valid()
+            self.fail()
+        except InvalidParameters as e:
+            self.assertEqual(e.detail, { 'game_members' : 'Not a list.', 'winning_score' : 'This field is required.' })
+    
+    def test_json_list(self):
+        member_id = str(uuid.uuid1())
+        form = GamesPostForm({ 'game_members' : '["%s", "bogus", 5]' % member_id, 'winning_score' : '10' })
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.cleaned_data['game_members'], [member_id])
+        self.assertEqual(form.cleaned_data['winning_score'], 10)
+
+@benchmark
+class ValidatorBenchmark(SimpleTestCase):
+    '''
+        Compares validations per second of SelectionForm's schema with the
+        Django form it replaced.
+    '''
+    
+    def test_validations_per_second(self):
+        data = { 'selection_id' : str(uuid.uuid1()) }
+        game_id = str(uuid.uuid1())
+        
+        def django_form():
+            form = DjangoSelectionForm(dict(data, game_id=game_id))
+            form.is_valid()
+        
+        def schema_form():
+            SelectionForm(data, game_id=game_id).is_valid()
+        
+        before = measure(django_form, 5000)
+        after = measure(schema_form, 5000)
+        self.assertGreater(after['per_second'], before['per_second'])
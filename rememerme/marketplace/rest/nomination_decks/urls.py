@@ -1,10 +1,13 @@
 from django.conf.urls import patterns, url
 
-from rememerme.games.rest.rounds import views
+from rememerme.marketplace.rest.nomination_decks import views
 
 urlpatterns = patterns('',
-    url(r'^/?$', views.StartGameView.as_view()),
-    url(r'^/current/?$', views.RoundView.as_view()),
-    url(r'^/current/nominations/?$', views.NominationsView.as_view()),
-    url(r'^/current/selection/?$', views.SelectionView.as_view())
+    url(r'^/?$', views.DecksListView.as_view()),
+    url(r'^/games/(?P<game_id>[-\w]+)/?$', views.StartGameView.as_view()),
+    url(r'^/games/(?P<game_id>[-\w]+)/current/?$', views.RoundView.as_view()),
+    url(r'^/games/(?P<game_id>[-\w]+)/current/nominations/?$', views.NominationsView.as_view()),
+    url(r'^/games/(?P<game_id>[-\w]+)/current/selection/?$', views.SelectionView.as_view()),
+    url(r'^/search/?$', views.DeckSearchView.as_view()),
+    url(r'^/(?P<deck_id>[-\w]+)/?$', views.DeckSingleView.as_view())
 )
@@ -1,8 +1,9 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rememerme.games.rest.rounds.forms import StartGameForm, RoundForm, NominationsGetForm, NominationsPostForm, SelectionForm
+from rememerme.marketplace.rest.nomination_decks.forms import StartGameForm, RoundForm, NominationsGetForm, NominationsPostForm, SelectionForm
 from rememerme.games.rest.exceptions import BadRequestException
 from rest_framework.permissions import IsAuthenticated
+from rememerme.marketplace.rest.phrase_decks import views as deck_views
 
 class StartGameView(APIView):
     permission_classes = (IsAuthenticated,)
@@ -15,11 +16,7 @@ class StartGameView(APIView):
         '''
             Used to get all friends requests receieved of a user
         '''
-        data = { key : request.DATA[key] for key in request.DATA }
-        data['game_id'] = game_id
-        
-        # get the offset and limit query parameters
-        form = StartGameForm(data)
+        form = StartGameForm(request.DATA, game_id=game_id)
         
         if form.is_valid():
             return Response(form.submit(request))
@@ -37,9 +34,7 @@ class RoundView(APIView):
         '''
             Accept friend request.
         '''
-        data = { key : request.QUERY_PARAMS[key] for key in request.QUERY_PARAMS }
-        data['game_id'] = game_id
-        form = RoundForm(data)
+        form = RoundForm(request.QUERY_PARAMS, game_id=game_id)
 
         if form.is_valid():
             return Response(form.submit(request))
@@ -57,9 +52,7 @@ class NominationsView(APIView):
         '''
             Accept friend request.
         '''
-        data = { key : request.QUERY_PARAMS[key] for key in request.QUERY_PARAMS }
-        data['game_id'] = game_id
-        form = NominationsGetForm(data)
+        form = NominationsGetForm(request.QUERY_PARAMS, game_id=game_id)
 
         if form.is_valid():
             return Response(form.submit(request))
@@ -70,11 +63,7 @@ class NominationsView(APIView):
         '''
             Used to get all friends requests receieved of a user
         '''
-        data = { key : request.DATA[key] for key in request.DATA }
-        data['game_id'] = game_id
-        
-        # get the offset and limit query parameters
-        form = NominationsPostForm(data)
+        form = NominationsPostForm(request.DATA, game_id=game_id)
         
         if form.is_valid():
             return Response(form.submit(request))
@@ -92,14 +81,18 @@ class SelectionView(APIView):
         '''
             Used to get all friends requests receieved of a user
         '''
-        data = { key : request.DATA[key] for key in request.DATA }
-        data['game_id'] = game_id
-        
-        # get the offset and limit query parameters
-        form = SelectionForm(data)
+        form = SelectionForm(request.DATA, game_id=game_id)
         
         if form.is_valid():
             return Response(form.submit(request))
         else:
             raise BadRequestException()
 
+class DecksListView(deck_views.DecksListView):
+    deck_type = 'nomination'
+
+class DeckSingleView(deck_views.DeckSingleView):
+    deck_type = 'nomination'
+
+class DeckSearchView(deck_views.DeckSearchView):
+    deck_type = 'nomination'
@@ -0,0 +1,53 @@
+'''
+    Streams a CSV or NDJSON file of cards into a deck.
+
+    Usage: manage.py import_cards <deck_id> <file> [--format csv|ndjson] [--batch-size N]
+
+    @author: Andrew Oberlin, Jake Gregg
+'''
+from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
+from pycassa.cassandra.ttypes import NotFoundException as CassaNotFoundException
+from rememerme.cards.models import PhraseCard, NominationCard
+from rememerme.marketplace.models import Deck
+from rememerme.marketplace.importer import CardImporter, readRows, FORMATS
+import time
+
+CARD_MODELS = { 'phrase' : PhraseCard, 'nomination' : NominationCard }
+
+class Command(BaseCommand):
+    args = '<deck_id> <file>'
+    help = 'Imports the cards in a CSV or NDJSON file into a deck.'
+    option_list = BaseCommand.option_list + (
+        make_option('--format', dest='format', choices=FORMATS, default=None,
+            help='The format of the file, guessed from its extension by default.'),
+        make_option('--batch-size', dest='batch_size', type='int', default=None,
+            help='The number of cards written per batch.'),
+    )
+    
+    def handle(self, *args, **options):
+        if len(args) != 2:
+            raise CommandError('Usage: import_cards %s' % self.args)
+        deck_id, path = args
+        
+        try:
+            deck = Deck.getByID(deck_id)
+        except CassaNotFoundException:
+            raise CommandError('There is no deck %s' % deck_id)
+        
+        fmt = options['format'] or ('csv' if path.lower().endswith('.csv') else 'ndjson')
+        importer = CardImporter(CARD_MODELS[deck.deck_type], deck.deck_id, options['batch_size'])
+        
+        written = failed = 0
+        started = time.time()
+        with open(path, 'rb') as lines:
+            for report in importer.batches(readRows(lines, fmt)):
+                written += report['written']
+                failed += report['failed']
+                self.stdout.write('batch %(batch)d: %(written)d written, %(failed)d failed in %(seconds).2fs' % report)
+                for error in report['errors']:
+                    self.stderr.write('  line %(line)d: %(error)s' % error)
+        
+        elapsed = time.time() - started
+        self.stdout.write('Imported %d cards into %s in %.2fs (%.0f cards/s, %d rows failed)' %
+                          (written, deck.deck_id, elapsed, written / elapsed if elapsed else 0.0, failed))
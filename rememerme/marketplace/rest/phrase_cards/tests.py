@@ -1,3 +1,195 @@
-from django.test import TestCase
+from django.conf import settings
+from django.test import SimpleTestCase
+from django.test.client import Client
+from rememerme.marketplace import harness, pool
+from rememerme.marketplace.bench import benchmark
+from rememerme.marketplace.importer import CardImporter, readRows
+from rememerme.marketplace.loaders import getByIDs
+from rememerme.marketplace.models import DeckCard
+from rememerme.marketplace.streaming import streamCards, streamJSON
+from rememerme.marketplace.testing import MemoryManager, memory_model
+# loaded before the fakes are installed so their card models are swapped too
+from rememerme.marketplace.rest.phrase_cards import views as phrase_views
+from rememerme.marketplace.rest.nomination_cards import views as nomination_views
+import json
+import time
+import uuid
 
-# Create your tests here.
+class CardImportTest(SimpleTestCase):
+    
+    def setUp(self):
+        pool.setManager(MemoryManager())
+        self.PhraseCard = memory_model('phrase_card', 'phrase_card_id')
+        self.deck_id = str(uuid.uuid1())
+    
+    def tearDown(self):
+        pool.setManager(None)
+    
+    def test_csv_with_errors(self):
+        lines = ['term,description\n', 'Puns,Bad jokes\n', ',no term\n', 'Cats,\n']
+        summary = CardImporter(self.PhraseCard, self.deck_id, 10).run(readRows(iter(lines), 'csv'))
+        
+        self.assertEqual(summary['written'], 2)
+        self.assertEqual(summary['failed'], 1)
+        self.assertEqual(summary['batches'][0]['errors'][0]['line'], 3)
+        card_ids, _ = DeckCard.filterByDeck(self.deck_id, 10)
+        self.assertEqual(sorted(self.PhraseCard.getByID(c).term for c in card_ids), ['Cats', 'Puns'])
+    
+    def test_rerun_with_card_ids(self):
+        card_id = str(uuid.uuid1())
+        lines = [json.dumps({ 'card_id' : card_id, 'term' : 'Puns' })]
+        CardImporter(self.PhraseCard, self.deck_id).run(readRows(iter(lines), 'ndjson'))
+        CardImporter(self.PhraseCard, self.deck_id).run(readRows(iter(lines), 'ndjson'))
+        self.assertEqual(DeckCard.filterByDeck(self.deck_id, 10)[0], [card_id])
+    
+    def test_fields_that_are_not_text(self):
+        lines = [json.dumps(row) for row in ({ 'term' : 5 }, { 'term' : 'Puns', 'card_id' : 7 },
+                                             { 'term' : 'Cats', 'description' : ['a'] }, { 'term' : 'Dogs' })]
+        summary = CardImporter(self.PhraseCard, self.deck_id).run(readRows(iter(lines), 'ndjson'))
+        self.assertEqual(summary['written'], 1)
+        self.assertEqual([e['line'] for e in summary['batches'][0]['errors']], [1, 2, 3])
+        self.assertEqual(summary['batches'][0]['errors'][0]['error'], 'The term must be text')
+    
+    def test_bad_rows_fill_batches_too(self):
+        lines = [json.dumps({ 'term' : 5 })] * 25 + [json.dumps({ 'term' : 'Puns' })]
+        reports = list(CardImporter(self.PhraseCard, self.deck_id, 10).batches(readRows(iter(lines), 'ndjson')))
+        self.assertEqual([r['failed'] for r in reports], [10, 10, 5])
+        self.assertEqual([r['written'] for r in reports], [0, 0, 1])
+        self.assertEqual(reports[1]['errors'][0]['line'], 11)
+    
+    def test_errors_listed_are_capped(self):
+        lines = [json.dumps({ 'term' : 5 })] * 25
+        maximum = settings.CARD_IMPORT['MAX_ERRORS']
+        settings.CARD_IMPORT['MAX_ERRORS'] = 12
+        try:
+            summary = CardImporter(self.PhraseCard, self.deck_id, 10).run(readRows(iter(lines), 'ndjson'))
+        finally:
+            settings.CARD_IMPORT['MAX_ERRORS'] = maximum
+        self.assertEqual(summary['failed'], 25)
+        self.assertEqual([len(b['errors']) for b in summary['batches']], [10, 2, 0])
+
+class CardsListViewTest(SimpleTestCase):
+    '''
+        Lists the cards of a deck through its route, a page at a time and streamed.
+    '''
+    
+    def setUp(self):
+        self.fakes, self.patched = harness.installFakes(0.0)
+        self.user_id = str(uuid.uuid1())
+    
+    def tearDown(self):
+        harness.restoreFakes(self.patched)
+    
+    def check(self, deck_type, model):
+        deck_id = str(uuid.uuid1())
+        CardImporter(model, deck_id).run((n, { 'term' : 'card %d' % n }) for n in range(5))
+        path = '/rest/v1/%s_decks/%s/cards' % (deck_type, deck_id)
+        client = Client()
+        
+        paged = client.get(path, { 'limit' : 2 }, **{ harness.USER_HEADER : self.user_id })
+        self.assertEqual(paged.status_code, 200)
+        self.assertEqual(len(json.loads(paged.content)), 2)
+        self.assertTrue(paged.has_header('X-Next-Cursor'))
+        for limit in (-1, 0):
+            self.assertEqual(client.get(path, { 'limit' : limit }, **{ harness.USER_HEADER : self.user_id }).status_code, 400)
+        
+        streamed = client.get(path, { 'stream' : 'true' }, **{ harness.USER_HEADER : self.user_id })
+        self.assertEqual(streamed.status_code, 200)
+        self.assertEqual(len(json.loads(''.join(streamed.streaming_content))), 5)
+    
+    def test_phrase_cards(self):
+        self.check('phrase', self.fakes['PhraseCard'])
+    
+    def test_nomination_cards(self):
+        self.check('nomination', self.fakes['NominationCard'])
+
+class GeneratedImportTest(SimpleTestCase):
+    '''
+        Imports a deck from a generator so the file never exists in memory.
+    '''
+    cards = 5000
+    
+    def setUp(self):
+        pool.setManager(MemoryManager())
+    
+    def tearDown(self):
+        pool.setManager(None)
+    
+    def importCards(self):
+        self.PhraseCard = memory_model('phrase_card', 'phrase_card_id')
+        
+        def lines():
+            for i in range(self.cards):
+                # every thousandth line is broken
+                yield '{"term": "card %d"' % i if i % 1000 == 0 else json.dumps({ 'term' : 'card %d' % i })
+        
+        return CardImporter(self.PhraseCard, str(uuid.uuid1()), 1000).run(readRows(lines(), 'ndjson'))
+    
+    def test_bad_lines_are_skipped(self):
+        summary = self.importCards()
+        self.assertEqual(summary['written'], self.cards - self.cards // 1000)
+        self.assertEqual(summary['failed'], self.cards // 1000)
+        # one batched mutation per batch instead of one write per card
+        self.assertEqual(self.PhraseCard.table.calls, len(summary['batches']))
+        self.assertEqual(summary['cards_per_second'], summary['written'] / summary['seconds'])
+
+@benchmark
+class CardImportBenchmark(GeneratedImportTest):
+    '''
+        Imports a 100k card deck.
+    '''
+    cards = 100000
+    
+    def test_throughput(self):
+        # about a seventh of the cards per second imported on a developer machine
+        self.assertGreater(self.importCards()['cards_per_second'], 1000)
+
+class CardStreamBenchmark(SimpleTestCase):
+    '''
+        Compares building a whole deck listing in memory with streaming it
+        a page at a time, by time to first byte and the most held at once.
+    '''
+    cards = 20000
+    page_size = 200
+    
+    def setUp(self):
+        pool.setManager(MemoryManager(latency=0.001))
+        self.PhraseCard = memory_model('phrase_card', 'phrase_card_id', latency=0.001)
+        self.deck_id = str(uuid.uuid1())
+        lines = (json.dumps({ 'term' : 'card %d' % i }) for i in range(self.cards))
+        CardImporter(self.PhraseCard, self.deck_id, 1000).run(readRows(lines, 'ndjson'))
+    
+    def tearDown(self):
+        pool.setManager(None)
+    
+    def serialize(self, cards):
+        return [{ 'phrase_card_id' : card.phrase_card_id, 'term' : card.term } for card in cards]
+    
+    def materialize(self):
+        card_ids, _ = DeckCard.filterByDeck(self.deck_id, self.cards)
+        return json.dumps(self.serialize(getByIDs(self.PhraseCard, card_ids)))
+    
+    def stream(self):
+        return streamJSON(streamCards(self.PhraseCard, self.deck_id, self.serialize, self.page_size))
+    
+    def test_memory(self):
+        body = self.materialize()
+        chunks = list(self.stream())
+        largest = max(len(chunk) for chunk in chunks)
+        
+        self.assertEqual(json.loads(''.join(chunks)), json.loads(body))
+        self.assertTrue(largest * 10 < len(body))
+    
+    @benchmark
+    def test_ttfb(self):
+        start = time.time()
+        self.materialize()
+        materialized = time.time() - start
+        
+        start = time.time()
+        chunks = self.stream()
+        next(chunks)
+        next(chunks)
+        ttfb = time.time() - start
+
+        self.assertTrue(ttfb < materialized)
@@ -3,6 +3,10 @@ from rest_framework.response import Response
 from rememerme.games.rest.games.forms import GameRequestsForm, GamesPostForm, GamesListGetForm, GamesSingleGetForm
 from rememerme.games.rest.exceptions import BadRequestException
 from rest_framework.permissions import IsAuthenticated
+from rememerme.marketplace.rest.phrase_cards.forms import PhraseCardsListGetForm
+from rememerme.marketplace.rest.phrase_cards.forms import PhraseCardImportForm
+from rememerme.marketplace.permissions import IsContentAdmin
+from config.util import pagedResponse
 
 class GamesListView(APIView):
     permission_classes = (IsAuthenticated,)
@@ -62,4 +66,46 @@ class GameRequestView(APIView):
             return Response(form.submit(request))
         else:
             raise BadRequestException()
-        
+
+class CardsListView(APIView):
+    permission_classes = (IsAuthenticated,)
+    
+    '''
+       Browsing the cards of a deck.
+    '''
+    
+    def get(self, request, deck_id):
+        '''
+            Gets a page of the cards in the deck, or all of them as a
+            streamed list with stream=true.
+        '''
+        data = { key : request.QUERY_PARAMS[key] for key in request.QUERY_PARAMS }
+        data['deck_id'] = deck_id
+        form = PhraseCardsListGetForm(data)
+
+        if form.is_valid():
+            if form.cleaned_data['stream']:
+                return form.streamResponse(request)
+            return pagedResponse(form.submit(request), form.next_cursor)
+        else:
+            raise BadRequestException()
+
+class CardsImportView(APIView):
+    permission_classes = (IsAuthenticated, IsContentAdmin)
+    
+    '''
+       Loading whole decks of cards at once.
+    '''
+    
+    def post(self, request, deck_id):
+        '''
+            Imports the cards in the uploaded CSV or NDJSON file.
+        '''
+        data = { key : request.DATA[key] for key in request.DATA }
+        data['deck_id'] = deck_id
+        form = PhraseCardImportForm(data, request.FILES)
+
+        if form.is_valid():
+            return Response(form.submit(request))
+        else:
+            raise BadRequestException()
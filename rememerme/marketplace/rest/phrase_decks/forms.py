@@ -7,6 +7,7 @@
     @author: Andrew Oberlin, Jake Gregg
 '''
 from django import forms
+from django.conf import settings
 from rememerme.games.models import GameMember
 from rememerme.games.rest.exceptions import IllegalStatusCode, GameNotFound,\
     BadRequestException, GameMemberNotFound, GameMemberAlreadyExists
@@ -15,6 +16,19 @@ from rememerme.games.serializers import GameMemberSerializer
 from uuid import UUID
 from pycassa.cassandra.ttypes import NotFoundException as CassaNotFoundException
 import datetime
+import json
+import uuid
+from rememerme.cards.models import PhraseCard, NominationCard
+from rememerme.marketplace import deckstats, leaderboard, memberships, search
+from rememerme.marketplace.models import Deck, DeckCard
+from rememerme.marketplace.importer import validateRow
+from rememerme.marketplace.loaders import getByIDs
+from rememerme.marketplace.unitofwork import UnitOfWork
+from rememerme.marketplace.serializers import DeckSerializer
+from rememerme.marketplace.rest.exceptions import DeckNotFound
+from rememerme.marketplace.cache import catalog, CatalogEntry, toTimestamp
+from rememerme.marketplace.schema import Schema, SchemaForm, ChoiceField, IntField, TextField
+from config.util import getLimit, getCursor
 
 class GameMembersPutForm(forms.Form):
     game_id = forms.CharField(required=True)
@@ -34,17 +48,13 @@ class GameMembersPutForm(forms.Form):
     def submit(self, request):
         try:
             # get the game member by the group and user combination
-            members = GameMember.filterByGame(self.cleaned_data['game_id'])
-            member = None
-            for m in members:
-                if str(m.user_id) == request.user.pk:
-                    member = m
-                    break
+            member = memberships.findMember(self.cleaned_data['game_id'], request.user.pk)
             if not member:
                 raise GameMemberNotFound()
             
+            previous = member.status
             member.status = self.cleaned_data['status']
-            member.save()
+            memberships.save(member, previous)
         except CassaNotFoundException:
             raise GameMemberNotFound()
         return GameMemberSerializer(member).data
@@ -78,25 +88,16 @@ class GameMembersPostForm(forms.Form):
         '''
             Submits this form to create the given game.
         '''
-        members = GameMember.filterByGame(self.cleaned_data['game_id'])
-        them = None
-        me = None
-        for m in members:
-            if str(m.user_id) == request.user.pk:
-                me = m
-            if str(m.user_id) == self.cleaned_data['user_id']:
-                them = m
-                
-            if them and me:
-                break
-        if them:
+        found = memberships.memberIDs(self.cleaned_data['game_id'], [request.user.pk, self.cleaned_data['user_id']])
+        if self.cleaned_data['user_id'] in found:
             raise GameMemberAlreadyExists()
         
-        if not me:
+        if request.user.pk not in found:
             raise PermissionDenied()
         
-        member = GameMember.fromMap(self.cleaned_data)
-        member.save()
+        # the id is made here so the indexes can name the membership
+        member = GameMember.fromMap(dict(self.cleaned_data, game_member_id=str(uuid.uuid1())))
+        memberships.save(member)
         
         return GameMemberSerializer(member).data
 
@@ -112,13 +113,174 @@ class GameMembersGetForm(forms.Form):
 
     def submit(self, request):
         try:
-            members = GameMember.filterByGame(self.cleaned_data['game_id'])
-            member_ids = set([str(m.user_id) for m in members])
-            if request.user.pk not in member_ids:
+            # only members get to read the whole list
+            if not memberships.isMember(self.cleaned_data['game_id'], request.user.pk):
                 raise PermissionDenied()
+            members = GameMember.filterByGame(self.cleaned_data['game_id'])
         except CassaNotFoundException:
             raise GameNotFound()
         
         return GameMemberSerializer(members, many=True).data
 
+DECK_TYPES = (('phrase', 'phrase'), ('nomination', 'nomination'))
+
+CARD_MODELS = { 'phrase' : PhraseCard, 'nomination' : NominationCard }
+
+'''
+    Gets a page of the decks of one type for sale, newest first.
+'''
+class DecksListGetForm(forms.Form):
+    deck_type = forms.ChoiceField(choices=DECK_TYPES)
+    limit = forms.IntegerField(required=False, min_value=1)
+    cursor = forms.CharField(required=False)
+    
+    def clean(self):
+        self.cleaned_data['limit'] = getLimit(self.cleaned_data)
+        try:
+            self.cleaned_data['cursor'] = getCursor(self.cleaned_data)
+        except ValueError:
+            raise BadRequestException()
+        return self.cleaned_data
+    
+    def submit(self, request):
+        '''
+            Gets the page from the catalog cache, building it on a miss.
+            
+            @return: The CatalogEntry of the page
+        '''
+        deck_type, limit, cursor = self.cleaned_data['deck_type'], self.cleaned_data['limit'], self.cleaned_data['cursor']
+        
+        def build():
+            decks, next_cursor = Deck.filterByType(deck_type, limit, cursor)
+            last_modified = max([toTimestamp(deck.last_modified) for deck in decks] or [None])
+            data = DeckSerializer(decks, many=True).data
+            stats = deckstats.statsFor([deck.deck_id for deck in decks])
+            for deck in data:
+                deck['stats'] = stats[str(deck['deck_id'])]
+            return CatalogEntry(data, last_modified, next_cursor)
+        
+        return catalog.fetch(('decks', deck_type, limit, cursor), build)
+
+'''
+    Gets a single deck of the given type.
+'''
+class DeckSingleGetForm(forms.Form):
+    deck_type = forms.ChoiceField(choices=DECK_TYPES)
+    deck_id = forms.CharField()
+    
+    def clean(self):
+        try:
+            self.cleaned_data['deck_id'] = str(UUID(self.cleaned_data['deck_id']))
+        except ValueError:
+            raise DeckNotFound()
+        return self.cleaned_data
+    
+    def submit(self, request):
+        '''
+            Gets the deck from the catalog cache, loading it on a miss.
+            
+            @return: The CatalogEntry of the deck
+        '''
+        deck_id, deck_type = self.cleaned_data['deck_id'], self.cleaned_data['deck_type']
+        
+        def build():
+            try:
+                deck = Deck.getByID(deck_id)
+            except CassaNotFoundException:
+                raise DeckNotFound()
+            
+            if deck.deck_type != deck_type:
+                raise DeckNotFound()
+            data = DeckSerializer(deck).data
+            data['stats'] = deckstats.statsFor([deck.deck_id])[deck.deck_id]
+            return CatalogEntry(data, toTimestamp(deck.last_modified))
+        
+        return catalog.fetch(('deck', deck_id, deck_type), build)
+
+'''
+    Creates a deck for sale, optionally with its first cards.
+'''
+class DeckPostForm(forms.Form):
+    deck_type = forms.ChoiceField(choices=DECK_TYPES)
+    title = forms.CharField(max_length=255)
+    description = forms.CharField(required=False)
+    tags = forms.CharField(required=False)
+    price = forms.IntegerField(min_value=0)
+    cards = forms.CharField(required=False)
+    
+    def clean(self):
+        try:
+            tags = json.loads(self.cleaned_data.get('tags') or '[]')
+            cards = json.loads(self.cleaned_data.get('cards') or '[]')
+            if not isinstance(tags, list) or not isinstance(cards, list):
+                raise BadRequestException()
+            self.cleaned_data['tags'] = [str(tag) for tag in tags]
+            # every card is checked before anything is written
+            self.cleaned_data['cards'] = [validateRow(card if isinstance(card, dict) else { 'term' : card }, '')
+                                          for card in cards]
+        except ValueError:
+            raise BadRequestException()
+        return self.cleaned_data
+    
+    def submit(self, request):
+        '''
+            Writes the deck, its type index entry and every card in one batch.
+        '''
+        deck = Deck(deck_type=self.cleaned_data['deck_type'], title=self.cleaned_data['title'],
+                    description=self.cleaned_data['description'], tags=self.cleaned_data['tags'],
+                    price=self.cleaned_data['price'])
+        model = CARD_MODELS[deck.deck_type]
+        
+        with UnitOfWork():
+            deck.save()
+            for card_id, columns in self.cleaned_data['cards']:
+                columns['deck_id'] = deck.deck_id
+                model.table.insert(card_id, columns)
+            if self.cleaned_data['cards']:
+                DeckCard.add(deck.deck_id, [card_id for card_id, _ in self.cleaned_data['cards']],
+                             [columns['term'] for _, columns in self.cleaned_data['cards']])
+        
+        serialized = DeckSerializer(deck).data
+        serialized['cards'] = len(self.cleaned_data['cards'])
+        return serialized
 
+'''
+    Searches the decks for sale by the words of their title, description,
+    tags and cards.
+'''
+class DeckSearchForm(SchemaForm):
+    schema = Schema(q=TextField(max_length=200), deck_type=ChoiceField([deck_type for deck_type, _ in DECK_TYPES], required=False),
+                    min_price=IntField(required=False, min_value=0), max_price=IntField(required=False, min_value=0),
+                    limit=IntField(required=False, min_value=0))
+    
+    def submit(self, request):
+        return search.search(self.cleaned_data['q'], deck_type=self.cleaned_data['deck_type'],
+                             min_price=self.cleaned_data['min_price'], max_price=self.cleaned_data['max_price'],
+                             limit=getLimit(self.cleaned_data))
+
+'''
+    Gets the best selling decks of today, this week or all time.
+'''
+class TopDecksForm(SchemaForm):
+    schema = Schema(window=ChoiceField(settings.LEADERBOARD['WINDOWS'].keys(), required=False, default='today'),
+                    limit=IntField(required=False, min_value=0, max_value=settings.LEADERBOARD['TOP_K']))
+    
+    def submit(self, request):
+        window = self.cleaned_data['window']
+        ranked = leaderboard.top(window, getLimit(self.cleaned_data))
+        
+        # the decks are served from the search index, only the ones it doesn't have yet are read
+        data = {}
+        for deck_id, _ in ranked:
+            indexed = search.index.decks.get(deck_id)
+            if indexed is not None and indexed.data is not None:
+                data[deck_id] = indexed.data
+        missing = [deck_id for deck_id, _ in ranked if deck_id not in data]
+        for deck in getByIDs(Deck, missing, skip_missing=True):
+            data[str(deck.deck_id)] = DeckSerializer(deck).data
+        
+        results = []
+        for deck_id, sales in ranked:
+            if deck_id in data:
+                results.append(dict(data[deck_id], sales=sales))
+        return { 'window' : window, 'results' : results }
@@ -0,0 +1,33 @@
+'''
+    Builds the index of game memberships by status for users whose
+    memberships were made before the index existed.
+
+    Usage: manage.py index_memberships [user_id ...]
+
+    @author: Andrew Oberlin, Jake Gregg
+'''
+from django.core.management.base import BaseCommand
+from rememerme.games.models import GameMember
+from rememerme.marketplace import memberships
+
+class Command(BaseCommand):
+    args = '[user_id ...]'
+    help = 'Indexes the game memberships of the given users, or of every user, by status.'
+    
+    def handle(self, *args, **options):
+        user_ids = args or self.allUsers()
+        
+        indexed = 0
+        for user_id in user_ids:
+            members = memberships.backfill(user_id)
+            indexed += 1
+            self.stdout.write('%s: %d memberships' % (user_id, len(members)))
+        self.stdout.write('Indexed the memberships of %d users' % indexed)
+    
+    def allUsers(self):
+        seen = set()
+        for _, columns in GameMember.table.get_range(columns=['user_id']):
+            user_id = str(columns.get('user_id'))
+            if user_id not in seen:
+                seen.add(user_id)
+                yield user_id
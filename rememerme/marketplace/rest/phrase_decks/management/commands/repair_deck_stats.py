@@ -0,0 +1,30 @@
+'''
+    Recounts the statistics of every deck from the cards, purchases and
+    plays they stand for and corrects the counters that drifted.
+
+    Usage: manage.py repair_deck_stats [--dry-run] [--page-size N]
+
+    @author: Andrew Oberlin, Jake Gregg
+'''
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from optparse import make_option
+from rememerme.marketplace import deckstats
+
+class Command(BaseCommand):
+    help = 'Recounts the card, purchase and play counters of every deck and reports and fixes any drift.'
+    option_list = BaseCommand.option_list + (
+        make_option('--dry-run', dest='dry_run', action='store_true', default=False,
+            help='Only report the drift without correcting it.'),
+        make_option('--page-size', dest='page_size', type='int', default=None,
+            help='The decks and purchases read at a time.'),
+    )
+    
+    def handle(self, *args, **options):
+        report = deckstats.repair(options['page_size'] or settings.DECK_STATS['REPAIR_PAGE_SIZE'],
+                                  fix=not options['dry_run'])
+        for drift in report['drift']:
+            self.stdout.write('%(deck_id)s %(counter)s: counted %(stored)d, actually %(actual)d' % drift)
+        self.stdout.write('Checked %d decks, %d counters drifted%s, %d skipped as they changed while recounted'
+                          % (report['decks'], report['drifted'], '' if report['fixed'] else ' (not fixed)',
+                             report['skipped']))
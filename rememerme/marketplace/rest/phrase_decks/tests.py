@@ -1,3 +1,266 @@
-from django.test import TestCase
+from django.test import SimpleTestCase
+from django.test.client import Client
+from rememerme.marketplace import pool, auth, harness, memberships, search
+from rememerme.marketplace.bench import benchmark, measure
+from rememerme.marketplace.models import Deck
+from rememerme.marketplace.cache import catalog, cachedResponse, CatalogEntry
+from rememerme.marketplace.testing import MemoryManager
+from config.util import encodeCursor, decodeCursor
+# loaded before the fakes are installed so their models are swapped too
+from rememerme.marketplace.rest.phrase_decks import views
+import json
+import random
+import uuid
 
-# Create your tests here.
+class DeckPaginationTest(SimpleTestCase):
+    '''
+        Every page of a listing should cost the same no matter how deep it is.
+    '''
+    
+    def setUp(self):
+        self.manager = MemoryManager()
+        pool.setManager(self.manager)
+    
+    def tearDown(self):
+        pool.setManager(None)
+    
+    def test_pages_cost_the_same(self):
+        created = []
+        for i in range(95):
+            deck = Deck(deck_type='phrase', title='Deck %d' % i, price=i)
+            deck.save()
+            created.append(deck.deck_id)
+        Deck(deck_type='nomination', title='Other', price=1).save()
+        
+        seen = []
+        costs = []
+        cursor = None
+        while True:
+            before = self.manager.calls()
+            decks, cursor = Deck.filterByType('phrase', 10, cursor)
+            costs.append(self.manager.calls() - before)
+            seen.extend(deck.deck_id for deck in decks)
+            if cursor is None:
+                break
+            # the client only ever sees the opaque token
+            cursor = decodeCursor(encodeCursor(cursor))
+        
+        self.assertEqual(sorted(seen), sorted(created))
+        self.assertEqual(len(costs), 10)
+        self.assertEqual(set(costs), set([2]))
+    
+    def test_foreign_cursor_is_invalid(self):
+        self.assertRaises(ValueError, decodeCursor, u'caf\xe9')
+        self.assertRaises(ValueError, decodeCursor, 'not a cursor!')
+
+class FakeRequest(object):
+    def __init__(self, **meta):
+        self.META = meta
+
+class CatalogCacheTest(SimpleTestCase):
+    
+    def setUp(self):
+        catalog.invalidate()
+        self.builds = 0
+    
+    def build(self):
+        self.builds += 1
+        return CatalogEntry([{ 'deck_id' : 'a', 'title' : 'Puns' }], 1387500000)
+    
+    def test_read_through(self):
+        first = catalog.fetch(('decks', 'phrase'), self.build)
+        second = catalog.fetch(('decks', 'phrase'), self.build)
+        self.assertTrue(first is second)
+        self.assertEqual(self.builds, 1)
+        
+        catalog.invalidate()
+        catalog.fetch(('decks', 'phrase'), self.build)
+        self.assertEqual(self.builds, 2)
+    
+    def test_not_modified(self):
+        entry = catalog.fetch(('decks', 'phrase'), self.build)
+        saved = catalog.bytes_saved
+        
+        response = cachedResponse(FakeRequest(HTTP_IF_NONE_MATCH=entry.etag), entry)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(catalog.bytes_saved, saved + entry.size)
+        
+        response = cachedResponse(FakeRequest(HTTP_IF_NONE_MATCH='"stale"'), entry)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], entry.etag)
+        
+        response = cachedResponse(FakeRequest(HTTP_IF_MODIFIED_SINCE=response['Last-Modified']), entry)
+        self.assertEqual(response.status_code, 304)
+
+class CountingAuthentication(auth.CachedRememermeAuthentication):
+    '''
+        Stands in for the sessions service, knowing the sessions in valid.
+    '''
+    valid = { 'token-a' : 'user-a', 'token-b' : 'user-b' }
+    
+    def __init__(self):
+        self.checks = 0
+    
+    def validate(self, request):
+        self.checks += 1
+        user_id = self.valid.get(request.META.get('HTTP_AUTHORIZATION'))
+        return (FakeUser(user_id), None) if user_id else None
+
+class FakeUser(object):
+    def __init__(self, pk):
+        self.pk = pk
+
+class SessionCacheTest(SimpleTestCase):
+    
+    def setUp(self):
+        auth.sessions.clear()
+        auth.sessions.hits = auth.sessions.misses = 0
+        self.authentication = CountingAuthentication()
+    
+    def test_checked_once_per_session(self):
+        for _ in range(50):
+            user, _ = self.authentication.authenticate(FakeRequest(HTTP_AUTHORIZATION='token-a'))
+            self.assertEqual(user.pk, 'user-a')
+        self.assertEqual(self.authentication.checks, 1)
+        self.assertEqual(auth.stats()['hits'], 49)
+    
+    def test_failures_not_cached(self):
+        for _ in range(3):
+            self.assertEqual(self.authentication.authenticate(FakeRequest(HTTP_AUTHORIZATION='bad')), None)
+        self.assertEqual(self.authentication.checks, 3)
+    
+    def test_revoke(self):
+        self.authentication.authenticate(FakeRequest(HTTP_AUTHORIZATION='token-a'))
+        self.authentication.authenticate(FakeRequest(HTTP_AUTHORIZATION='token-b'))
+        auth.revokeUser('user-a')
+        self.authentication.authenticate(FakeRequest(HTTP_AUTHORIZATION='token-a'))
+        self.authentication.authenticate(FakeRequest(HTTP_AUTHORIZATION='token-b'))
+        self.assertEqual(self.authentication.checks, 3)
+        
+        auth.revoke('token-b')
+        self.authentication.authenticate(FakeRequest(HTTP_AUTHORIZATION='token-b'))
+        self.assertEqual(self.authentication.checks, 4)
+
+class DeckSearchTest(SimpleTestCase):
+    '''
+        Checks matching, ranking and faceting of the deck search index.
+    '''
+    
+    def setUp(self):
+        self.index = search.DeckIndex()
+        self.decks = {}
+        for title, deck_type, price, tags in (('Horror Nights', 'phrase', 0, ['scary']),
+                                              ('Holiday Cheer', 'phrase', 5, ['festive']),
+                                              ('Horrible Puns', 'nomination', 12, ['jokes'])):
+            deck = Deck(deck_id=str(uuid.uuid1()), deck_type=deck_type, title=title, description='',
+                        tags=tags, price=price)
+            self.index.addDeck(deck)
+            self.decks[title] = deck.deck_id
+    
+    def titles(self, found):
+        return [result['title'] for result in found['results']]
+    
+    def test_prefix_search(self):
+        found = self.index.search('hor')
+        self.assertEqual(set(self.titles(found)), set(['Horror Nights', 'Horrible Puns']))
+        self.assertEqual(self.titles(self.index.search('horror')), ['Horror Nights'])
+        self.assertEqual(self.titles(self.index.search('hor sca')), ['Horror Nights'])
+        self.assertEqual(self.index.search('zombie')['total'], 0)
+    
+    def test_ranking(self):
+        # a word on a card counts for less than the same word in a title
+        self.index.addCards(self.decks['Holiday Cheer'], { str(uuid.uuid1()) : 'horror movie marathon' })
+        self.assertEqual(self.titles(self.index.search('horror')), ['Horror Nights', 'Holiday Cheer'])
+    
+    def test_facets_and_filters(self):
+        found = self.index.search('h', deck_type='phrase', max_price=4)
+        self.assertEqual(self.titles(found), ['Horror Nights'])
+        self.assertEqual(found['facets']['deck_type'], { 'phrase' : 2, 'nomination' : 1 })
+        self.assertEqual(found['facets']['price'], { '0' : 1, '5-9' : 1, '10-24' : 1 })
+    
+    def test_card_updates(self):
+        card_id = str(uuid.uuid1())
+        self.index.addCards(self.decks['Horrible Puns'], { card_id : 'a pun about cheese' })
+        self.assertEqual(self.titles(self.index.search('cheese')), ['Horrible Puns'])
+        self.index.removeCards(self.decks['Horrible Puns'], [card_id])
+        self.assertEqual(self.index.search('cheese')['total'], 0)
+        self.assertFalse('cheese' in self.index.words)
+    
+    def test_deck_writes_are_indexed(self):
+        pool.setManager(MemoryManager())
+        try:
+            deck = Deck(deck_type='phrase', title='Spooky Season', description='', tags=[], price=1)
+            deck.save()
+            self.assertEqual([result['deck_id'] for result in search.index.search('spooky')['results']], [deck.deck_id])
+        finally:
+            pool.setManager(None)
+
+@benchmark
+class DeckSearchBenchmark(SimpleTestCase):
+    '''
+        Searching a catalog of tens of thousands of decks should take well
+        under a millisecond.
+    '''
+    
+    def test_search_latency(self):
+        generator = random.Random(20)
+        vocabulary = [''.join(generator.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(generator.randint(4, 9)))
+                      for _ in range(5000)]
+        index = search.DeckIndex()
+        for i in range(20000):
+            deck = Deck(deck_id=str(uuid.UUID(int=i)), deck_type=generator.choice(['phrase', 'nomination']),
+                        title=' '.join(generator.sample(vocabulary, 3)), description=' '.join(generator.sample(vocabulary, 8)),
+                        tags=generator.sample(vocabulary, 2), price=generator.randint(0, 30))
+            index.addDeck(deck)
+            index.addCards(deck.deck_id, dict((str(n), ' '.join(generator.sample(vocabulary, 2))) for n in range(5)))
+        
+        queries = [' '.join(generator.sample(vocabulary, 2))[:-2] for _ in range(200)]
+        timing = measure(lambda: index.search(generator.choice(queries), deck_type='phrase'), 2000)
+        self.assertLess(timing['p50_ms'], 1.0)
+
+class GameMembersViewTest(SimpleTestCase):
+    '''
+        Adds and changes the members of a game through its route, which keeps
+        the membership indexes up to date.
+    '''
+    
+    def setUp(self):
+        self.fakes, self.patched = harness.installFakes(0.0)
+        self.user_id, self.friend_id, self.game_id = str(uuid.uuid1()), str(uuid.uuid1()), str(uuid.uuid1())
+        memberships.save(self.fakes['GameMember'](game_member_id=str(uuid.uuid1()), game_id=self.game_id,
+                                                  user_id=self.user_id, status=memberships.ACCEPTED))
+        self.path = '/rest/v1/phrase_decks/games/%s/members' % self.game_id
+    
+    def tearDown(self):
+        harness.restoreFakes(self.patched)
+    
+    def test_members_are_indexed(self):
+        client = Client()
+        response = client.post(self.path, { 'user_id' : self.friend_id }, **{ harness.USER_HEADER : self.user_id })
+        self.assertEqual(response.status_code, 200)
+        member_id = memberships.gameIndex().get(self.game_id, columns=[self.friend_id])[self.friend_id]
+        self.assertEqual(list(memberships.index().get(memberships.rowKey(self.friend_id, memberships.INVITED))),
+                         [member_id])
+        
+        response = client.put(self.path, json.dumps({ 'status' : memberships.ACCEPTED }),
+                              content_type='application/json', **{ harness.USER_HEADER : self.friend_id })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(memberships.index().get(memberships.rowKey(self.friend_id, memberships.ACCEPTED))),
+                         [member_id])
+        self.assertEqual(len(json.loads(client.get(self.path, **{ harness.USER_HEADER : self.friend_id }).content)), 2)
+
+class DecksListViewTest(SimpleTestCase):
+    
+    def setUp(self):
+        self.fakes, self.patched = harness.installFakes(0.0)
+        Deck(deck_type='phrase', title='Puns', price=1).save()
+    
+    def tearDown(self):
+        harness.restoreFakes(self.patched)
+    
+    def test_limit_must_be_positive(self):
+        client = Client()
+        headers = { harness.USER_HEADER : str(uuid.uuid1()) }
+        self.assertEqual(client.get('/rest/v1/phrase_decks', { 'limit' : 1 }, **headers).status_code, 200)
+        for limit in (-1, 0):
+            self.assertEqual(client.get('/rest/v1/phrase_decks', { 'limit' : limit }, **headers).status_code, 400)
@@ -1,7 +1,10 @@
 from django.conf.urls import patterns, url
 
-from rememerme.games.rest.members import views
+from rememerme.marketplace.rest.phrase_decks import views
 
 urlpatterns = patterns('',
-    url(r'^/?', views.GameMembersView.as_view())
+    url(r'^/search/?$', views.DeckSearchView.as_view()),
+    url(r'^/games/(?P<game_id>[-\w]+)/members/?$', views.GameMembersView.as_view()),
+    url(r'^/(?P<deck_id>[-\w]+)/?$', views.DeckSingleView.as_view()),
+    url(r'^/?$', views.DecksListView.as_view())
 )
@@ -1,8 +1,12 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rememerme.games.rest.members.forms import GameMembersPostForm, GameMembersGetForm, GameMembersPutForm
 from rememerme.games.rest.exceptions import BadRequestException
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.exceptions import PermissionDenied
+from rememerme.marketplace.rest.phrase_decks.forms import GameMembersPostForm, GameMembersGetForm, GameMembersPutForm,\
+    DecksListGetForm, DeckSingleGetForm, DeckPostForm, DeckSearchForm, TopDecksForm
+from rememerme.marketplace.permissions import IsContentAdmin
+from rememerme.marketplace.cache import cachedResponse
 
 class GameMembersView(APIView):
     permission_classes = (IsAuthenticated,) 
@@ -26,7 +30,7 @@ class GameMembersView(APIView):
         '''
             Used to create a new friend request.
         '''
-        query = { key : requests.DATA[key] for key in request.DATA }
+        query = { key : request.DATA[key] for key in request.DATA }
         query['game_id'] = game_id
         form = GameMembersPostForm(query)
 
@@ -47,3 +51,87 @@ class GameMembersView(APIView):
             return Response(form.submit(request))
         else:
             raise BadRequestException()
+
+class DecksListView(APIView):
+    permission_classes = (IsAuthenticated,)
+    deck_type = 'phrase'
+    
+    '''
+       Browsing the decks for sale.
+    '''
+    
+    def get(self, request):
+        '''
+            Gets a page of the decks, newest first.
+        '''
+        data = { key : request.QUERY_PARAMS[key] for key in request.QUERY_PARAMS }
+        data['deck_type'] = self.deck_type
+        form = DecksListGetForm(data)
+
+        if form.is_valid():
+            return cachedResponse(request, form.submit(request))
+        else:
+            raise BadRequestException()
+    
+    def post(self, request):
+        '''
+            Creates a deck with its first cards. Only content admins can make decks.
+        '''
+        if not IsContentAdmin().has_permission(request, self):
+            raise PermissionDenied()
+        
+        data = { key : request.DATA[key] for key in request.DATA }
+        data['deck_type'] = self.deck_type
+        form = DeckPostForm(data)
+
+        if form.is_valid():
+            return Response(form.submit(request))
+        else:
+            raise BadRequestException()
+
+class DeckSingleView(APIView):
+    permission_classes = (IsAuthenticated,)
+    deck_type = 'phrase'
+    
+    def get(self, request, deck_id):
+        '''
+            Gets a single deck.
+        '''
+        form = DeckSingleGetForm({ 'deck_id' : deck_id, 'deck_type' : self.deck_type })
+
+        if form.is_valid():
+            return cachedResponse(request, form.submit(request))
+        else:
+            raise BadRequestException()
+
+class DeckSearchView(APIView):
+    permission_classes = (IsAuthenticated,)
+    deck_type = 'phrase'
+    
+    def get(self, request):
+        '''
+            Searches the decks by title, description, tags and card text,
+            best match first, with the matches counted by type and price.
+        '''
+        overrides = { 'deck_type' : self.deck_type } if self.deck_type else {}
+        form = DeckSearchForm(request.QUERY_PARAMS, **overrides)
+
+        if form.is_valid():
+            return Response(form.submit(request))
+        else:
+            raise BadRequestException()
+
+class TopDecksView(APIView):
+    permission_classes = (IsAuthenticated,)
+    
+    def get(self, request):
+        '''
+            Gets the best selling decks of a window, with the sales of each
+            in the window.
+        '''
+        form = TopDecksForm(request.QUERY_PARAMS)
+
+        if form.is_valid():
+            return Response(form.submit(request))
+        else:
+            raise BadRequestException()
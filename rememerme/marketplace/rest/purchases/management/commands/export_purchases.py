@@ -0,0 +1,73 @@
+'''
+    Dumps the purchases of the whole store, or of one user, as NDJSON or
+    CSV. An interrupted dump continues after the cursor of the last line
+    written.
+
+    Usage: manage.py export_purchases [--format ndjson|csv] [--since DATE] [--until DATE]
+                                      [--user USER_ID] [--cursor CURSOR] [--output FILE] [--page-size N]
+
+    @author: Andrew Oberlin, Jake Gregg
+'''
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
+from rememerme.marketplace.schema import DateTimeField, Invalid
+from rememerme.marketplace.serializers import PurchaseSerializer
+from rememerme.marketplace.streaming import EXPORT_FORMATS, PURCHASE_FIELDS, streamExport, userPurchases, allPurchases
+from config.util import decodeCursor
+import sys
+
+parseDate = DateTimeField().compile()
+
+class Command(BaseCommand):
+    help = 'Streams every purchase, optionally of one user or between two dates, to a file or stdout.'
+    option_list = BaseCommand.option_list + (
+        make_option('--format', dest='format', type='choice', choices=sorted(EXPORT_FORMATS), default='ndjson',
+            help='ndjson (the default) or csv.'),
+        make_option('--since', dest='since', default=None,
+            help='Only purchases made on or after this date.'),
+        make_option('--until', dest='until', default=None,
+            help='Only purchases made before this date.'),
+        make_option('--user', dest='user_id', default=None,
+            help='Only the purchases of this user, oldest first.'),
+        make_option('--cursor', dest='cursor', default=None,
+            help='Continue after the purchase with this cursor.'),
+        make_option('--output', dest='output', default=None,
+            help='The file written to, appended to when resuming. Defaults to stdout.'),
+        make_option('--page-size', dest='page_size', type='int', default=None,
+            help='The purchases read at a time.'),
+    )
+
+    def handle(self, *args, **options):
+        try:
+            since = parseDate(options['since']) if options['since'] else None
+            until = parseDate(options['until']) if options['until'] else None
+            cursor = decodeCursor(options['cursor']) if options['cursor'] else None
+        except (Invalid, ValueError) as e:
+            raise CommandError(str(e))
+        page_size = options['page_size'] or settings.PURCHASE_EXPORT['PAGE_SIZE']
+
+        if options['user_id']:
+            purchases = userPurchases(options['user_id'], since, until, cursor, page_size)
+        else:
+            purchases = allPurchases(since, until, cursor, page_size)
+
+        exported = [0]
+        def rows():
+            for position, purchase in purchases:
+                exported[0] += 1
+                yield position, PurchaseSerializer(purchase).data
+
+        # the header of a resumed CSV dump is already in the file
+        chunks = streamExport(rows(), options['format'], PURCHASE_FIELDS)
+        if options['format'] == 'csv' and cursor is not None:
+            next(chunks)
+
+        output = open(options['output'], 'ab' if cursor is not None else 'wb') if options['output'] else sys.stdout
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+        finally:
+            if output is not sys.stdout:
+                output.close()
+        self.stderr.write('Exported %d purchases' % exported[0])
@@ -1,3 +1,502 @@
-from django.test import TestCase
+from django.conf import settings
+from django.test import SimpleTestCase
+from rememerme.marketplace import deckstats, entitlements, leaderboard, pool
+from rememerme.marketplace.bench import benchmark, measure
+from rememerme.marketplace.ledger import Ledger
+from rememerme.marketplace.models import Deck, DeckCard, Purchase
+from rememerme.marketplace.leaderboard import Leaderboard
+from rememerme.marketplace.purchasing import PurchasePipeline
+from rememerme.marketplace.streaming import PURCHASE_FIELDS, streamExport, userPurchases, allPurchases
+from rememerme.marketplace.rest.exceptions import InsufficientFunds, DeckAlreadyOwned,\
+    PurchaseInProgress
+from rememerme.marketplace.testing import MemoryManager
+from config.util import decodeCursor
+import datetime
+import json
+import random
+import threading
+import time
+import uuid
 
-# Create your tests here.
+class PurchasePipelineTest(SimpleTestCase):
+    
+    def setUp(self):
+        pool.setManager(MemoryManager())
+        self.user_id = str(uuid.uuid1())
+        self.deck = Deck(deck_type='phrase', title='Puns', price=30)
+        self.deck.save()
+        Ledger().credit(self.user_id, 50, 'gift')
+    
+    def tearDown(self):
+        pool.setManager(None)
+    
+    def test_retry_returns_same_purchase(self):
+        first = PurchasePipeline().submit(self.user_id, self.deck.deck_id, 'key-1')
+        again = PurchasePipeline().submit(self.user_id, self.deck.deck_id, 'key-1')
+        self.assertEqual(first.purchase_id, again.purchase_id)
+        self.assertEqual(Ledger().balance(self.user_id), 20)
+        self.assertRaises(DeckAlreadyOwned, PurchasePipeline().submit, self.user_id, self.deck.deck_id, 'key-2')
+    
+    def test_insufficient_funds_releases_claim(self):
+        expensive = Deck(deck_type='phrase', title='Gold', price=80)
+        expensive.save()
+        self.assertRaises(InsufficientFunds, PurchasePipeline().submit, self.user_id, expensive.deck_id, 'key-1')
+        Ledger().credit(self.user_id, 50, 'gift')
+        PurchasePipeline().submit(self.user_id, expensive.deck_id, 'key-2')
+        self.assertEqual(Ledger().balance(self.user_id), 20)
+    
+    def test_key_reused_for_another_deck(self):
+        other = Deck(deck_type='phrase', title='Riddles', price=10)
+        other.save()
+        first = PurchasePipeline().submit(self.user_id, self.deck.deck_id, 'key-1')
+        second = PurchasePipeline().submit(self.user_id, other.deck_id, 'key-1')
+        self.assertNotEqual(first.purchase_id, second.purchase_id)
+        self.assertEqual(Purchase.getByID(first.purchase_id).deck_id, self.deck.deck_id)
+        self.assertEqual(Ledger().balance(self.user_id), 10)
+    
+    def test_stalled_debit_is_not_repeated_by_a_retry(self):
+        entries = pool.columnFamily('wallet_ledger')
+        cas = entries.cas
+        stalled, retried = threading.Event(), threading.Event()
+        
+        def stallOriginal(key, expected, updates):
+            if threading.current_thread().name == 'original' and not stalled.is_set():
+                stalled.set()
+                retried.wait()
+            return cas(key, expected, updates)
+        entries.cas = stallOriginal
+        
+        purchases = []
+        def buy():
+            purchases.append(PurchasePipeline().submit(self.user_id, self.deck.deck_id, 'key-1'))
+        original = threading.Thread(target=buy, name='original')
+        original.start()
+        stalled.wait()
+        
+        # the original has taken longer than a retry waits for
+        timeout = settings.PURCHASES['PENDING_TIMEOUT']
+        settings.PURCHASES['PENDING_TIMEOUT'] = 0
+        try:
+            buy()
+        finally:
+            settings.PURCHASES['PENDING_TIMEOUT'] = timeout
+            retried.set()
+            original.join()
+        
+        self.assertEqual(len(purchases), 2)
+        self.assertEqual(purchases[0].purchase_id, purchases[1].purchase_id)
+        self.assertEqual(Ledger().balance(self.user_id), 20)
+
+class PurchaseStressTest(SimpleTestCase):
+    '''
+        Hammers the pipeline from many threads with retries, double clicks and
+        purchases of other decks racing for the same funds, then checks that
+        every purchase was paid for exactly once.
+    '''
+    threads = 16
+    attempts = 50
+    
+    def setUp(self):
+        pool.setManager(MemoryManager(latency=0.0001))
+    
+    def tearDown(self):
+        pool.setManager(None)
+    
+    def stress(self):
+        '''
+            Runs the purchases.
+            
+            @return: A report of the users, the outcome of every attempt and the attempts per second
+        '''
+        users = [str(uuid.uuid1()) for _ in range(4)]
+        decks = []
+        for i in range(10):
+            deck = Deck(deck_type='phrase', title='Deck %d' % i, price=10 + i)
+            deck.save()
+            decks.append(deck)
+        # enough to buy about half of the decks so the funds are contended
+        for user_id in users:
+            Ledger().credit(user_id, 70, 'gift')
+        
+        outcomes = { 'purchased' : 0, 'in_progress' : 0, 'owned' : 0, 'insufficient' : 0 }
+        lock = threading.Lock()
+        
+        def work(seed):
+            rand = random.Random(seed)
+            for _ in range(self.attempts):
+                user_id = rand.choice(users)
+                deck = rand.choice(decks)
+                # a few keys per deck so the same purchase is retried concurrently
+                key = '%s-%d' % (deck.deck_id, rand.randint(0, 2))
+                try:
+                    PurchasePipeline().submit(user_id, deck.deck_id, key)
+                    outcome = 'purchased'
+                except PurchaseInProgress:
+                    outcome = 'in_progress'
+                except DeckAlreadyOwned:
+                    outcome = 'owned'
+                except InsufficientFunds:
+                    outcome = 'insufficient'
+                with lock:
+                    outcomes[outcome] += 1
+        
+        start = time.time()
+        workers = [threading.Thread(target=work, args=(i, )) for i in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.time() - start
+        
+        total = self.threads * self.attempts
+        return { 'users' : users, 'outcomes' : outcomes, 'per_second' : total / elapsed if elapsed else 0.0 }
+    
+    def test_no_double_spends(self):
+        report = self.stress()
+        self.assertEqual(sum(report['outcomes'].values()), self.threads * self.attempts)
+        self.assertTrue(report['outcomes']['purchased'] > 0)
+        
+        ledger = Ledger()
+        for user_id in report['users']:
+            debits = [e for _, e in ledger.tail(user_id) if e['amount'] < 0]
+            purchases, _ = Purchase.filterByUser(user_id, 100)
+            
+            # one debit per purchase and never two purchases of the same deck
+            self.assertEqual(len(debits), len(purchases))
+            self.assertEqual(len(set(p.deck_id for p in purchases)), len(purchases))
+            self.assertEqual(sorted(d['reference'] for d in debits), sorted(p.purchase_id for p in purchases))
+            
+            spent = sum(p.price for p in purchases)
+            self.assertEqual(ledger.balance(user_id), 70 - spent)
+            self.assertTrue(ledger.balance(user_id) >= 0)
+    
+    @benchmark
+    def test_throughput(self):
+        # about a tenth of the attempts per second made on a developer machine
+        self.assertGreater(self.stress()['per_second'], 500)
+
+class DeckStatsTest(SimpleTestCase):
+    '''
+        The counters of a deck should follow its cards, purchases and plays,
+        and repair should put back any that drift.
+    '''
+    
+    def setUp(self):
+        pool.setManager(MemoryManager())
+        self.deck = Deck(deck_type='phrase', title='Puns', price=0)
+        self.deck.save()
+    
+    def tearDown(self):
+        pool.setManager(None)
+    
+    def stats(self):
+        return deckstats.statsFor([self.deck.deck_id])[self.deck.deck_id]
+    
+    def test_counters_follow_writes(self):
+        card_ids = [str(uuid.uuid1()) for _ in range(5)]
+        DeckCard.add(self.deck.deck_id, card_ids)
+        # writing the same cards again doesn't count them twice
+        DeckCard.add(self.deck.deck_id, card_ids[:2])
+        DeckCard.remove(self.deck.deck_id, card_ids[:1])
+        
+        pipeline = PurchasePipeline()
+        pipeline.submit(str(uuid.uuid1()), self.deck.deck_id, 'once')
+        user_id = str(uuid.uuid1())
+        pipeline.submit(user_id, self.deck.deck_id, 'retried')
+        pipeline.submit(user_id, self.deck.deck_id, 'retried')
+        
+        game_id = uuid.uuid1()
+        deckstats.recordPlay(self.deck.deck_id, game_id)
+        # a retried start of the same game
+        deckstats.recordPlay(self.deck.deck_id, game_id)
+        self.assertEqual(self.stats(), { 'cards' : 4, 'purchases' : 2, 'plays' : 1 })
+    
+    def test_sale_committed_by_a_retry_is_counted_once(self):
+        user_id = str(uuid.uuid1())
+        pipeline = PurchasePipeline()
+        claim = pipeline.reserve(user_id, self.deck, 'key-1')
+        claim = pipeline.grant(user_id, self.deck, claim)
+        # a retry lands before the original commits, or after it crashed
+        retried = PurchasePipeline().submit(user_id, self.deck.deck_id, 'key-1')
+        
+        self.assertEqual(pipeline.commit(user_id, self.deck, claim).purchase_id, retried.purchase_id)
+        self.assertEqual(self.stats()['purchases'], 1)
+    
+    def test_repair(self):
+        DeckCard.add(self.deck.deck_id, [str(uuid.uuid1()) for _ in range(3)])
+        PurchasePipeline().submit(str(uuid.uuid1()), self.deck.deck_id)
+        deckstats.counters().add(self.deck.deck_id, deckstats.CARDS, 7)
+        deckstats.counters().add(self.deck.deck_id, deckstats.PURCHASES, -1)
+        
+        report = deckstats.repair(10, fix=False)
+        self.assertEqual(report['decks'], 1)
+        self.assertEqual(sorted((drift['counter'], drift['stored'], drift['actual']) for drift in report['drift']),
+                         [('cards', 10, 3), ('purchases', 0, 1)])
+        self.assertEqual(self.stats()['cards'], 10)
+        
+        deckstats.repair(10)
+        self.assertEqual(self.stats(), { 'cards' : 3, 'purchases' : 1, 'plays' : 0 })
+        self.assertEqual(deckstats.repair(10)['drifted'], 0)
+    
+    def test_repair_skips_counters_written_meanwhile(self):
+        DeckCard.add(self.deck.deck_id, [str(uuid.uuid1()) for _ in range(3)])
+        deckstats.counters().add(self.deck.deck_id, deckstats.CARDS, 7)
+        recount = deckstats.recount
+        
+        def recountThenPlay(deck_id, purchases):
+            actual = recount(deck_id, purchases)
+            # a game starts after its deck was recounted
+            deckstats.recordPlay(deck_id, uuid.uuid1())
+            return actual
+        
+        deckstats.recount = recountThenPlay
+        try:
+            report = deckstats.repair(10)
+        finally:
+            deckstats.recount = recount
+        self.assertEqual(report['skipped'], 1)
+        self.assertEqual([drift['counter'] for drift in report['drift']], ['cards'])
+        self.assertEqual(self.stats(), { 'cards' : 3, 'purchases' : 0, 'plays' : 1 })
+
+class Clock(object):
+    '''
+        A clock moved by hand.
+    '''
+    
+    def __init__(self):
+        self.now = 1000 * 3600.0
+    
+    def __call__(self):
+        return self.now
+
+class LeaderboardTest(SimpleTestCase):
+    '''
+        Each window should rank its best sellers as sales land and drop the
+        sales of the hours that pass out of it.
+    '''
+    windows = { 'today' : 24, 'week' : 168, 'all' : None }
+    
+    def setUp(self):
+        pool.setManager(MemoryManager())
+        self.clock = Clock()
+    
+    def tearDown(self):
+        pool.setManager(None)
+    
+    def test_windows_expire(self):
+        board = Leaderboard(self.windows, 3, clock=self.clock)
+        for _ in range(3):
+            board.add('old')
+        self.clock.now += 30 * 3600
+        board.add('new')
+        board.add('new')
+        board.add('other')
+        self.assertEqual(board.query('today', 10), [('new', 2), ('other', 1)])
+        self.assertEqual(board.query('week', 10), [('old', 3), ('new', 2), ('other', 1)])
+        
+        self.clock.now += 200 * 3600
+        self.assertEqual(board.query('today', 10), [])
+        self.assertEqual(board.query('week', 10), [])
+        self.assertEqual(board.query('all', 1), [('old', 3)])
+    
+    def test_ranking_matches_counts(self):
+        board = Leaderboard(self.windows, 10, clock=self.clock)
+        generator = random.Random(22)
+        counts = {}
+        for _ in range(5000):
+            deck_id = 'deck-%d' % int(generator.paretovariate(1.2))
+            board.add(deck_id)
+            counts[deck_id] = counts.get(deck_id, 0) + 1
+        ranked = board.query('all', 10)
+        self.assertEqual([count for _, count in ranked], sorted(counts.values(), reverse=True)[:10])
+        self.assertTrue(all(counts[deck_id] == count for deck_id, count in ranked))
+    
+    def test_purchases_rebuild(self):
+        leaderboard.board.load({}, {})
+        decks = []
+        for i in range(3):
+            deck = Deck(deck_type='phrase', title='Deck %d' % i, price=0)
+            deck.save()
+            decks.append(deck)
+        for deck, buyers in zip(decks, (1, 3, 2)):
+            for _ in range(buyers):
+                PurchasePipeline().submit(str(uuid.uuid1()), deck.deck_id)
+        expected = [(decks[1].deck_id, 3), (decks[2].deck_id, 2), (decks[0].deck_id, 1)]
+        self.assertEqual(leaderboard.board.query('today', 10), expected)
+        
+        # a restarted process gets the same ranking back from the counters
+        leaderboard.board.load({}, {})
+        self.assertEqual(leaderboard.board.query('week', 10), [])
+        leaderboard.rebuild()
+        self.assertEqual(leaderboard.board.query('week', 10), expected)
+        self.assertEqual(leaderboard.board.query('all', 10), expected)
+    
+    def test_sale_committed_by_a_retry_is_counted_once(self):
+        leaderboard.board.load({}, {})
+        deck = Deck(deck_type='phrase', title='Puns', price=0)
+        deck.save()
+        user_id = str(uuid.uuid1())
+        pipeline = PurchasePipeline()
+        claim = pipeline.grant(user_id, deck, pipeline.reserve(user_id, deck, 'key-1'))
+        PurchasePipeline().submit(user_id, deck.deck_id, 'key-1')
+        pipeline.commit(user_id, deck, claim)
+        
+        self.assertEqual(leaderboard.board.query('today', 10), [(deck.deck_id, 1)])
+        leaderboard.board.load({}, {})
+        leaderboard.rebuild()
+        self.assertEqual(leaderboard.board.query('all', 10), [(deck.deck_id, 1)])
+
+@benchmark
+class LeaderboardBenchmark(SimpleTestCase):
+    '''
+        Counting a sale and reading a leaderboard should both take a few
+        microseconds with tens of thousands of decks selling.
+    '''
+    
+    def test_update_and_query(self):
+        board = Leaderboard({ 'today' : 24, 'week' : 168, 'all' : None }, 100)
+        generator = random.Random(22)
+        deck_ids = ['deck-%d' % int(generator.paretovariate(0.25)) for _ in range(200000)]
+        
+        start = time.time()
+        for deck_id in deck_ids:
+            board.add(deck_id)
+        elapsed = time.time() - start
+        timing = measure(lambda: board.query('week', 20), 5000)
+        self.assertGreater(len(deck_ids) / elapsed, 20000)
+        self.assertLess(timing['p50_ms'], 0.1)
+
+class PurchaseExportTest(SimpleTestCase):
+    '''
+        An export should stream the purchases between its dates and pick up
+        after the last line received.
+    '''
+    
+    def setUp(self):
+        pool.setManager(MemoryManager())
+        self.user_id = str(uuid.uuid1())
+        start = datetime.datetime(2014, 1, 1)
+        for day in range(30):
+            for user_id in (self.user_id, str(uuid.uuid1())):
+                Purchase(purchase_id=str(uuid.uuid1()), user_id=user_id, deck_id=str(uuid.uuid1()), price=day,
+                         date_created=start + datetime.timedelta(days=day, hours=12)).save()
+    
+    def tearDown(self):
+        pool.setManager(None)
+    
+    def export(self, purchases, format='ndjson'):
+        rows = ((position, { 'price' : purchase.price, 'date_created' : purchase.date_created,
+                             'purchase_id' : purchase.purchase_id }) for position, purchase in purchases)
+        return ''.join(streamExport(rows, format, PURCHASE_FIELDS))
+    
+    def test_user_export_filters_and_resumes(self):
+        since, until = datetime.datetime(2014, 1, 5), datetime.datetime(2014, 1, 15)
+        lines = [json.loads(line) for line in self.export(userPurchases(self.user_id, since, until, page_size=3)).splitlines()]
+        self.assertEqual([line['price'] for line in lines], range(4, 14))
+        
+        # a connection dropped after the fourth line
+        cursor = decodeCursor(lines[3]['cursor'])
+        resumed = [json.loads(line) for line in
+                   self.export(userPurchases(self.user_id, since, until, cursor, page_size=3)).splitlines()]
+        self.assertEqual([line['purchase_id'] for line in lines[:4] + resumed], [line['purchase_id'] for line in lines])
+    
+    def test_store_export_resumes(self):
+        lines = self.export(allPurchases(datetime.datetime(2014, 1, 11), page_size=7), 'csv').splitlines()
+        self.assertEqual(lines[0].split(','), list(PURCHASE_FIELDS) + ['cursor'])
+        self.assertEqual(len(lines), 41)
+        
+        cursor = decodeCursor(lines[20].split(',')[-1])
+        resumed = self.export(allPurchases(datetime.datetime(2014, 1, 11), cursor=cursor, page_size=7), 'csv').splitlines()
+        self.assertEqual(lines[21:], resumed[1:])
+
+class EntitlementTest(SimpleTestCase):
+    '''
+        Paid decks should only be playable by the users who bought them,
+        answered without a round trip once the user is cached.
+    '''
+    
+    def setUp(self):
+        self.manager = MemoryManager()
+        pool.setManager(self.manager)
+        entitlements.owned.clear()
+        self.user_id = str(uuid.uuid1())
+        self.paid = Deck(deck_type='phrase', title='Gold', price=30)
+        self.paid.save()
+        self.free = Deck(deck_type='phrase', title='Starter', price=0)
+        self.free.save()
+        Ledger().credit(self.user_id, 50, 'gift')
+    
+    def tearDown(self):
+        pool.setManager(None)
+        entitlements.owned.clear()
+    
+    def test_paid_decks_need_purchase(self):
+        self.assertFalse(entitlements.canPlay(self.user_id, self.paid.deck_id))
+        self.assertTrue(entitlements.canPlay(self.user_id, self.free.deck_id))
+        # decks the marketplace doesn't sell are left to the games service
+        self.assertTrue(entitlements.canPlay(self.user_id, uuid.uuid1()))
+        
+        PurchasePipeline().submit(self.user_id, self.paid.deck_id)
+        calls = self.manager.calls()
+        self.assertTrue(entitlements.canPlay(self.user_id, self.paid.deck_id))
+        self.assertEqual(self.manager.calls(), calls)
+    
+    def test_purchase_in_another_process(self):
+        self.assertFalse(entitlements.owns(self.user_id, self.paid.deck_id))
+        PurchasePipeline().submit(self.user_id, self.paid.deck_id)
+        # as if the purchase had gone through another process
+        decks, _ = entitlements.owned.get(self.user_id)
+        entitlements.owned.set(self.user_id, (frozenset(), time.time()))
+        self.assertFalse(entitlements.owns(self.user_id, self.paid.deck_id))
+        
+        entitlements.owned.set(self.user_id, (frozenset(), time.time() - 60))
+        self.assertTrue(entitlements.owns(self.user_id, self.paid.deck_id))
+        self.assertEqual(entitlements.owned.get(self.user_id)[0], decks)
+
+class EntitlementConcurrencyTest(SimpleTestCase):
+    '''
+        Checking decks while many games start at once should answer every
+        check right, whatever the number of decks a user owns.
+    '''
+    threads = 16
+    checks = 2000
+    
+    def setUp(self):
+        entitlements.owned.clear()
+        self.generator = random.Random(24)
+        users = {}
+        for _ in range(1000):
+            decks = [str(uuid.uuid4()) for _ in range(self.generator.randint(1, 200))]
+            user_id = str(uuid.uuid4())
+            entitlements.owned.set(user_id, (frozenset(entitlements.encode(deck_id) for deck_id in decks), time.time()))
+            users[user_id] = decks
+        self.pairs = [(user_id, self.generator.choice(decks)) for user_id, decks in users.items()]
+    
+    def tearDown(self):
+        entitlements.owned.clear()
+    
+    def test_concurrent_checks(self):
+        failures = []
+        def work(seed):
+            rand = random.Random(seed)
+            for _ in range(self.checks):
+                if not entitlements.owns(*rand.choice(self.pairs)):
+                    failures.append(seed)
+        
+        workers = [threading.Thread(target=work, args=(i, )) for i in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(failures, [])
+
+@benchmark
+class EntitlementBenchmark(EntitlementConcurrencyTest):
+    '''
+        Checking a deck should take a few microseconds.
+    '''
+    checks = 20000
+    
+    def test_check_latency(self):
+        timing = measure(lambda: entitlements.owns(*self.generator.choice(self.pairs)), 5000)
+        self.assertLess(timing['p50_ms'], 0.05)
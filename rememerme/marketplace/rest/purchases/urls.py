@@ -1,9 +1,9 @@
 from django.conf.urls import patterns, url
 
-from rememerme.games.rest.games import views
+from rememerme.marketplace.rest.purchases import views
 
 urlpatterns = patterns('',
-    url(r'^/requests/?', views.GameRequestView.as_view()),
-    url(r'^/(?P<game_id>[-\w]+)/?', views.GamesSingleView.as_view()),
-    url(r'^/?$', views.GamesListView.as_view())
+    url(r'^/export/?$', views.PurchasesExportView.as_view()),
+    url(r'^/(?P<purchase_id>[-\w]+)/?$', views.PurchaseSingleView.as_view()),
+    url(r'^/?$', views.PurchasesView.as_view())
 )
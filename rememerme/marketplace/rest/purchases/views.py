@@ -1,8 +1,10 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rememerme.games.rest.games.forms import GameRequestsForm, GamesPostForm, GamesListGetForm, GamesSingleGetForm
+from rememerme.marketplace.rest.purchases.forms import GameRequestsForm, GamesPostForm, GamesListGetForm, GamesSingleGetForm, \
+    PurchasePostForm, PurchasesListGetForm, PurchaseSingleGetForm, PurchasesExportForm
 from rememerme.games.rest.exceptions import BadRequestException
 from rest_framework.permissions import IsAuthenticated
+from config.util import pagedResponse
 
 class GamesListView(APIView):
     permission_classes = (IsAuthenticated,)
@@ -40,7 +42,7 @@ class GamesSingleView(APIView):
         '''
             Used to create a new friend request.
         '''
-        form = GamesSingleGetForm({ 'game_id' : game_id })
+        form = GamesSingleGetForm(request.QUERY_PARAMS, game_id=game_id)
 
         if form.is_valid():
             return Response(form.submit(request))
@@ -62,4 +64,57 @@ class GameRequestView(APIView):
             return Response(form.submit(request))
         else:
             raise BadRequestException()
-        
+
+class PurchasesView(APIView):
+    permission_classes = (IsAuthenticated, )
+    
+    def get(self, request):
+        '''
+            Gets the decks the user bought, newest first.
+        '''
+        form = PurchasesListGetForm(request.QUERY_PARAMS)
+
+        if form.is_valid():
+            return pagedResponse(form.submit(request), form.next_cursor)
+        else:
+            raise BadRequestException()
+    
+    def post(self, request):
+        '''
+            Buys a deck.
+        '''
+        form = PurchasePostForm(request.DATA)
+
+        if form.is_valid():
+            return Response(form.submit(request))
+        else:
+            raise BadRequestException()
+
+class PurchasesExportView(APIView):
+    permission_classes = (IsAuthenticated, )
+    
+    def get(self, request):
+        '''
+            Streams every purchase of the user as NDJSON or CSV, optionally
+            between two dates.
+        '''
+        form = PurchasesExportForm(request.QUERY_PARAMS)
+
+        if form.is_valid():
+            return form.stream(request)
+        else:
+            raise BadRequestException()
+
+class PurchaseSingleView(APIView):
+    permission_classes = (IsAuthenticated, )
+    
+    def get(self, request, purchase_id):
+        '''
+            Gets a single purchase of the user.
+        '''
+        form = PurchaseSingleGetForm(request.QUERY_PARAMS, purchase_id=purchase_id)
+
+        if form.is_valid():
+            return Response(form.submit(request))
+        else:
+            raise BadRequestException()
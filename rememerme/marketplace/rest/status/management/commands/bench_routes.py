@@ -0,0 +1,53 @@
+'''
+    Benchmarks every route against in-memory stand-ins for Cassandra and
+    the other rememerme services and writes out a JSON report.
+
+    Usage: manage.py bench_routes [--requests N] [--concurrency N] [--decks N]
+        [--cards N] [--games N] [--latency SECONDS] [--only TEXT]
+        [--output FILE] [--compare FILE]
+
+    @author: Andrew Oberlin, Jake Gregg
+'''
+from django.core.management.base import BaseCommand
+from optparse import make_option
+from rememerme.marketplace import harness
+import json
+
+class Command(BaseCommand):
+    help = 'Benchmarks every route with in-memory data and reports throughput, p50/p99 and datastore calls.'
+    option_list = BaseCommand.option_list + (
+        make_option('--requests', dest='requests', type='int', default=100,
+            help='The requests made to each route.'),
+        make_option('--concurrency', dest='concurrency', type='int', default=4,
+            help='The number of clients making requests at once.'),
+        make_option('--decks', dest='decks', type='int', default=10,
+            help='The decks of each type seeded.'),
+        make_option('--cards', dest='cards', type='int', default=100,
+            help='The cards seeded in each deck.'),
+        make_option('--games', dest='games', type='int', default=10,
+            help='The games seeded.'),
+        make_option('--latency', dest='latency', type='float', default=0.0,
+            help='Simulated Cassandra round trip in seconds.'),
+        make_option('--only', dest='only', default=None,
+            help='Only run the scenarios whose name contains this.'),
+        make_option('--output', dest='output', default=None,
+            help='Write the report to this file instead of stdout.'),
+        make_option('--compare', dest='compare', default=None,
+            help='A previous report to compare this run with.'),
+    )
+    
+    def handle(self, *args, **options):
+        report = harness.benchmark(requests=options['requests'], concurrency=options['concurrency'],
+                                   decks=options['decks'], cards=options['cards'], games=options['games'],
+                                   latency=options['latency'], only=options['only'])
+        
+        if options['compare']:
+            with open(options['compare']) as previous:
+                report['compared_with'] = harness.compare(json.load(previous), report)
+        
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
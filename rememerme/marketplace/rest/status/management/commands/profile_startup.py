@@ -0,0 +1,49 @@
+'''
+    Reports how long the WSGI app takes to start and which modules the time
+    goes to. The app is started in a new interpreter so nothing is already
+    imported.
+
+    Usage: manage.py profile_startup [--module MODULE] [--limit N] [--prewarm]
+        [--eager] [--first-request PATH] [--json]
+
+    @author: Andrew Oberlin, Jake Gregg
+'''
+from django.core.management.base import BaseCommand
+from optparse import make_option
+from rememerme.marketplace import startup
+import json
+
+class Command(BaseCommand):
+    help = 'Reports the startup time of the WSGI app and the import time of each module.'
+    option_list = BaseCommand.option_list + (
+        make_option('--module', dest='module', default='config.wsgi',
+            help='The module making the WSGI app.'),
+        make_option('--limit', dest='limit', type='int', default=30,
+            help='The number of slowest modules listed.'),
+        make_option('--prewarm', dest='prewarm', action='store_true', default=False,
+            help='Open the Cassandra pool like a production worker does.'),
+        make_option('--eager', dest='eager', action='store_true', default=False,
+            help='Load every route at startup instead of the lazy ones on first hit.'),
+        make_option('--first-request', dest='first_request', default=None,
+            help='A path to request once the app is started.'),
+        make_option('--json', dest='json', action='store_true', default=False,
+            help='Write out the whole report as JSON.'),
+    )
+    
+    def handle(self, *args, **options):
+        report = startup.measure(options['module'], prewarm=options['prewarm'],
+                                 lazy=False if options['eager'] else None,
+                                 first_request=options['first_request'])
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2, sort_keys=True))
+            return
+        
+        self.stdout.write('%s started in %.3fs (target %.3fs, lazy %s)' % (report['module'], report['seconds'],
+                          report['target_seconds'], report['lazy']))
+        if 'first_request' in report:
+            first = report['first_request']
+            self.stdout.write('first request to %s: %d in %.3fs' % (first['path'], first['status'], first['seconds']))
+        self.stdout.write('%10s %10s  %s' % ('self ms', 'total ms', 'module'))
+        slowest = sorted(report['modules'].items(), key=lambda item: item[1]['self_ms'], reverse=True)
+        for module, times in slowest[:options['limit']]:
+            self.stdout.write('%10.1f %10.1f  %s' % (times['self_ms'], times['cumulative_ms'], module))
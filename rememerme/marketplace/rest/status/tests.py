@@ -0,0 +1,220 @@
+from django.conf import settings
+from django.core.urlresolvers import RegexURLResolver, RegexURLPattern
+from django.test import SimpleTestCase
+from pycassa.cassandra.ttypes import TimedOutException, UnavailableException
+from pycassa.pool import MaximumRetryException
+from rest_framework.views import APIView
+from rememerme.marketplace import harness, metrics, pool, startup, users
+from rememerme.marketplace.bench import benchmark
+from rememerme.marketplace.pool import ConnectionManager, Node, PoolStats
+import itertools
+
+class NodeSelectionTest(SimpleTestCase):
+    '''
+        Checks the node selection and failover of the ConnectionManager.
+    '''
+    
+    def makeManager(self, strategy, servers):
+        manager = ConnectionManager('marketplace', [], strategy=strategy)
+        manager.nodes = [Node(server, None, PoolStats(), 10) for server in servers]
+        manager.cycle = itertools.cycle(range(len(servers)))
+        return manager
+    
+    def test_round_robin(self):
+        manager = self.makeManager('round_robin', ['a', 'b', 'c'])
+        used = [manager.execute(lambda node: node.server) for _ in range(6)]
+        self.assertEqual(used, ['a', 'b', 'c', 'a', 'b', 'c'])
+    
+    def test_latency_aware(self):
+        manager = self.makeManager('latency', ['a', 'b'])
+        manager.nodes[0].latency = 0.5
+        manager.nodes[1].latency = 0.01
+        used = set(manager.execute(lambda node: node.server) for _ in range(20))
+        self.assertEqual(used, set(['b']))
+    
+    def test_failover(self):
+        manager = self.makeManager('round_robin', ['a', 'b'])
+        
+        def call(node):
+            if node.server == 'a':
+                raise TimedOutException()
+            return node.server
+        
+        self.assertEqual(manager.execute(call), 'b')
+        self.assertFalse(manager.nodes[0].isUp())
+        self.assertEqual(manager.nodes[0].timeouts, 1)
+        # the node that timed out is tried last until it comes back
+        self.assertEqual([n.server for n in manager.candidates()], ['b', 'a'])
+    
+    def test_no_failover_after_write_timeout(self):
+        manager = self.makeManager('round_robin', ['a', 'b'])
+        tried = []
+        
+        def call(node):
+            tried.append(node.server)
+            if node.server == 'a':
+                raise TimedOutException()
+            return node.server
+        
+        # a counter add that timed out may have been applied, so it isn't sent again
+        self.assertRaises(TimedOutException, manager.execute, call, idempotent=False)
+        self.assertEqual(tried, ['a'])
+        self.assertFalse(manager.nodes[0].isUp())
+    
+    def test_failover_after_refused_write(self):
+        manager = self.makeManager('round_robin', ['a', 'b'])
+        
+        def call(node):
+            if node.server == 'a':
+                raise UnavailableException()
+            return node.server
+        
+        self.assertEqual(manager.execute(call, idempotent=False), 'b')
+    
+    def failAttempt(self, node, error):
+        # what pycassa's pool does with max_retries=0
+        node.stats.connection_failed({ 'error' : error, 'server' : node.server, 'connection' : None })
+        raise MaximumRetryException('Retried 1 times. Last failure was %s: ' % error.__class__.__name__)
+    
+    def test_failover_after_wrapped_refusal(self):
+        manager = self.makeManager('round_robin', ['a', 'b'])
+        
+        def call(node):
+            if node.server == 'a':
+                self.failAttempt(node, UnavailableException())
+            return node.server
+        
+        self.assertEqual(manager.execute(call, idempotent=False), 'b')
+    
+    def test_no_failover_after_wrapped_timeout(self):
+        manager = self.makeManager('round_robin', ['a', 'b'])
+        
+        def call(node):
+            if node.server == 'a':
+                self.failAttempt(node, TimedOutException())
+            return node.server
+        
+        self.assertRaises(MaximumRetryException, manager.execute, call, idempotent=False)
+        self.assertEqual(manager.execute(lambda node: node.server), 'b')
+
+class FakeColumnFamily(object):
+    
+    def get(self, key):
+        return { 'a' : '1' }
+    
+    def multiget(self, keys):
+        return dict((key, { 'a' : '1' }) for key in keys)
+    
+    def get_range(self):
+        for i in range(3):
+            yield str(i), {}
+    
+    def insert(self, key, columns):
+        pass
+
+class FakeRequest(object):
+    
+    def __init__(self, path):
+        self.path_info = path
+
+class FakeResponse(object):
+    streaming = False
+    content = 'x' * 10
+
+class MetricsTest(SimpleTestCase):
+    '''
+        Checks that datastore calls are counted against the route of the request.
+    '''
+    
+    def setUp(self):
+        metrics.instrument(FakeColumnFamily, ['get', 'multiget', 'get_range', 'insert'])
+        metrics.registry.clear()
+        self.resolver = RegexURLResolver(r'^/', [
+            RegexURLResolver(r'^rest/v1/phrase_decks/(?P<deck_id>[-\w]+)/cards', [
+                RegexURLPattern(r'^/?$', None)
+            ]),
+            RegexURLResolver(r'^rest/v1/phrase_decks', [
+                RegexURLPattern(r'^/(?P<deck_id>[-\w]+)/?$', None),
+                RegexURLPattern(r'^/?$', None)
+            ])
+        ])
+    
+    def test_route_pattern(self):
+        self.assertEqual(metrics.routePattern('/rest/v1/phrase_decks/abc/cards', self.resolver),
+                         'rest/v1/phrase_decks/(?P<deck_id>[-\w]+)/cards/?')
+        self.assertEqual(metrics.routePattern('/rest/v1/phrase_decks/', self.resolver), 'rest/v1/phrase_decks/?')
+        self.assertEqual(metrics.routePattern('/nowhere', self.resolver), None)
+    
+    def test_request_counts(self):
+        middleware = metrics.MetricsMiddleware.__new__(metrics.MetricsMiddleware)
+        request = FakeRequest('/rest/v1/phrase_decks/abc')
+        middleware.process_request(request)
+        metrics.current().route = metrics.routePattern(request.path_info, self.resolver)
+        
+        cf = FakeColumnFamily()
+        cf.get('a')
+        cf.multiget(['a', 'b', 'c'])
+        list(cf.get_range())
+        cf.insert('a', {})
+        middleware.process_response(request, FakeResponse())
+        
+        # calls outside of a request aren't counted
+        cf.get('a')
+        
+        stats = metrics.registry.stats()['rest/v1/phrase_decks/(?P<deck_id>[-\w]+)/?']
+        self.assertEqual(stats['requests'], 1)
+        self.assertEqual(stats['datastore_calls'], 4)
+        self.assertEqual(stats['rows_read'], 7)
+        self.assertEqual(stats['bytes_serialized'], 10)
+        self.assertTrue('marketplace_datastore_calls_total{route="rest/v1/phrase_decks/(?P<deck_id>[-\\\\w]+)/?",method="multiget"} 1'
+                        in metrics.registry.exposition())
+
+class RouteBenchmarkTest(SimpleTestCase):
+    '''
+        Runs the route benchmark with a little data to keep it working.
+    '''
+    
+    def test_every_route_is_run(self):
+        report = harness.benchmark(requests=4, concurrency=2, decks=2, cards=5, games=2)
+        
+        for route in harness.routes():
+            self.assertTrue('GET ' + route in report['scenarios'])
+        purchases = report['scenarios']['POST rest/v1/account/purchases/?']
+        self.assertEqual(purchases['statuses'], { '200' : 4 })
+        self.assertTrue(purchases['datastore_calls_per_request'] > 0)
+        
+        changes = harness.compare(report, report)
+        self.assertEqual(changes['POST rest/v1/account/purchases/?']['p50_ms'], 0.0)
+
+class FakesTest(SimpleTestCase):
+    
+    def test_restore_puts_everything_back(self):
+        from rememerme.games import models as games
+        game, authenticators = games.Game, APIView.__dict__['get_authenticators']
+        client, manager = users.UserClient, pool._manager
+        
+        fakes, patched = harness.installFakes(0.0)
+        self.assertTrue(games.Game is fakes['Game'])
+        self.assertTrue(users.UserClient is harness.BenchUserClient)
+        harness.restoreFakes(patched)
+        
+        self.assertTrue(games.Game is game)
+        self.assertTrue(APIView.__dict__['get_authenticators'] is authenticators)
+        self.assertTrue(users.UserClient is client)
+        self.assertTrue(pool._manager is manager)
+
+class StartupTimeTest(SimpleTestCase):
+    '''
+        A worker should start within STARTUP['TARGET_SECONDS'] without
+        loading the routes it leaves for their first hit.
+    '''
+    
+    def test_routes_left_for_their_first_hit(self):
+        report = startup.measure('config.wsgi')
+        self.assertTrue('rememerme.marketplace.rest.purchases.views' in report['modules'])
+        self.assertFalse('rememerme.marketplace.rest.status.views' in report['modules'])
+        self.assertFalse('rest_framework_swagger' in report['modules'])
+    
+    @benchmark
+    def test_startup_within_target(self):
+        self.assertLess(startup.measure('config.wsgi')['seconds'], settings.STARTUP['TARGET_SECONDS'])
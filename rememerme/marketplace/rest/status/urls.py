@@ -0,0 +1,13 @@
+from django.conf.urls import patterns, url
+
+from rememerme.marketplace.rest.status import views
+
+urlpatterns = patterns('',
+    url(r'^/pool/?$', views.PoolStatsView.as_view()),
+    url(r'^/cache/?$', views.CacheStatsView.as_view()),
+    url(r'^/sessions/?$', views.SessionCacheStatsView.as_view()),
+    url(r'^/entitlements/?$', views.EntitlementStatsView.as_view()),
+    url(r'^/identity/?$', views.IdentityMapStatsView.as_view()),
+    url(r'^/routes/?$', views.RouteStatsView.as_view()),
+    url(r'^/metrics/?$', views.MetricsView.as_view())
+)
@@ -0,0 +1,113 @@
+from rest_framework.views import APIView
+from rest_framework.response import Response
+from rest_framework.permissions import BasePermission
+from django.conf import settings
+from django.http import HttpResponse
+from rememerme.marketplace import pool, metrics, auth, identity, entitlements
+from rememerme.marketplace.cache import catalog
+
+class IsMonitoringHost(BasePermission):
+    '''
+        Only lets the hosts listed in settings.MONITORING_HOSTS read the stats.
+    '''
+    
+    def has_permission(self, request, view):
+        return request.META.get('REMOTE_ADDR') in settings.MONITORING_HOSTS
+
+class PoolStatsView(APIView):
+    authentication_classes = ()
+    permission_classes = (IsMonitoringHost,)
+    
+    '''
+       Used by monitoring to watch the Cassandra connection pools.
+    '''
+    
+    def get(self, request):
+        '''
+            Gets the checked out connections, waits and timeouts of every node.
+        '''
+        return Response(pool.stats())
+
+class CacheStatsView(APIView):
+    authentication_classes = ()
+    permission_classes = (IsMonitoringHost,)
+    
+    '''
+       Used by monitoring to watch the deck catalog cache.
+    '''
+    
+    def get(self, request):
+        '''
+            Gets the hit ratio of the catalog cache and the bytes saved by 304s.
+        '''
+        return Response(catalog.stats())
+
+class SessionCacheStatsView(APIView):
+    authentication_classes = ()
+    permission_classes = (IsMonitoringHost,)
+    
+    '''
+       Used by monitoring to watch the cache of validated sessions.
+    '''
+    
+    def get(self, request):
+        '''
+            Gets the hit ratio and size of the session cache.
+        '''
+        return Response(auth.stats())
+
+class EntitlementStatsView(APIView):
+    authentication_classes = ()
+    permission_classes = (IsMonitoringHost,)
+    
+    '''
+       Used by monitoring to watch the cache of the decks each user owns.
+    '''
+    
+    def get(self, request):
+        '''
+            Gets the hit ratio and size of the entitlement cache.
+        '''
+        return Response(entitlements.stats())
+
+class IdentityMapStatsView(APIView):
+    authentication_classes = ()
+    permission_classes = (IsMonitoringHost,)
+    
+    '''
+       Used by monitoring to see how many reads the identity maps save.
+    '''
+    
+    def get(self, request):
+        '''
+            Gets the reads served from the request identity maps and the reads made through them.
+        '''
+        return Response(identity.totals.toMap())
+
+class RouteStatsView(APIView):
+    authentication_classes = ()
+    permission_classes = (IsMonitoringHost,)
+    
+    '''
+       Used to find the routes making the most Cassandra calls per request.
+    '''
+    
+    def get(self, request):
+        '''
+            Gets the latency, datastore calls, rows read and bytes written of every route.
+        '''
+        return Response(metrics.registry.stats())
+
+class MetricsView(APIView):
+    authentication_classes = ()
+    permission_classes = (IsMonitoringHost,)
+    
+    '''
+       Scraped by Prometheus.
+    '''
+    
+    def get(self, request):
+        '''
+            Gets the metrics of every route in the Prometheus text format.
+        '''
+        return HttpResponse(metrics.registry.exposition(), content_type='text/plain; version=0.0.4')
@@ -6,7 +6,6 @@
 
     @author: Andrew Oberlin, Jake Gregg
 '''
-from django import forms
 from rememerme.games.models import Game, GameMember
 from rememerme.games.rest.exceptions import InvalidWinningScore, GameNotFound,\
     BadRequestException
@@ -15,16 +14,22 @@ from uuid import UUID
 import uuid
 from pycassa.cassandra.ttypes import NotFoundException as CassaNotFoundException
 import datetime
-import json
 from rememerme.games.permissions import GamePermissions
-from rememerme.users.client import UserClient, UserClientError
+from rememerme.marketplace import memberships
+from rememerme.marketplace.loaders import getByIDs
+from rememerme.marketplace.users import existingUsers
+from rememerme.marketplace.unitofwork import UnitOfWork
+from rememerme.marketplace.ledger import Ledger
+from rememerme.marketplace.schema import Schema, SchemaForm, UUIDField, IntField, TextField, JSONListField
+from rememerme.marketplace.rest.exceptions import InvalidParameters
+from config.util import getLimit, getCursor
 
-class GamesListGetForm(forms.Form):
+class GamesListGetForm(SchemaForm):
 
     def submit(self, request):
         try:
             game_memberships = GameMember.filterByUser(request.user.pk)
-            games = [Game.getByID(mem.game_id) for mem in game_memberships]
+            games = getByIDs(Game, [mem.game_id for mem in game_memberships])
         except CassaNotFoundException:
             raise GameNotFound()
         return GameSerializer(games, many=True).data
@@ -32,72 +37,51 @@ class GamesListGetForm(forms.Form):
 '''
     Creates a new game instance.
 '''
-class GamesPostForm(forms.Form):
-    game_members = forms.CharField(required=True)
-    winning_score = forms.IntegerField(required=True)
-
-    def clean(self):
-        '''
-            Overriding the clean method to add the default offset and limiting information.
-        '''
-        now = datetime.datetime.now()
-        self.cleaned_data['date_created'] = now
-        self.cleaned_data['last_modified'] = now
-        
-        if self.cleaned_data['winning_score'] <= 0:
-            raise InvalidWinningScore()
-        
-        try:
-            self.cleaned_data['game_members'] = json.loads(self.cleaned_data['game_members'])
-            if not isinstance(self.cleaned_data['game_members'], list):
-                raise BadRequestException()
-        except ValueError:
-            raise BadRequestException()
-        
-        return self.cleaned_data
-    
+class GamesPostForm(SchemaForm):
+    # invitees that aren't UUIDs are left out rather than failing the game
+    schema = Schema(game_members=JSONListField(item=UUIDField(), drop_invalid=True),
+                    winning_score=IntField(min_value=1, error=InvalidWinningScore))
     
     def submit(self, request):
         '''
             Submits this form to create the given game.
         '''
-        game_members = self.cleaned_data['game_members']
+        user_ids = self.cleaned_data['game_members']
         del self.cleaned_data['game_members']
         self.cleaned_data['leader_id'] = UUID(request.user.pk)
-        game = Game.fromMap(self.cleaned_data)
-        game.save()
+        
+        # every invitee is looked up at once instead of one call after another
+        existing = existingUsers(request.auth, user_ids)
         
         members_added = {}
+        now = datetime.datetime.now()
+        self.cleaned_data['date_created'] = now
+        self.cleaned_data['last_modified'] = now
         
-        for mem in game_members:
-            try:
-                mem = str(UUID(mem))
-                UserClient(request.auth).get(mem)
-                # user exists so let's add him/her
-                now = datetime.datetime.now()
+        # the game and all of its members are written in one batch
+        with UnitOfWork():
+            game = Game.fromMap(self.cleaned_data)
+            game.save()
+            
+            for mem in user_ids:
+                if mem not in existing:
+                    continue
+                # a user listed twice is only added once
+                existing.discard(mem)
                 member = GameMember(game_member_id=str(uuid.uuid1()), game_id=UUID(game.game_id), user_id=UUID(mem), status=1, date_created=now, last_modified=now)
-                member.save()
+                memberships.save(member)
                 members_added[member.game_member_id] = now
-            except ValueError, UserClientError:
-                continue
-       
-        member = GameMember(game_member_id=str(uuid.uuid1()), score=0, game_id=UUID(game.game_id), user_id=UUID(request.user.pk), status=2, date_created=now, last_modified=now)
-        member.save()
-        members_added[member.game_member_id] = now 
+            
+            member = GameMember(game_member_id=str(uuid.uuid1()), score=0, game_id=UUID(game.game_id), user_id=UUID(request.user.pk), status=2, date_created=now, last_modified=now)
+            memberships.save(member)
+            members_added[member.game_member_id] = now 
 
         serialized = GameSerializer(game).data
         serialized['game_members'] = members_added
         return serialized
 
-class GamesSingleGetForm(forms.Form):
-    game_id = forms.CharField()
-    
-    def clean(self):
-        try:
-            self.cleaned_data['game_id'] = str(UUID(self.cleaned_data['game_id']))
-        except ValueError:
-            raise GameNotFound()
-        return self.cleaned_data
+class GamesSingleGetForm(SchemaForm):
+    schema = Schema(game_id=UUIDField(error=GameNotFound))
 
     def submit(self, request):
         try:
@@ -108,12 +92,34 @@ class GamesSingleGetForm(forms.Form):
             raise GameNotFound()
         return GameSerializer(game).data
 
-class GameRequestsForm(forms.Form):
+class GameRequestsForm(SchemaForm):
     def submit(self, request):
-        requests = [gm for gm in GameMember.filterByUser(request.user.pk) if gm.status == 1]
+        requests = memberships.filterByStatus(request.user.pk, memberships.INVITED)
         return GameMemberSerializer(requests, many=True).data
-        
-        
-        
-        
 
+'''
+    Gets the balance of the user's wallet.
+'''
+class WalletGetForm(SchemaForm):
+    def submit(self, request):
+        return { 'user_id' : request.user.pk, 'balance' : Ledger().balance(request.user.pk) }
+
+'''
+    Gets a page of the credits and debits of the user's wallet, newest first.
+'''
+class WalletHistoryForm(SchemaForm):
+    schema = Schema(limit=IntField(required=False, min_value=0), cursor=TextField(required=False))
+    
+    def is_valid(self):
+        super(WalletHistoryForm, self).is_valid()
+        self.cleaned_data['limit'] = getLimit(self.cleaned_data)
+        try:
+            self.cleaned_data['cursor'] = getCursor(self.cleaned_data)
+        except ValueError:
+            raise InvalidParameters({ 'cursor' : 'Not a cursor from this listing.' })
+        return True
+    
+    def submit(self, request):
+        history, self.next_cursor = Ledger().history(request.user.pk, self.cleaned_data['limit'],
+                                                     self.cleaned_data['cursor'])
+        return history
@@ -0,0 +1,39 @@
+'''
+    Folds the new ledger entries of every wallet into its balance snapshot.
+
+    Usage: manage.py compact_wallets [--check] [user_id ...]
+
+    @author: Andrew Oberlin, Jake Gregg
+'''
+from django.core.management.base import BaseCommand
+from optparse import make_option
+from rememerme.marketplace.ledger import Ledger
+
+class Command(BaseCommand):
+    args = '[user_id ...]'
+    help = 'Compacts the wallet ledgers into balance snapshots and optionally checks them.'
+    option_list = BaseCommand.option_list + (
+        make_option('--check', action='store_true', dest='check', default=False,
+            help='Replay each whole ledger and report snapshots that do not match it.'),
+    )
+    
+    def handle(self, *args, **options):
+        ledger = Ledger()
+        user_ids = args or ledger.users()
+        
+        compacted = 0
+        inconsistent = 0
+        for user_id in user_ids:
+            balance, seq = ledger.compact(user_id)
+            compacted += 1
+            
+            if options['check']:
+                report = ledger.check(user_id)
+                if not report['consistent']:
+                    inconsistent += 1
+                    self.stderr.write('%(user_id)s: snapshot says %(snapshot_balance)d at seq %(snapshot_seq)d '
+                                      'but the ledger sums to %(ledger_balance_at_snapshot)d' % report)
+        
+        self.stdout.write('Compacted %d wallets' % compacted)
+        if options['check']:
+            self.stdout.write('%d inconsistent snapshots' % inconsistent)
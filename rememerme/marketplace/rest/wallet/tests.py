@@ -1,3 +1,508 @@
-from django.test import TestCase
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from django.conf import settings
+from django.test import SimpleTestCase
+from pycassa.cassandra.ttypes import NotFoundException as CassaNotFoundException, TimedOutException
+from rememerme.marketplace import memberships, pool, ratelimit, users
+from rememerme.marketplace.bench import benchmark, measure
+from rememerme.marketplace.loaders import getByIDs
+from rememerme.marketplace.testing import memory_model, MemoryColumnFamily, MemoryManager
+from rememerme.marketplace.ledger import Ledger
+from rememerme.marketplace.unitofwork import UnitOfWork, afterWrite
+from rememerme.users.client import UserClientError
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import urllib2
+import uuid
 
-# Create your tests here.
+class GamesListBenchmark(SimpleTestCase):
+    '''
+        Compares loading a user's games one get at a time against the
+        single multiget used by GamesListGetForm.
+    '''
+    
+    def setUp(self):
+        self.Game = memory_model('game', 'game_id', latency=0.0002)
+    
+    def makeGames(self, count):
+        game_ids = []
+        for _ in range(count):
+            game = self.Game(game_id=str(uuid.uuid1()), winning_score=10)
+            game.save()
+            game_ids.append(game.game_id)
+        return game_ids
+    
+    def compare(self, count):
+        '''
+            Loads the games of a user with the given number of memberships both ways.
+
+            @return: The round trips and timing of each, by way
+        '''
+        game_ids = self.makeGames(count)
+        report = {}
+        for way, load in (('serial', lambda: [self.Game.getByID(game_id) for game_id in game_ids]),
+                          ('bulk', lambda: getByIDs(self.Game, game_ids))):
+            self.Game.table.calls = 0
+            report[way] = measure(load, 10)
+            report[way]['round_trips'] = self.Game.table.calls / 10
+        self.assertEqual([g.game_id for g in getByIDs(self.Game, game_ids)], game_ids)
+        return report
+    
+    def test_round_trips(self):
+        for count in (10, 50, 200):
+            report = self.compare(count)
+            self.assertEqual(report['serial']['round_trips'], count)
+            self.assertEqual(report['bulk']['round_trips'], 1 + (count - 1) // 100)
+    
+    @benchmark
+    def test_p99_by_membership_count(self):
+        for count in (10, 50, 200):
+            report = self.compare(count)
+            self.assertLess(report['bulk']['p99_ms'], report['serial']['p99_ms'])
+    
+    def test_chunking(self):
+        game_ids = self.makeGames(25)
+        self.Game.table.calls = 0
+        games = getByIDs(self.Game, game_ids + [str(uuid.uuid1())], chunk_size=10, skip_missing=True)
+        self.assertEqual(self.Game.table.calls, 3)
+        self.assertEqual(len(games), 25)
+    
+    def test_missing_rows_raise(self):
+        # a listing naming a game that doesn't exist is a GameNotFound, as with getByID
+        game_ids = self.makeGames(3)
+        self.assertRaises(CassaNotFoundException, getByIDs, self.Game, game_ids + [str(uuid.uuid1())])
+
+class LedgerTest(SimpleTestCase):
+    
+    def setUp(self):
+        self.ledger = Ledger(MemoryColumnFamily('wallet_ledger'), MemoryColumnFamily('wallet_snapshot'))
+        self.user_id = str(uuid.uuid1())
+    
+    def test_balance_and_compaction(self):
+        self.ledger.credit(self.user_id, 100, 'gift')
+        self.ledger.debit(self.user_id, 30, 'deck')
+        self.assertEqual(self.ledger.balance(self.user_id), 70)
+        
+        self.assertEqual(self.ledger.compact(self.user_id), (70, 2))
+        self.ledger.credit(self.user_id, 5, 'refund')
+        self.assertEqual(self.ledger.snapshot(self.user_id), (70, 2))
+        self.assertEqual(self.ledger.balance(self.user_id), 75)
+        self.assertTrue(self.ledger.check(self.user_id)['consistent'])
+        
+        history, cursor = self.ledger.history(self.user_id, 2)
+        self.assertEqual([e['seq'] for e in history], [3, 2])
+        history, cursor = self.ledger.history(self.user_id, 2, cursor)
+        self.assertEqual([e['seq'] for e in history], [1])
+        self.assertEqual(cursor, None)
+    
+    def test_check_finds_drift(self):
+        self.ledger.credit(self.user_id, 10, 'gift')
+        self.ledger.compact(self.user_id)
+        self.ledger.snapshots.insert(self.user_id, { 'balance' : '11' })
+        report = self.ledger.check(self.user_id)
+        self.assertFalse(report['consistent'])
+        self.assertEqual(report['ledger_balance'], 10)
+    
+    def test_lost_append_is_not_repeated(self):
+        entries = self.ledger.entries
+        cas = entries.cas
+        lost = []
+        
+        def applyThenTimeOut(key, expected, updates):
+            result = cas(key, expected, updates)
+            if not lost:
+                lost.append(updates)
+                raise TimedOutException()
+            return result
+        
+        entries.cas = applyThenTimeOut
+        self.ledger.credit(self.user_id, 100, 'gift')
+        self.assertEqual(self.ledger.debit(self.user_id, 30, 'purchase-1'), 2)
+        self.assertEqual(self.ledger.balance(self.user_id), 70)
+        self.assertEqual(self.ledger.head(self.user_id), 2)
+
+@benchmark
+class LedgerBenchmark(SimpleTestCase):
+    '''
+        Compares reading the balance of a wallet with 10k entries from the
+        snapshot against replaying the whole ledger.
+    '''
+    
+    def test_balance_reads(self):
+        ledger = Ledger(MemoryColumnFamily('wallet_ledger'), MemoryColumnFamily('wallet_snapshot'))
+        user_id = str(uuid.uuid1())
+        for i in range(10000):
+            ledger.credit(user_id, 1 + i % 7, 'entry-%d' % i)
+        total = sum(1 + i % 7 for i in range(10000))
+        ledger.compact(user_id)
+        for i in range(20):
+            ledger.debit(user_id, 1, 'tail-%d' % i)
+        
+        ledger.entries.latency = ledger.snapshots.latency = 0.0002
+        replay = measure(lambda: sum(e['amount'] for _, e in ledger.tail(user_id)), 10)
+        snapshot = measure(lambda: ledger.balance(user_id), 10)
+        self.assertEqual(ledger.balance(user_id), total - 20)
+        self.assertLess(snapshot['p99_ms'], replay['p99_ms'])
+
+class StubUserHandler(BaseHTTPRequestHandler):
+    '''
+        A users service that knows every user whose id doesn't start with 0.
+    '''
+    latency = 0.02
+    
+    def do_GET(self):
+        time.sleep(self.latency)
+        self.send_response(404 if self.path.split('/')[-1].startswith('0') else 200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write('{}')
+    
+    def log_message(self, *args):
+        pass
+
+class StubUserService(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 64
+
+class UserLookupBenchmark(SimpleTestCase):
+    '''
+        Compares checking invitees one after another with the concurrent,
+        cached lookup used by GamesPostForm, against a local users service.
+    '''
+    
+    def setUp(self):
+        self.server = StubUserService(('127.0.0.1', 0), StubUserHandler)
+        threading.Thread(target=self.server.serve_forever).start()
+        self.url = 'http://127.0.0.1:%d/rest/v1/users/' % self.server.server_address[1]
+        users.found.clear()
+        users.missing.clear()
+    
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+    
+    def lookup(self, user_id):
+        try:
+            urllib2.urlopen(self.url + user_id).read()
+        except urllib2.HTTPError:
+            raise UserClientError()
+    
+    def test_lookups_by_member_count(self):
+        for count in (1, 5, 10, 25):
+            user_ids = [str(uuid.uuid4()) for _ in range(count)]
+            expected = set(user_id for user_id in user_ids if not user_id.startswith('0'))
+            
+            self.assertEqual(set(user_id for user_id in user_ids if users.userExists(self.lookup, user_id)), expected)
+            self.assertEqual(users.existingUsers(None, user_ids, self.lookup), expected)
+            # and again from the cache
+            self.assertEqual(users.existingUsers(None, user_ids, self.lookup), expected)
+    
+    @benchmark
+    def test_latency_by_member_count(self):
+        for count in (5, 10, 25):
+            user_ids = [str(uuid.uuid4()) for _ in range(count)]
+            
+            start = time.time()
+            for user_id in user_ids:
+                users.userExists(self.lookup, user_id)
+            serial_ms = (time.time() - start) * 1000
+            
+            start = time.time()
+            users.existingUsers(None, user_ids, self.lookup)
+            concurrent_ms = (time.time() - start) * 1000
+            
+            self.assertTrue(concurrent_ms < serial_ms)
+
+class UnitOfWorkTest(SimpleTestCase):
+    
+    def setUp(self):
+        self.Game = memory_model('game', 'game_id')
+        self.GameMember = memory_model('game_member', 'game_member_id')
+    
+    def test_rows_written_when_block_ends(self):
+        with UnitOfWork(max_rows=3) as unit:
+            self.Game(game_id='g', winning_score=10).save()
+            for i in range(7):
+                self.GameMember(game_member_id=str(i), game_id='g').save()
+            self.assertEqual(self.GameMember.table.rows, {})
+        
+        self.assertEqual(len(self.GameMember.table.rows), 7)
+        self.assertEqual(self.Game.getByID('g').winning_score, 10)
+        # one batch for the game and three for the members
+        self.assertEqual(unit.batches, 4)
+        self.assertEqual(self.GameMember.table.calls, 3)
+    
+    def test_split_by_bytes(self):
+        with UnitOfWork(max_rows=100, max_bytes=250) as unit:
+            for i in range(4):
+                self.GameMember(game_member_id=str(i), padding='x' * 100).save()
+        self.assertEqual(unit.batches, 2)
+    
+    def test_nothing_written_on_error(self):
+        try:
+            with UnitOfWork():
+                self.Game(game_id='g').save()
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual(self.Game.table.rows, {})
+    
+    def test_nested_units_and_callbacks(self):
+        written = []
+        with UnitOfWork() as outer:
+            with UnitOfWork():
+                self.Game(game_id='g').save()
+                afterWrite(lambda: written.append(len(self.Game.table.rows)))
+            self.assertEqual(self.Game.table.rows, {})
+        self.assertEqual(written, [1])
+        self.assertEqual(outer.batches, 1)
+    
+    def test_removes_and_adds_keep_their_order(self):
+        counters = MemoryColumnFamily('deck_counters')
+        self.Game(game_id='g', winning_score=10).save()
+        with UnitOfWork() as unit:
+            self.GameMember(game_member_id='m', game_id='g').save()
+            self.GameMember.table.remove('m')
+            self.GameMember(game_member_id='m', game_id='h').save()
+            self.Game.table.remove('g', columns=['winning_score'])
+            counters.add('g', 'plays', 1)
+            self.assertEqual(self.Game.getByID('g').winning_score, 10)
+            self.assertEqual(counters.rows, {})
+            self.assertRaises(RuntimeError, counters.cas, 'g', { 'plays' : None }, { 'plays' : 1 })
+        
+        self.assertEqual(self.GameMember.getByID('m').game_id, 'h')
+        self.assertFalse('winning_score' in self.Game.table.rows.get('g', {}))
+        self.assertEqual(counters.rows, { 'g' : { 'plays' : 1 } })
+        self.assertEqual(unit.batches, 2)
+
+class GameCreationBenchmark(SimpleTestCase):
+    '''
+        Compares writing a game and its members one save at a time with
+        writing them in a UnitOfWork as GamesPostForm does.
+    '''
+    
+    def setUp(self):
+        self.Game = memory_model('game', 'game_id', latency=0.0005)
+        self.GameMember = memory_model('game_member', 'game_member_id', latency=0.0005)
+    
+    def create(self, members):
+        game = self.Game(game_id=str(uuid.uuid1()), winning_score=10)
+        game.save()
+        for _ in range(members + 1):
+            self.GameMember(game_member_id=str(uuid.uuid1()), game_id=game.game_id, status=1).save()
+    
+    def compare(self, members):
+        '''
+            Creates games with the given number of members both ways.
+
+            @return: The writes and timing of each, by way
+        '''
+        def batched():
+            with UnitOfWork():
+                self.create(members)
+        
+        report = {}
+        for way, create in (('per_row', lambda: self.create(members)), ('unit', batched)):
+            self.Game.table.calls = self.GameMember.table.calls = 0
+            report[way] = measure(create, 10)
+            report[way]['writes'] = (self.Game.table.calls + self.GameMember.table.calls) / 10
+        return report
+    
+    def test_writes_per_game(self):
+        for members in (1, 10, 50):
+            report = self.compare(members)
+            self.assertEqual(report['per_row']['writes'], members + 2)
+            self.assertEqual(report['unit']['writes'], 2)
+    
+    @benchmark
+    def test_write_latency(self):
+        for members in (1, 10, 50):
+            report = self.compare(members)
+            self.assertLess(report['unit']['p50_ms'], report['per_row']['p50_ms'])
+
+class MembershipIndexBenchmark(SimpleTestCase):
+    '''
+        Compares filtering all of a heavy user's memberships for pending
+        requests with reading them from the index by status.
+    '''
+    
+    def setUp(self):
+        pool.setManager(MemoryManager())
+        self.GameMember = memory_model('game_member', 'game_member_id', filters={ 'filterByUser' : 'user_id' })
+        self.real, memberships.GameMember = memberships.GameMember, self.GameMember
+    
+    def tearDown(self):
+        memberships.GameMember = self.real
+        pool.setManager(None)
+    
+    def join(self, user_id, status):
+        member = self.GameMember(game_member_id=str(uuid.uuid1()), game_id=str(uuid.uuid1()),
+                                 user_id=user_id, status=status)
+        memberships.save(member)
+        return member
+    
+    def test_status_changes_move_the_member(self):
+        user_id = str(uuid.uuid1())
+        memberships.backfill(user_id)
+        member = self.join(user_id, memberships.INVITED)
+        self.assertEqual([m.game_member_id for m in memberships.filterByStatus(user_id, memberships.INVITED)],
+                         [member.game_member_id])
+        
+        member.status = memberships.ACCEPTED
+        memberships.save(member, memberships.INVITED)
+        self.assertEqual(memberships.filterByStatus(user_id, memberships.INVITED), [])
+        self.assertEqual(len(memberships.filterByStatus(user_id, memberships.ACCEPTED)), 1)
+    
+    def test_changes_of_the_games_service_are_found(self):
+        user_id = str(uuid.uuid1())
+        memberships.backfill(user_id)
+        member = self.join(user_id, memberships.INVITED)
+        # e.g. made by the games service
+        member.status = memberships.ACCEPTED
+        member.save()
+        invite = self.GameMember(game_member_id=str(uuid.uuid1()), game_id='g', user_id=user_id,
+                                 status=memberships.INVITED)
+        invite.save()
+        
+        self.assertEqual(memberships.filterByStatus(user_id, memberships.INVITED), [])
+        self.assertEqual([m.game_member_id for m in memberships.filterByStatus(user_id, memberships.ACCEPTED)],
+                         [member.game_member_id])
+        
+        memberships.index().insert(user_id, { memberships.INDEXED : repr(time.time() - settings.MEMBERSHIPS['INDEX_TTL'] - 1) })
+        self.assertEqual([m.game_member_id for m in memberships.filterByStatus(user_id, memberships.INVITED)],
+                         [invite.game_member_id])
+        self.assertTrue(memberships.isIndexed(user_id))
+    
+    def test_unindexed_users_are_backfilled(self):
+        user_id = str(uuid.uuid1())
+        for status in (1, 2, 2):
+            self.GameMember(game_member_id=str(uuid.uuid1()), game_id='g', user_id=user_id, status=status).save()
+        self.assertEqual(len(memberships.filterByStatus(user_id, memberships.INVITED)), 1)
+        self.assertTrue(memberships.isIndexed(user_id))
+    
+    def makeHistory(self, history):
+        user_id = str(uuid.uuid1())
+        memberships.backfill(user_id)
+        for i in range(history):
+            self.join(user_id, memberships.INVITED if i % 500 == 0 else memberships.ACCEPTED)
+        return user_id
+    
+    def scan(self, user_id):
+        return [m for m in self.GameMember.filterByUser(user_id) if m.status == memberships.INVITED]
+    
+    def test_pending_requests(self):
+        for history in (100, 1000, 5000):
+            user_id = self.makeHistory(history)
+            self.assertEqual(sorted(m.game_member_id for m in memberships.filterByStatus(user_id, memberships.INVITED)),
+                             sorted(m.game_member_id for m in self.scan(user_id)))
+    
+    @benchmark
+    def test_index_beats_scan(self):
+        for history in (100, 1000, 5000):
+            user_id = self.makeHistory(history)
+            scan = measure(lambda: self.scan(user_id), 5)
+            indexed = measure(lambda: memberships.filterByStatus(user_id, memberships.INVITED), 5)
+            self.assertLess(indexed['p50_ms'], scan['p50_ms'])
+
+class LimitedRequest(object):
+    '''
+        Just enough of a request for the rate limiter.
+    '''
+    
+    def __init__(self, address, method='POST', session=None):
+        self.method = method
+        self.META = { 'REMOTE_ADDR' : address }
+        if session:
+            self.META['HTTP_AUTHORIZATION'] = session
+
+def takeShared(path, slots, count, results):
+    store = ratelimit.SharedStore(path, slots)
+    results.put(sum(1 for _ in range(count) if store.take('wallet:user:shared', 150, 0.001)[0]))
+    store.close()
+
+class RateLimitTest(SimpleTestCase):
+    '''
+        Each bucket should let through its burst, refill at its rate and be
+        shared by every process mapping the same file.
+    '''
+    
+    def setUp(self):
+        self.path = tempfile.mktemp(prefix='ratelimit-')
+    
+    def tearDown(self):
+        ratelimit.setStore(None)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+    
+    def test_bucket_refills(self):
+        for store in (ratelimit.MemoryStore(100), ratelimit.SharedStore(self.path, 64)):
+            capacity, per_second = ratelimit.parseRate('3/s')
+            taken = [store.take('key', capacity, per_second, now=100.0)[0] for _ in range(4)]
+            self.assertEqual(taken, [True, True, True, False])
+            allowed, wait = store.take('key', capacity, per_second, now=100.0)
+            self.assertAlmostEqual(wait, 1.0 / 3)
+            self.assertTrue(store.take('key', capacity, per_second, now=100.0 + wait + 0.001)[0])
+            self.assertTrue(store.take('other', capacity, per_second, now=100.0)[0])
+    
+    def test_full_group_evicts_stalest(self):
+        store = ratelimit.SharedStore(self.path, ratelimit.GROUP_SIZE)
+        for i in range(ratelimit.GROUP_SIZE * 4):
+            store.take('key-%d' % i, 1, 0.001, now=float(i))
+        # the newest buckets are still empty
+        self.assertFalse(store.take('key-%d' % (ratelimit.GROUP_SIZE * 4 - 1), 1, 0.001, now=200.0)[0])
+        self.assertTrue(store.take('key-0', 1, 0.001, now=200.0)[0])
+    
+    def test_shared_between_processes(self):
+        results = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=takeShared, args=(self.path, 1024, 100, results)) for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(sum(results.get() for _ in workers), 150)
+    
+    def test_middleware(self):
+        ratelimit.setStore(ratelimit.MemoryStore(100))
+        middleware = ratelimit.RateLimitMiddleware()
+        rule = ratelimit.Limit('wallet', user='2/m', ip='3/m', methods=['post'])
+        
+        def call(request):
+            kwargs = { 'rate_limit' : rule }
+            response = middleware.process_view(request, None, (), kwargs)
+            self.assertEqual(kwargs, {})
+            return response
+        
+        self.assertIsNone(call(LimitedRequest('10.0.0.1', 'GET', 'a')))
+        self.assertIsNone(call(LimitedRequest('10.0.0.1', session='a')))
+        self.assertIsNone(call(LimitedRequest('10.0.0.1', session='a')))
+        response = call(LimitedRequest('10.0.0.1', session='a'))
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '30')
+        # the refused request left the address a token for another user
+        self.assertIsNone(call(LimitedRequest('10.0.0.1', session='b')))
+        response = call(LimitedRequest('10.0.0.1', session='c'))
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '20')
+
+@benchmark
+class RateLimitBenchmark(SimpleTestCase):
+    '''
+        Checking the buckets of a request should add a few microseconds.
+    '''
+    
+    def setUp(self):
+        self.path = tempfile.mktemp(prefix='ratelimit-')
+    
+    def tearDown(self):
+        ratelimit.setStore(None)
+        os.remove(self.path)
+    
+    def test_check_overhead(self):
+        rule = ratelimit.Limit('wallet', user='1000000/s', ip='1000000/s')
+        requests = [LimitedRequest('10.0.%d.%d' % (i // 256, i % 256), session='session-%d' % i) for i in range(5000)]
+        for name, store in (('memory', ratelimit.MemoryStore(65536)), ('shared', ratelimit.SharedStore(self.path, 65536))):
+            timing = measure(lambda: ratelimit.check(requests[int(time.time() * 1000000) % len(requests)], rule, store), 20000)
+            self.assertLess(timing['p50_ms'], 0.05, name)
@@ -1,8 +1,10 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rememerme.games.rest.games.forms import GameRequestsForm, GamesPostForm, GamesListGetForm, GamesSingleGetForm
+from rememerme.marketplace.rest.wallet.forms import GameRequestsForm, GamesPostForm, GamesListGetForm, GamesSingleGetForm, \
+    WalletGetForm, WalletHistoryForm
 from rememerme.games.rest.exceptions import BadRequestException
 from rest_framework.permissions import IsAuthenticated
+from config.util import pagedResponse
 
 class GamesListView(APIView):
     permission_classes = (IsAuthenticated,)
@@ -40,7 +42,7 @@ class GamesSingleView(APIView):
         '''
             Used to create a new friend request.
         '''
-        form = GamesSingleGetForm({ 'game_id' : game_id })
+        form = GamesSingleGetForm(request.QUERY_PARAMS, game_id=game_id)
 
         if form.is_valid():
             return Response(form.submit(request))
@@ -62,4 +64,31 @@ class GameRequestView(APIView):
             return Response(form.submit(request))
         else:
             raise BadRequestException()
-        
+
+class WalletView(APIView):
+    permission_classes = (IsAuthenticated, )
+    
+    def get(self, request):
+        '''
+            Gets the balance of the user's wallet.
+        '''
+        form = WalletGetForm(request.QUERY_PARAMS)
+
+        if form.is_valid():
+            return Response(form.submit(request))
+        else:
+            raise BadRequestException()
+
+class WalletHistoryView(APIView):
+    permission_classes = (IsAuthenticated, )
+    
+    def get(self, request):
+        '''
+            Gets the credits and debits of the user's wallet, newest first.
+        '''
+        form = WalletHistoryForm(request.QUERY_PARAMS)
+
+        if form.is_valid():
+            return pagedResponse(form.submit(request), form.next_cursor)
+        else:
+            raise BadRequestException()
@@ -0,0 +1,246 @@
+'''
+    Declarative request validation.
+
+    A Schema is declared once per form at import and compiled into a single
+    validator that checks each parameter with a function made for that
+    field, e.g. a UUID field is one call to UUID. Invalid parameters are
+    reported together, by name, in the detail of an InvalidParameters
+    error. A field given an error class raises that instead, so a bad game
+    id is still a GameNotFound.
+
+    @author: Andrew Oberlin, Jake Gregg
+'''
+from rememerme.marketplace.rest.exceptions import InvalidParameters
+from uuid import UUID
+import datetime
+import json
+
+REQUIRED = 'This field is required.'
+
+class Invalid(Exception):
+    '''
+        A parameter failed its check.
+    '''
+
+class Field(object):
+    '''
+        A parameter of a request.
+
+        @param required: Whether a missing or blank value is an error
+        @param default: The value of a missing optional parameter
+        @param error: An exception class raised for a bad value instead of
+            reporting it with the other invalid parameters
+    '''
+
+    def __init__(self, required=True, default=None, error=None):
+        self.required = required
+        self.default = default
+        self.error = error
+
+    def compile(self):
+        '''
+            Makes the function that checks and converts a value.
+        '''
+        raise NotImplementedError()
+
+class UUIDField(Field):
+    '''
+        A UUID, cleaned to its string form.
+    '''
+
+    def compile(self):
+        def check(value):
+            try:
+                return str(UUID(value))
+            except (TypeError, ValueError, AttributeError):
+                raise Invalid('Not a valid UUID.')
+        return check
+
+class IntField(Field):
+    '''
+        A whole number, optionally within min_value and max_value.
+    '''
+
+    def __init__(self, min_value=None, max_value=None, **kwargs):
+        super(IntField, self).__init__(**kwargs)
+        self.min_value = min_value
+        self.max_value = max_value
+
+    def compile(self):
+        min_value, max_value = self.min_value, self.max_value
+
+        def check(value):
+            if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+                raise Invalid('Not a whole number.')
+            try:
+                value = int(value.strip() if isinstance(value, basestring) else value)
+            except (TypeError, ValueError):
+                raise Invalid('Not a whole number.')
+            if min_value is not None and value < min_value:
+                raise Invalid('Must be at least %d.' % min_value)
+            if max_value is not None and value > max_value:
+                raise Invalid('Must be at most %d.' % max_value)
+            return value
+        return check
+
+class TextField(Field):
+    '''
+        A string of at most max_length characters.
+    '''
+
+    def __init__(self, max_length=None, **kwargs):
+        super(TextField, self).__init__(**kwargs)
+        self.max_length = max_length
+
+    def compile(self):
+        max_length = self.max_length
+
+        def check(value):
+            if not isinstance(value, basestring):
+                value = unicode(value)
+            if max_length is not None and len(value) > max_length:
+                raise Invalid('Must be at most %d characters.' % max_length)
+            return value
+        return check
+
+class ChoiceField(Field):
+    '''
+        One of a fixed set of strings.
+    '''
+
+    def __init__(self, choices, **kwargs):
+        super(ChoiceField, self).__init__(**kwargs)
+        self.choices = choices
+
+    def compile(self):
+        choices = frozenset(self.choices)
+        message = 'Must be one of %s.' % ', '.join(sorted(choices))
+
+        def check(value):
+            if value not in choices:
+                raise Invalid(message)
+            return value
+        return check
+
+class DateTimeField(Field):
+    '''
+        A date, or a date and time, in ISO 8601 form.
+    '''
+    formats = ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M', '%Y-%m-%d')
+
+    def compile(self):
+        formats = self.formats
+
+        def check(value):
+            if isinstance(value, datetime.datetime):
+                return value
+            for format in formats:
+                try:
+                    return datetime.datetime.strptime(str(value).strip(), format)
+                except ValueError:
+                    pass
+            raise Invalid('Not a date, e.g. 2014-01-31 or 2014-01-31T12:00:00.')
+        return check
+
+class JSONListField(Field):
+    '''
+        A list, sent either as a JSON string or already parsed from a JSON
+        body.
+
+        @param item: The Field each item is checked with, if any
+        @param drop_invalid: Whether bad items are left out instead of
+            making the whole list invalid
+        @param max_items: The most items the list may have
+    '''
+
+    def __init__(self, item=None, drop_invalid=False, max_items=None, **kwargs):
+        super(JSONListField, self).__init__(**kwargs)
+        self.item = item
+        self.drop_invalid = drop_invalid
+        self.max_items = max_items
+
+    def compile(self):
+        check_item = self.item.compile() if self.item is not None else None
+        drop_invalid, max_items = self.drop_invalid, self.max_items
+
+        def check(value):
+            if isinstance(value, basestring):
+                try:
+                    value = json.loads(value)
+                except ValueError:
+                    raise Invalid('Not valid JSON.')
+            if not isinstance(value, list):
+                raise Invalid('Not a list.')
+            if max_items is not None and len(value) > max_items:
+                raise Invalid('Must have at most %d items.' % max_items)
+            if check_item is None:
+                return value
+
+            items = []
+            for index, item in enumerate(value):
+                try:
+                    items.append(check_item(item))
+                except Invalid as e:
+                    if not drop_invalid:
+                        raise Invalid('Item %d: %s' % (index, e.args[0]))
+            return items
+        return check
+
+class Schema(object):
+    '''
+        The parameters of a request. Compiled into validate when declared.
+    '''
+
+    def __init__(self, **fields):
+        self.fields = fields
+        self.validate = self.compile()
+
+    def compile(self):
+        checks = tuple((name, field.compile(), field.required, field.default, field.error)
+                       for name, field in sorted(self.fields.items()))
+
+        def validate(data, overrides=None):
+            '''
+                Checks the parameters of a request.
+
+                @param data: The QUERY_PARAMS or DATA of the request
+                @param overrides: Parameters taken from the URL
+                @return: The cleaned parameters
+                @raise InvalidParameters: Listing every invalid parameter
+            '''
+            overrides = overrides or {}
+            cleaned = {}
+            errors = {}
+            for name, check, required, default, error in checks:
+                value = overrides[name] if name in overrides else data.get(name)
+                if value is None or value == '':
+                    if required:
+                        errors[name] = REQUIRED
+                    cleaned[name] = default
+                    continue
+                try:
+                    cleaned[name] = check(value)
+                except Invalid as e:
+                    if error is not None:
+                        raise error()
+                    errors[name] = e.args[0]
+            if errors:
+                raise InvalidParameters(errors)
+            return cleaned
+        return validate
+
+class SchemaForm(object):
+    '''
+        A form validated by its schema instead of a Django form. Invalid
+        parameters raise from is_valid with the details of what was wrong.
+    '''
+    schema = Schema()
+
+    def __init__(self, data, **overrides):
+        self.data = data
+        self.overrides = overrides
+        self.cleaned_data = None
+
+    def is_valid(self):
+        self.cleaned_data = self.schema.validate(self.data, self.overrides)
+        return True
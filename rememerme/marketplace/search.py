@@ -0,0 +1,366 @@
+'''
+    In-process search of the deck catalog.
+
+    Every process keeps an inverted index of the decks for sale, from the
+    words of their title, description and tags and the terms of their
+    cards to the decks they appear in. It is built from Cassandra when the
+    worker starts and kept current by the deck and card writes the process
+    makes, and rebuilt every REFRESH_SECONDS to pick up the writes of other
+    processes.
+
+    Each word of a query matches every indexed word it is a prefix of, so
+    results show up while the user is still typing. A deck has to match
+    every word of the query and is scored by where the words appear in it
+    (FIELD_WEIGHTS) and how rare they are across the catalog. Results come
+    with the number of matching decks of each type and price range.
+
+    @author: Andrew Oberlin, Jake Gregg
+'''
+from django.conf import settings
+from rememerme.cards.models import PhraseCard, NominationCard
+from rememerme.marketplace.serializers import DeckSerializer
+import bisect
+import heapq
+import math
+import re
+import threading
+import time
+
+CARD_MODELS = { 'phrase' : PhraseCard, 'nomination' : NominationCard }
+
+# the attribute holding the id of each type of card
+CARD_KEYS = { 'phrase' : 'phrase_card_id', 'nomination' : 'nomination_card_id' }
+
+WORD = re.compile(r'\w+', re.UNICODE)
+
+'''
+    Splits text into the lower case words it is indexed and searched by.
+'''
+def tokenize(text):
+    if not text:
+        return []
+    if not isinstance(text, unicode):
+        text = str(text).decode('utf-8', 'replace')
+    return WORD.findall(text.lower())
+
+'''
+    Gets the label of the price range a price falls in, e.g. 5-9 or 25+.
+'''
+def priceBucket(price):
+    bounds = settings.DECK_SEARCH['PRICE_BUCKETS']
+    index = bisect.bisect_right(bounds, price or 0) - 1
+    if index < 0:
+        return str(bounds[0])
+    if index == len(bounds) - 1:
+        return '%d+' % bounds[index]
+    if bounds[index + 1] - bounds[index] == 1:
+        return str(bounds[index])
+    return '%d-%d' % (bounds[index], bounds[index + 1] - 1)
+
+class IndexedDeck(object):
+    '''
+        What the index keeps of a deck: its facets, its serialized form and
+        the words of its fields and of each of its cards.
+    '''
+
+    def __init__(self, deck_id):
+        self.deck_id = deck_id
+        self.deck_type = None
+        self.price = 0
+        self.title = ''
+        self.data = None
+        self.fields = {}
+        self.cards = {}
+        self.weights = {}
+
+    def computeWeights(self):
+        '''
+            Works out how much each word counts towards the deck's score.
+        '''
+        field_weights = settings.DECK_SEARCH['FIELD_WEIGHTS']
+        weights = {}
+        for field, words in self.fields.items():
+            for word in words:
+                weights[word] = weights.get(word, 0.0) + field_weights[field]
+
+        card_counts = {}
+        for words in self.cards.values():
+            for word in words:
+                card_counts[word] = card_counts.get(word, 0) + 1
+        # a word on many cards of the deck shouldn't drown out its title
+        for word, count in card_counts.items():
+            weights[word] = weights.get(word, 0.0) + field_weights['cards'] * (1.0 + math.log(count))
+        return weights
+
+class DeckIndex(object):
+    '''
+        The inverted index. Safe to search and update from any thread.
+    '''
+
+    def __init__(self):
+        self.decks = {}
+        self.postings = {}
+        self.words = []
+        self.lock = threading.RLock()
+        self.built = None
+        self.building = False
+        self.pending = []
+        self.searches = 0
+        self.seconds = 0.0
+
+    def _reindex(self, deck):
+        weights = deck.computeWeights()
+        for word in deck.weights:
+            if word not in weights:
+                postings = self.postings[word]
+                del postings[deck.deck_id]
+                if not postings:
+                    del self.postings[word]
+                    del self.words[bisect.bisect_left(self.words, word)]
+        for word, weight in weights.items():
+            postings = self.postings.get(word)
+            if postings is None:
+                postings = self.postings[word] = {}
+                bisect.insort(self.words, word)
+            postings[deck.deck_id] = weight
+        deck.weights = weights
+
+    def _update(self, name, *args):
+        with self.lock:
+            getattr(self, '_' + name)(*args)
+            # writes made while a rebuild reads the catalog are replayed on the new index
+            if self.building:
+                self.pending.append((name, args))
+
+    def _addDeck(self, deck):
+        indexed = self.decks.get(str(deck.deck_id))
+        if indexed is None:
+            indexed = self.decks[str(deck.deck_id)] = IndexedDeck(str(deck.deck_id))
+        indexed.deck_type = deck.deck_type
+        indexed.price = deck.price or 0
+        indexed.title = deck.title or ''
+        indexed.data = DeckSerializer(deck).data
+        indexed.fields = {
+            'title' : tokenize(deck.title),
+            'description' : tokenize(deck.description),
+            'tags' : [word for tag in deck.tags or () for word in tokenize(tag)]
+        }
+        self._reindex(indexed)
+
+    def _addCards(self, deck_id, cards):
+        indexed = self.decks.get(str(deck_id))
+        if indexed is None:
+            indexed = self.decks[str(deck_id)] = IndexedDeck(str(deck_id))
+        for card_id, text in cards.items():
+            indexed.cards[str(card_id)] = tuple(tokenize(text))
+        self._reindex(indexed)
+
+    def _removeCards(self, deck_id, card_ids):
+        indexed = self.decks.get(str(deck_id))
+        if indexed is None:
+            return
+        for card_id in card_ids:
+            indexed.cards.pop(str(card_id), None)
+        self._reindex(indexed)
+
+    def addDeck(self, deck):
+        '''
+            Indexes a new or changed deck.
+        '''
+        self._update('addDeck', deck)
+
+    def addCards(self, deck_id, cards):
+        '''
+            Indexes new or changed cards of a deck.
+
+            @param cards: Map of card id to the text of the card
+        '''
+        self._update('addCards', deck_id, cards)
+
+    def removeCards(self, deck_id, card_ids):
+        '''
+            Drops cards of a deck from the index.
+        '''
+        self._update('removeCards', deck_id, card_ids)
+
+    def expand(self, prefix):
+        '''
+            Gets the indexed words starting with the prefix, shortest first.
+        '''
+        start = bisect.bisect_left(self.words, prefix)
+        end = bisect.bisect_left(self.words, prefix + u'\uffff', start)
+        words = self.words[start:end]
+        limit = settings.DECK_SEARCH['MAX_PREFIX_WORDS']
+        if len(words) > limit:
+            words = heapq.nsmallest(limit, words, key=len)
+        return words
+
+    def search(self, query, deck_type=None, min_price=None, max_price=None, limit=10):
+        '''
+            Finds the decks matching every word of the query.
+
+            @param query: The words searched for, each matching as a prefix
+            @param deck_type: Only decks of this type are returned
+            @param min_price: Only decks costing at least this are returned
+            @param max_price: Only decks costing at most this are returned
+            @param limit: The most decks returned
+            @return: A map of the ranked results, the total number found and
+                the facets of every deck matching the query
+        '''
+        started = time.time()
+        with self.lock:
+            total_decks = float(len(self.decks)) or 1.0
+            expansions = [(word, self.expand(word)) for word in set(tokenize(query))]
+            # the rarest word is matched first so the decks left to check shrink fastest
+            expansions.sort(key=lambda expansion: sum(len(self.postings[word]) for word in expansion[1]))
+
+            scores = None
+            for word, words in expansions:
+                matched = {}
+                for indexed in words:
+                    postings = self.postings[indexed]
+                    # an exact match counts for more than a longer word it starts
+                    boost = 1.0 if indexed == word else 0.5
+                    rarity = boost * math.log(1.0 + total_decks / len(postings))
+                    if scores is None or len(postings) < len(scores):
+                        candidates = postings.iteritems()
+                    else:
+                        candidates = ((deck_id, postings[deck_id]) for deck_id in scores if deck_id in postings)
+                    for deck_id, weight in candidates:
+                        if scores is None or deck_id in scores:
+                            matched[deck_id] = max(matched.get(deck_id, 0.0), weight * rarity)
+                if scores is None:
+                    scores = matched
+                else:
+                    scores = dict((deck_id, scores[deck_id] + score) for deck_id, score in matched.iteritems())
+                if not scores:
+                    break
+            scores = scores or {}
+
+            facets = { 'deck_type' : {}, 'price' : {} }
+            found = []
+            for deck_id, score in scores.items():
+                deck = self.decks[deck_id]
+                if deck.data is None:
+                    # cards indexed before the deck itself
+                    continue
+                facets['deck_type'][deck.deck_type] = facets['deck_type'].get(deck.deck_type, 0) + 1
+                bucket = priceBucket(deck.price)
+                facets['price'][bucket] = facets['price'].get(bucket, 0) + 1
+                if deck_type is not None and deck.deck_type != deck_type:
+                    continue
+                if (min_price is not None and deck.price < min_price) or (max_price is not None and deck.price > max_price):
+                    continue
+                found.append((score, deck))
+
+            ranked = heapq.nlargest(limit, found, key=lambda item: (item[0], item[1].title))
+            results = []
+            for score, deck in ranked:
+                result = dict(deck.data)
+                result['score'] = round(score, 4)
+                results.append(result)
+
+            self.searches += 1
+            self.seconds += time.time() - started
+            return { 'results' : results, 'total' : len(found), 'facets' : facets }
+
+    def load(self, other):
+        '''
+            Takes over the contents of a freshly built index.
+        '''
+        with self.lock:
+            self.decks, self.postings, self.words = other.decks, other.postings, other.words
+            self.built = time.time()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'decks' : len(self.decks),
+                'words' : len(self.words),
+                'built' : self.built,
+                'searches' : self.searches,
+                'mean_ms' : self.seconds / self.searches * 1000.0 if self.searches else 0.0
+            }
+
+index = DeckIndex()
+
+'''
+    Builds a new index from every deck and card in Cassandra.
+'''
+def buildIndex():
+    from rememerme.marketplace.models import Deck, DeckCard
+    from rememerme.marketplace.loaders import getByIDs
+
+    page_size = settings.DECK_SEARCH['BUILD_PAGE_SIZE']
+    fresh = DeckIndex()
+    for deck_type, model in CARD_MODELS.items():
+        cursor = None
+        while True:
+            decks, cursor = Deck.filterByType(deck_type, page_size, cursor)
+            for deck in decks:
+                fresh.addDeck(deck)
+                for card_ids in DeckCard.iterByDeck(deck.deck_id, page_size):
+                    cards = getByIDs(model, card_ids, skip_missing=True)
+                    fresh.addCards(deck.deck_id, dict((getattr(card, CARD_KEYS[deck_type]), getattr(card, 'term', ''))
+                                                      for card in cards))
+            if cursor is None:
+                break
+    return fresh
+
+_rebuilding = threading.Lock()
+
+'''
+    Rebuilds the index of this process. The writes made while the catalog
+    is read are applied to the new index before it is used.
+
+    @param force: Whether to rebuild an index that was already built
+'''
+def rebuild(force=True):
+    with _rebuilding:
+        if not force and index.built is not None:
+            return
+        with index.lock:
+            index.building = True
+            index.pending = []
+        try:
+            fresh = buildIndex()
+            with index.lock:
+                for name, args in index.pending:
+                    getattr(fresh, '_' + name)(*args)
+                index.load(fresh)
+        finally:
+            with index.lock:
+                index.building = False
+                index.pending = []
+
+'''
+    Rebuilds the index in the background if it is older than REFRESH_SECONDS.
+'''
+def refresh():
+    built = index.built
+    if built is None or time.time() - built < settings.DECK_SEARCH['REFRESH_SECONDS'] or _rebuilding.locked():
+        return
+    thread = threading.Thread(target=rebuild)
+    thread.daemon = True
+    thread.start()
+
+'''
+    Builds the index in the background, e.g. when a worker starts.
+'''
+def warm():
+    thread = threading.Thread(target=rebuild, args=(False,))
+    thread.daemon = True
+    thread.start()
+
+'''
+    Searches the index of this process. The first search waits for the
+    index to be built.
+
+    @return: The results of DeckIndex.search
+'''
+def search(query, **filters):
+    if index.built is None:
+        rebuild(force=False)
+    else:
+        refresh()
+    return index.search(query, **filters)
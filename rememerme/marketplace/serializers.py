@@ -0,0 +1,18 @@
+from rest_framework import serializers
+
+class DeckSerializer(serializers.Serializer):
+    deck_id = serializers.CharField()
+    deck_type = serializers.CharField()
+    title = serializers.CharField()
+    description = serializers.CharField()
+    tags = serializers.Field()
+    price = serializers.IntegerField()
+    date_created = serializers.Field()
+    last_modified = serializers.Field()
+
+class PurchaseSerializer(serializers.Serializer):
+    purchase_id = serializers.CharField()
+    user_id = serializers.CharField()
+    deck_id = serializers.CharField()
+    price = serializers.IntegerField()
+    date_created = serializers.Field()
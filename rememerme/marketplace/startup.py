@@ -0,0 +1,164 @@
+'''
+    Starting a worker.
+
+    warm loads the middleware and the URL confs of the routes every worker
+    serves when the WSGI app is made, so the first request doesn't pay for
+    them, and starts building the deck search index and loading the best
+    sellers in the background. With STARTUP['LAZY'] set the URL confs of
+    LAZY_URLCONFS (the monitoring routes) are left to Django, which imports
+    an include the first time a request is routed into it. Swagger is never imported at
+    startup either: Django only imports an installed app when its templates
+    or static files are first looked up.
+
+    The import time of each module of the WSGI app is measured in a new
+    interpreter by running this module, so nothing is already imported.
+
+    @author: Andrew Oberlin, Jake Gregg
+'''
+import json
+import os
+import subprocess
+import sys
+import time
+
+'''
+    Loads the middleware of the WSGI app and the URL confs it will route to.
+
+    @param application: The WSGIHandler
+'''
+def warm(application):
+    from django.conf import settings
+    from django.core.urlresolvers import get_resolver, RegexURLResolver
+
+    application.load_middleware()
+    config = settings.STARTUP
+    lazy = config['LAZY_URLCONFS'] if config['LAZY'] else ()
+    for pattern in get_resolver(None).url_patterns:
+        if isinstance(pattern, RegexURLResolver) and pattern.urlconf_name not in lazy:
+            pattern.url_patterns
+
+    if settings.DECK_SEARCH['BUILD_AT_STARTUP']:
+        from rememerme.marketplace import search
+        search.warm()
+    if settings.LEADERBOARD['LOAD_AT_STARTUP']:
+        from rememerme.marketplace import leaderboard
+        leaderboard.warm()
+
+class ImportProfiler(object):
+    '''
+        Times every module imported while it is installed. Each module is
+        charged with the time of the import statement that loaded it, and
+        its self time leaves out the imports it made itself.
+    '''
+
+    def __init__(self):
+        self.modules = {}
+        self.stack = []
+        self.original = None
+
+    def install(self):
+        import __builtin__
+        self.original = __builtin__.__import__
+        __builtin__.__import__ = self.load
+
+    def uninstall(self):
+        import __builtin__
+        __builtin__.__import__ = self.original
+
+    def candidates(self, name, globals, fromlist, level):
+        '''
+            Gets the names of the modules an import statement can load.
+        '''
+        prefixes = [''] if level <= 0 else []
+        if level != 0 and globals and globals.get('__name__'):
+            package = globals['__name__'] if '__path__' in globals else globals['__name__'].rpartition('.')[0]
+            for _ in range(level - 1):
+                package = package.rpartition('.')[0]
+            if package:
+                prefixes.append(package + '.')
+        found = []
+        for prefix in prefixes:
+            full = (prefix + name) if name else prefix[:-1]
+            if full:
+                found.append(full)
+                found.extend(full + '.' + item for item in fromlist or () if item != '*')
+        return found
+
+    def load(self, name, globals=None, locals=None, fromlist=None, level=-1):
+        candidates = self.candidates(name, globals, fromlist, level)
+        # a module being imported is already in sys.modules while it runs
+        loading = [module for module in candidates if module not in sys.modules]
+        self.stack.append(0.0)
+        start = time.time()
+        try:
+            return self.original(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.time() - start
+            nested = self.stack.pop()
+            if self.stack:
+                self.stack[-1] += elapsed
+            loaded = [module for module in loading if sys.modules.get(module) is not None]
+            if loaded:
+                self.modules[max(loaded, key=len)] = {
+                    'cumulative_ms' : elapsed * 1000.0,
+                    'self_ms' : (elapsed - nested) * 1000.0
+                }
+
+'''
+    Imports a module with every import timed, and times the first request
+    made to it if asked. Run in a new interpreter by measure.
+
+    @param module: The module making the WSGI app, e.g. config.wsgi
+    @param prewarm: Whether the Cassandra pool is opened like in production
+    @param lazy: Overrides STARTUP['LAZY'], or None to keep it
+    @param first_request: A path to request once the module is imported
+    @return: The report
+'''
+def probe(module, prewarm=False, lazy=None, first_request=None):
+    profiler = ImportProfiler()
+    start = time.time()
+    profiler.install()
+    try:
+        from django.conf import settings
+        settings.CASSANDRA_POOL['PREWARM'] = prewarm
+        if lazy is not None:
+            settings.STARTUP['LAZY'] = lazy
+        __import__(module)
+    finally:
+        profiler.uninstall()
+    seconds = time.time() - start
+
+    report = {
+        'module' : module,
+        'lazy' : settings.STARTUP['LAZY'],
+        'seconds' : seconds,
+        'target_seconds' : settings.STARTUP['TARGET_SECONDS'],
+        'modules' : profiler.modules
+    }
+    if first_request:
+        from django.test.client import Client
+        start = time.time()
+        response = Client().get(first_request)
+        report['first_request'] = {
+            'path' : first_request,
+            'status' : response.status_code,
+            'seconds' : time.time() - start
+        }
+    return report
+
+'''
+    Measures the startup of a module in a new interpreter.
+
+    @return: The report of probe
+'''
+def measure(module='config.wsgi', prewarm=False, lazy=None, first_request=None):
+    from django.conf import settings
+    options = { 'module' : module, 'prewarm' : prewarm, 'lazy' : lazy, 'first_request' : first_request }
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'config.settings'))
+    output = subprocess.check_output([sys.executable, '-m', __name__, json.dumps(options)],
+                                     cwd=settings.BASE_DIR, env=env)
+    return json.loads(output)
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.getcwd())
+    sys.stdout.write(json.dumps(probe(**json.loads(sys.argv[1]))))
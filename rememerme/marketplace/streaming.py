@@ -0,0 +1,136 @@
+'''
+    Streaming responses for listings too large to build in memory.
+
+    Exports are written a line at a time, as NDJSON or CSV, and every line
+    carries the cursor of its row so a dropped export can be resumed after
+    the last line received.
+
+    @author: Andrew Oberlin, Jake Gregg
+'''
+from rest_framework.utils.encoders import JSONEncoder
+from rememerme.marketplace.loaders import getByIDs, getPage
+from rememerme.marketplace.models import DeckCard, Purchase
+from config.util import encodeCursor
+import csv
+import json
+
+EXPORT_FORMATS = { 'ndjson' : 'application/x-ndjson', 'csv' : 'text/csv' }
+
+# the columns of a purchase export
+PURCHASE_FIELDS = ('purchase_id', 'user_id', 'deck_id', 'price', 'date_created')
+
+'''
+    Encodes pages of items as one JSON list, a page at a time.
+
+    @param pages: Iterates over lists of serialized items
+    @return: The pieces of the JSON document
+'''
+def streamJSON(pages):
+    encoder = JSONEncoder()
+    yield '['
+    first = True
+    for page in pages:
+        if not page:
+            continue
+        body = ','.join(encoder.encode(item) for item in page)
+        yield body if first else ',' + body
+        first = False
+    yield ']'
+
+'''
+    Iterates over the cards of a deck a page at a time, reading each page
+    of the deck_cards index and loading its cards with one multiget.
+
+    @param model: The card model
+    @param serialize: Turns a list of cards into a list of maps
+    @param page_size: The number of cards read per page
+    @return: Lists of serialized cards
+'''
+def streamCards(model, deck_id, serialize, page_size):
+    for card_ids in DeckCard.iterByDeck(deck_id, page_size):
+        yield serialize(getByIDs(model, card_ids, skip_missing=True))
+
+'''
+    Iterates over the purchases of a user, oldest first, reading the
+    user_purchases index a page at a time.
+
+    @param since: Only purchases made at or after this datetime
+    @param until: Only purchases made before this datetime
+    @param cursor: The position of the last purchase already exported
+    @return: Tuples of the position of each purchase and the purchase
+'''
+def userPurchases(user_id, since=None, until=None, cursor=None, page_size=500):
+    # index columns are named by the time of the purchase first
+    column_start = since.isoformat() if since else ''
+    column_finish = until.isoformat() if until else ''
+    while True:
+        columns, next_cursor = getPage(Purchase.user_index, user_id, page_size, cursor,
+                                       column_start=column_start, column_finish=column_finish)
+        positions = dict((purchase_id, name) for name, purchase_id in columns)
+        for purchase in getByIDs(Purchase, [purchase_id for _, purchase_id in columns], skip_missing=True):
+            yield positions[purchase.purchase_id], purchase
+        if next_cursor is None:
+            return
+        cursor = next_cursor
+
+'''
+    Iterates over every purchase in the store in row order, reading the
+    purchase column family a page at a time.
+
+    @param since: Only purchases made at or after this datetime
+    @param until: Only purchases made before this datetime
+    @param cursor: The row key of the last purchase already exported
+    @return: Tuples of the position of each purchase and the purchase
+'''
+def allPurchases(since=None, until=None, cursor=None, page_size=500):
+    since = since.isoformat() if since else None
+    until = until.isoformat() if until else None
+    for key, columns in Purchase.table.get_range(start=cursor or '', buffer_size=page_size):
+        # the range starts with the row it was resumed after
+        if key == cursor:
+            continue
+        purchase = Purchase.fromCassa((key, columns))
+        if (since and purchase.date_created < since) or (until and purchase.date_created >= until):
+            continue
+        yield key, purchase
+
+class _Line(object):
+    '''
+        Hands back what a csv writer writes to it instead of keeping it.
+    '''
+
+    def write(self, value):
+        return value
+
+'''
+    Encodes items as NDJSON, one object per line with its cursor.
+
+    @param rows: Tuples of the position of each item and the item as a map
+'''
+def streamNDJSON(rows):
+    encoder = JSONEncoder()
+    for position, item in rows:
+        yield encoder.encode(dict(item, cursor=encodeCursor(position))) + '\n'
+
+'''
+    Encodes items as CSV with a header line, the cursor of each row last.
+
+    @param rows: Tuples of the position of each item and the item as a map
+    @param fields: The keys of each item written, in order
+'''
+def streamCSV(rows, fields):
+    writer = csv.writer(_Line())
+    yield writer.writerow(list(fields) + ['cursor'])
+    for position, item in rows:
+        values = [item.get(field) for field in fields]
+        values = [value.encode('utf-8') if isinstance(value, unicode) else '' if value is None else value
+                  for value in values]
+        yield writer.writerow(values + [encodeCursor(position)])
+
+'''
+    Encodes exported items in one of EXPORT_FORMATS.
+'''
+def streamExport(rows, format, fields):
+    if format == 'csv':
+        return streamCSV(rows, fields)
+    return streamNDJSON(rows)
@@ -0,0 +1,298 @@
+'''
+    In-memory stand-ins for the pycassa column families so the forms and
+    data-access helpers can be exercised and benchmarked without a
+    Cassandra cluster.
+
+    @author: Andrew Oberlin, Jake Gregg
+'''
+from pycassa.cassandra.ttypes import NotFoundException
+from rememerme.marketplace.unitofwork import intercept
+from collections import OrderedDict
+import random
+import threading
+import time
+import uuid
+
+class MemoryColumnFamily(object):
+    '''
+        A column family held in a dict of sorted column maps. Every call that
+        would be a round trip to Cassandra is counted in calls and can be
+        slowed down with latency (in seconds) to mimic the network.
+    '''
+    
+    def __init__(self, column_family, latency=0.0):
+        self.column_family = column_family
+        self.latency = latency
+        self.calls = 0
+        self.rows = {}
+        self.lock = threading.RLock()
+    
+    def _round_trip(self):
+        with self.lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+    
+    def _slice(self, key, columns=None, column_start='', column_finish='',
+               column_reversed=False, column_count=100):
+        row = self.rows.get(key)
+        if not row:
+            return OrderedDict()
+        
+        if columns is not None:
+            return OrderedDict((c, row[c]) for c in columns if c in row)
+        
+        names = sorted(row.keys(), reverse=column_reversed)
+        result = OrderedDict()
+        for name in names:
+            if column_start and (name > column_start if column_reversed else name < column_start):
+                continue
+            if column_finish and (name < column_finish if column_reversed else name > column_finish):
+                break
+            result[name] = row[name]
+            if column_count is not None and len(result) >= column_count:
+                break
+        return result
+    
+    def get(self, key, columns=None, column_start='', column_finish='',
+            column_reversed=False, column_count=100, **kwargs):
+        self._round_trip()
+        with self.lock:
+            result = self._slice(key, columns, column_start, column_finish,
+                                 column_reversed, column_count)
+        if not result:
+            raise NotFoundException()
+        return result
+    
+    def multiget(self, keys, columns=None, column_start='', column_finish='',
+                 column_reversed=False, column_count=100, buffer_size=1024, **kwargs):
+        keys = list(keys)
+        result = OrderedDict()
+        for i in range(0, len(keys), buffer_size):
+            self._round_trip()
+            with self.lock:
+                for key in keys[i:i + buffer_size]:
+                    row = self._slice(key, columns, column_start, column_finish,
+                                      column_reversed, column_count)
+                    if row:
+                        result[key] = row
+        return result
+    
+    def xget(self, key, column_start='', column_finish='', column_reversed=False,
+             count=None, buffer_size=1024, **kwargs):
+        returned = 0
+        first = True
+        while True:
+            self._round_trip()
+            with self.lock:
+                page = self._slice(key, None, column_start, column_finish,
+                                   column_reversed, buffer_size + (0 if first else 1))
+            names = list(page.keys())
+            # the start column of a later page was the last one yielded
+            if not first and names and names[0] == column_start:
+                names = names[1:]
+            for name in names:
+                yield name, page[name]
+                returned += 1
+                if count is not None and returned >= count:
+                    return
+            if len(names) < buffer_size:
+                return
+            column_start = names[-1]
+            first = False
+    
+    def find(self, column, value):
+        '''
+            Gets the rows whose column has the value, as one round trip like a
+            secondary index query.
+        '''
+        self._round_trip()
+        with self.lock:
+            return [(key, dict(row)) for key, row in self.rows.items()
+                    if column in row and str(row[column]) == str(value)]
+    
+    def get_count(self, key, **kwargs):
+        self._round_trip()
+        with self.lock:
+            return len(self.rows.get(key, {}))
+    
+    def get_range(self, start='', finish='', columns=None, buffer_size=1024, **kwargs):
+        with self.lock:
+            # sorted keys stand in for the token order of the ring
+            keys = [key for key in sorted(self.rows.keys()) if key >= start]
+        for i in range(0, len(keys), buffer_size):
+            self._round_trip()
+            for key in keys[i:i + buffer_size]:
+                with self.lock:
+                    row = self._slice(key, columns, column_count=None)
+                if row:
+                    yield key, row
+    
+    def insert(self, key, columns, **kwargs):
+        self._round_trip()
+        with self.lock:
+            self.rows.setdefault(key, {}).update(columns)
+    
+    def add(self, key, column, value=1, **kwargs):
+        self._round_trip()
+        with self.lock:
+            row = self.rows.setdefault(key, {})
+            row[column] = row.get(column, 0) + value
+    
+    def cas(self, key, expected, updates):
+        self._round_trip()
+        with self.lock:
+            row = self.rows.get(key, {})
+            current = dict((name, row[name]) for name in expected if name in row)
+            if any(current.get(name) != value for name, value in expected.items()):
+                return False, current
+            self.rows.setdefault(key, {}).update(updates)
+            return True, {}
+    
+    def batch(self, queue_size=100):
+        return MemoryBatch(self, queue_size)
+    
+    def remove(self, key, columns=None, **kwargs):
+        self._round_trip()
+        with self.lock:
+            if columns is None:
+                self.rows.pop(key, None)
+                return
+            row = self.rows.get(key, {})
+            for column in columns:
+                row.pop(column, None)
+            if not row:
+                self.rows.pop(key, None)
+
+class MemoryBatch(object):
+    '''
+        Queues inserts and removes like a pycassa CfMutator and applies each
+        full queue as one round trip.
+    '''
+    
+    def __init__(self, column_family, queue_size):
+        self.column_family = column_family
+        self.queue_size = queue_size
+        self.queue = []
+    
+    def insert(self, key, columns, **kwargs):
+        self.queue.append((key, columns))
+        if len(self.queue) >= self.queue_size:
+            self.send()
+    
+    def remove(self, key, columns=None, **kwargs):
+        # a remove is queued as the column names, or None for the whole row
+        self.queue.append((key, list(columns) if columns is not None else None))
+        if len(self.queue) >= self.queue_size:
+            self.send()
+    
+    def send(self):
+        if not self.queue:
+            return
+        cf = self.column_family
+        cf._round_trip()
+        with cf.lock:
+            for key, columns in self.queue:
+                if isinstance(columns, dict):
+                    cf.rows.setdefault(key, {}).update(columns)
+                    continue
+                row = cf.rows.get(key, {})
+                for column in columns if columns is not None else list(row):
+                    row.pop(column, None)
+                if not row:
+                    cf.rows.pop(key, None)
+        self.queue = []
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, typ, val, tb):
+        if not typ:
+            self.send()
+
+'''
+    Builds a model class in the style of rememerme.games.models backed by
+    a MemoryColumnFamily. The model keeps every column as an attribute.
+
+    @param name: The class name and column family name
+    @param key: The attribute the row key is stored under
+    @param latency: Simulated latency in seconds of each round trip
+    @param filters: Map of the name of a filter class method (e.g.
+        filterByGame) to the attribute it matches (e.g. game_id)
+'''
+def memory_model(name, key, latency=0.0, filters=None):
+    table = MemoryColumnFamily(name, latency=latency)
+    
+    def __init__(self, **kwargs):
+        for attr, value in kwargs.items():
+            setattr(self, attr, value)
+    
+    def fromMap(cls, mapRep):
+        return cls(**mapRep)
+    
+    def fromCassa(cls, cassRep):
+        mapRep = dict(cassRep[1])
+        mapRep[key] = str(cassRep[0])
+        return cls.fromMap(mapRep)
+    
+    def getByID(cls, row_key):
+        return cls.fromCassa((str(row_key), cls.table.get(str(row_key))))
+    
+    def save(self):
+        # a new row gets its id when saved, as with the models of the games package
+        if getattr(self, key, None) is None:
+            setattr(self, key, str(uuid.uuid1()))
+        columns = dict((attr, value) for attr, value in self.__dict__.items() if attr != key)
+        self.table.insert(str(getattr(self, key)), columns)
+    
+    def getRandom(cls, *args, **kwargs):
+        with cls.table.lock:
+            row_key = random.choice(list(cls.table.rows.keys()))
+        return cls.getByID(row_key)
+    
+    def makeFilter(attr):
+        def filterBy(cls, value):
+            return [cls.fromCassa(row) for row in cls.table.find(attr, value)]
+        return classmethod(filterBy)
+    
+    attrs = {
+        'table' : table,
+        '__init__' : __init__,
+        'fromMap' : classmethod(fromMap),
+        'fromCassa' : classmethod(fromCassa),
+        'getByID' : classmethod(getByID),
+        'getRandom' : classmethod(getRandom),
+        'save' : save
+    }
+    for method, attr in (filters or {}).items():
+        attrs[method] = makeFilter(attr)
+    return type(name, (object,), attrs)
+
+class MemoryManager(object):
+    '''
+        Stands in for rememerme.marketplace.pool.ConnectionManager, handing out
+        MemoryColumnFamily instances. Install it with pool.setManager.
+    '''
+    
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.column_families = {}
+        self.lock = threading.Lock()
+    
+    def columnFamily(self, name):
+        with self.lock:
+            if name not in self.column_families:
+                self.column_families[name] = MemoryColumnFamily(name, latency=self.latency)
+            return self.column_families[name]
+    
+    def calls(self):
+        return sum(cf.calls for cf in self.column_families.values())
+    
+    def prewarm(self):
+        pass
+    
+    def stats(self):
+        return { 'strategy' : 'memory', 'nodes' : [] }
+
+# inserts made inside a UnitOfWork are queued just like pycassa's
+intercept(MemoryColumnFamily)
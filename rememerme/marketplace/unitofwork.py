@@ -0,0 +1,232 @@
+'''
+    Writes the rows made by one request in batches instead of one at a time.
+
+    Inside a UnitOfWork every insert and remove a model makes on this
+    thread is queued instead of sent. When the block ends they are written,
+    in the order they were made, in batch mutations of at most MAX_ROWS rows
+    and MAX_BYTES bytes. Rows of column families on the same connection
+    pool share a batch, so a game and all of its members are one round
+    trip. Counter adds can't go in a batch, so they are made once the
+    batches are written. A compare-and-set has to be answered right away
+    and is refused inside a unit. If the block raises nothing is written.
+    Reads inside the block don't see the queued rows.
+
+    @author: Andrew Oberlin, Jake Gregg
+'''
+from django.conf import settings
+from pycassa.batch import Mutator
+from pycassa.columnfamily import ColumnFamily
+from rememerme.marketplace import metrics
+from rememerme.marketplace.pool import ManagedColumnFamily
+from collections import OrderedDict
+import functools
+import threading
+
+_local = threading.local()
+
+'''
+    Gets the unit of work open on this thread, if any.
+'''
+def current():
+    return getattr(_local, 'unit', None)
+
+INSERT = 'insert'
+REMOVE = 'remove'
+
+'''
+    Estimates the bytes a row adds to a batch.
+
+    @param columns: The map of an insert or the column names of a remove
+        (None for the whole row)
+'''
+def rowSize(key, columns):
+    if not isinstance(columns, dict):
+        return len(str(key)) + sum(len(str(name)) for name in columns or ())
+    return len(str(key)) + sum(len(str(name)) + len(str(value)) for name, value in columns.items())
+
+'''
+    Works out how rows of a table are batched.
+
+    @return: A tuple of the key of the batch the rows go in, a function
+        making an empty batch and a function adding an insert or remove to one
+'''
+def batchTarget(table, atomic):
+    if isinstance(table, ManagedColumnFamily):
+        table = table.nodeColumnFamily()
+
+    if isinstance(table, ColumnFamily):
+        def make(queue_size):
+            return Mutator(table.pool, queue_size=queue_size, atomic=atomic)
+        def put(mutator, op, key, columns, kwargs):
+            if op == REMOVE:
+                mutator.remove(table, key, columns=columns, **kwargs)
+            else:
+                mutator.insert(table, key, columns, **kwargs)
+        return ('pool', id(table.pool)), make, put
+
+    # anything else with a batch, e.g. the in-memory column families
+    def make(queue_size):
+        return table.batch(queue_size=queue_size)
+    def put(mutator, op, key, columns, kwargs):
+        if op == REMOVE:
+            mutator.remove(key, columns=columns, **kwargs)
+        else:
+            mutator.insert(key, columns, **kwargs)
+    return ('table', id(table)), make, put
+
+class UnitOfWork(object):
+    '''
+        Collects the rows written inside a with block and writes them in
+        batches when it ends. A unit opened inside another is written with
+        the outer one.
+    '''
+
+    def __init__(self, max_rows=None, max_bytes=None, atomic=None):
+        config = settings.UNIT_OF_WORK
+        self.max_rows = max_rows or config['MAX_ROWS']
+        self.max_bytes = max_bytes or config['MAX_BYTES']
+        self.atomic = config['ATOMIC'] if atomic is None else atomic
+        self.rows = []
+        self.callbacks = []
+        self.batches = 0
+        self.previous = None
+
+    def add(self, op, table, key, columns, kwargs):
+        self.rows.append((op, table, key, columns, kwargs))
+
+    def __enter__(self):
+        self.previous = current()
+        _local.unit = self
+        return self
+
+    def __exit__(self, typ, val, tb):
+        _local.unit = self.previous
+        rows, self.rows = self.rows, []
+        callbacks, self.callbacks = self.callbacks, []
+        if typ is not None:
+            return False
+
+        if self.previous is not None:
+            self.previous.rows.extend(rows)
+            self.previous.callbacks.extend(callbacks)
+            return False
+
+        self.flush(rows)
+        for callback in callbacks:
+            callback()
+        return False
+
+    def flush(self, rows):
+        '''
+            Writes the rows, splitting each batch by row count and size.
+        '''
+        groups = OrderedDict()
+        for op, table, key, columns, kwargs in rows:
+            group, make, put = batchTarget(table, self.atomic)
+            if group not in groups:
+                groups[group] = (make, [])
+            groups[group][1].append((put, op, key, columns, kwargs))
+
+        for make, entries in groups.values():
+            batch, size, count = None, 0, 0
+            for put, op, key, columns, kwargs in entries:
+                row_size = rowSize(key, columns)
+                if batch is not None and (count >= self.max_rows or size + row_size > self.max_bytes):
+                    self.send(batch)
+                    batch = None
+                if batch is None:
+                    # the queue never fills on its own so the batches are split here
+                    batch, size, count = make(self.max_rows + 1), 0, 0
+                put(batch, op, key, columns, kwargs)
+                size += row_size
+                count += 1
+            if batch is not None:
+                self.send(batch)
+
+    def send(self, batch):
+        batch.send()
+        self.batches += 1
+
+'''
+    Runs fn once the rows of the open unit of work are written, or right
+    away if there is none. Used to drop caches of what is being written.
+'''
+def afterWrite(fn):
+    unit = current()
+    if unit is None:
+        fn()
+    else:
+        unit.callbacks.append(fn)
+
+'''
+    Wraps the insert of a table class so that inside a unit of work the row
+    is queued instead of written.
+'''
+def deferrable(insert):
+    @functools.wraps(insert)
+    def wrapper(self, key, columns, timestamp=None, ttl=None, **kwargs):
+        unit = current()
+        if unit is None:
+            return insert(self, key, columns, timestamp=timestamp, ttl=ttl, **kwargs)
+        options = dict((name, value) for name, value in (('timestamp', timestamp), ('ttl', ttl)) if value is not None)
+        unit.add(INSERT, self, key, columns, options)
+        return metrics.DEFERRED
+    return wrapper
+
+'''
+    Wraps the remove of a table class so that inside a unit of work it is
+    queued behind the inserts made before it.
+'''
+def deferrableRemove(remove):
+    @functools.wraps(remove)
+    def wrapper(self, key, columns=None, timestamp=None, **kwargs):
+        unit = current()
+        if unit is None:
+            return remove(self, key, columns=columns, timestamp=timestamp, **kwargs)
+        options = { 'timestamp' : timestamp } if timestamp is not None else {}
+        unit.add(REMOVE, self, key, list(columns) if columns is not None else None, options)
+        return metrics.DEFERRED
+    return wrapper
+
+'''
+    Wraps the counter add of a table class so that inside a unit of work it
+    is made once the batches are written.
+'''
+def deferrableAdd(add):
+    @functools.wraps(add)
+    def wrapper(self, *args, **kwargs):
+        unit = current()
+        if unit is None:
+            return add(self, *args, **kwargs)
+        unit.callbacks.append(lambda: add(self, *args, **kwargs))
+        return metrics.DEFERRED
+    return wrapper
+
+'''
+    Wraps the compare-and-set of a table class so that it can't be made
+    inside a unit of work, where it would overtake the queued rows.
+'''
+def immediate(cas):
+    @functools.wraps(cas)
+    def wrapper(self, *args, **kwargs):
+        if current() is not None:
+            raise RuntimeError('A compare-and-set can not be made inside a UnitOfWork')
+        return cas(self, *args, **kwargs)
+    return wrapper
+
+'''
+    Makes the writes of a table class deferrable. Doing it twice does nothing.
+'''
+def intercept(cls):
+    if cls.__dict__.get('_deferrable'):
+        return
+    cls.insert = deferrable(cls.insert)
+    cls.remove = deferrableRemove(cls.remove)
+    if hasattr(cls, 'add'):
+        cls.add = deferrableAdd(cls.add)
+    if hasattr(cls, 'cas'):
+        cls.cas = immediate(cls.cas)
+    cls._deferrable = True
+
+intercept(ColumnFamily)
+intercept(ManagedColumnFamily)
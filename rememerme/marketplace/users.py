@@ -0,0 +1,84 @@
+'''
+    Checks with the users service that users exist, many at a time.
+
+    Lookups that miss the cache run concurrently on a thread pool shared by
+    the process. Users that exist are remembered for TTL seconds and users
+    that don't for NEGATIVE_TTL seconds, so a new account shows up quickly.
+
+    @author: Andrew Oberlin, Jake Gregg
+'''
+from django.conf import settings
+from multiprocessing.pool import ThreadPool
+from rememerme.marketplace.cache import LRUCache
+from rememerme.users.client import UserClient, UserClientError
+import threading
+
+found = LRUCache(settings.USER_LOOKUP['CACHE_SIZE'], settings.USER_LOOKUP['TTL'])
+missing = LRUCache(settings.USER_LOOKUP['CACHE_SIZE'], settings.USER_LOOKUP['NEGATIVE_TTL'])
+
+_pool = None
+_pool_lock = threading.Lock()
+
+'''
+    Gets the thread pool the lookups run on, starting it on first use.
+'''
+def getPool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPool(settings.USER_LOOKUP['THREADS'])
+    return _pool
+
+'''
+    Asks the users service whether a single user exists.
+
+    @param lookup: Gets the user, raising UserClientError if it doesn't exist
+'''
+def userExists(lookup, user_id):
+    try:
+        lookup(user_id)
+        return True
+    except UserClientError:
+        return False
+
+'''
+    Finds which of the users exist.
+
+    @param auth: The auth of the request, passed on to the users service
+    @param user_ids: The ids of the users as strings
+    @param lookup: Gets a user by id, defaulting to the users service client
+    @return: The set of the ids of the users that exist
+'''
+def existingUsers(auth, user_ids, lookup=None):
+    lookup = lookup or (lambda user_id: UserClient(auth).get(user_id))
+
+    existing = set()
+    unknown = []
+    for user_id in set(user_ids):
+        if found.get(user_id):
+            existing.add(user_id)
+        elif not missing.get(user_id):
+            unknown.append(user_id)
+
+    if len(unknown) == 1:
+        results = [userExists(lookup, unknown[0])]
+    elif unknown:
+        results = getPool().map(lambda user_id: userExists(lookup, user_id), unknown)
+    else:
+        results = []
+
+    for user_id, exists in zip(unknown, results):
+        if exists:
+            found.set(user_id, True)
+            existing.add(user_id)
+        else:
+            missing.set(user_id, True)
+    return existing
+
+'''
+    Forgets what is known about a user, e.g. when the account is deleted.
+'''
+def forget(user_id):
+    found.delete(str(user_id))
+    missing.delete(str(user_id))